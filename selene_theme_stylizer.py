@@ -4,18 +4,21 @@ from PyQt6.QtWidgets import (
     QSpinBox, QTextEdit, QSplitter, QFileDialog, QMessageBox, QTabWidget,
     QGroupBox, QGridLayout, QScrollArea, QFrame, QButtonGroup, QRadioButton,
     QListWidget, QListWidgetItem, QTreeWidget, QTreeWidgetItem, QToolButton,
-    QMenu, QAction, QSpacerItem, QSizePolicy, QProgressBar, QDial, QDoubleSpinBox
+    QMenu, QSpacerItem, QSizePolicy, QProgressBar, QDial, QDoubleSpinBox,
+    QListView, QStyledItemDelegate, QStyle, QTableView, QAbstractItemView
 )
 from PyQt6.QtGui import (
-    QColor, QFont, QPainter, QPen, QBrush, QFontDatabase, QPixmap, QPainterPath,
+    QGuiApplication, QColor, QFont, QPainter, QPen, QBrush, QFontDatabase, QPixmap, QPainterPath,
     QLinearGradient, QRadialGradient, QConicalGradient, QPolygonF, QPainterPathStroker,
-    QTransform, QIcon, QKeySequence, QAction as QGuiAction, QPalette, QFontMetrics,
-    QTextOption, QTextDocument, QTextCursor, QTextCharFormat
+    QTransform, QIcon, QKeySequence, QAction, QPalette, QFontMetrics, QImage,
+    QTextOption, QTextDocument, QTextCursor, QTextCharFormat, QRegion, QPaintEngine
 )
 from PyQt6.QtCore import (
-    Qt, QRect, QRectF, QPointF, QSizeF, QTimer, QPropertyAnimation, QEasingCurve,
+    Qt, QRect, QRectF, QPointF, QLineF, QSizeF, QTimer, QPropertyAnimation, QEasingCurve,
     QSequentialAnimationGroup, QParallelAnimationGroup, pyqtSignal, QObject,
-    QThread, QMutex, QSettings, QStandardPaths, QDir, QUrl, QMimeData, QIODevice
+    QThread, QMutex, QSettings, QStandardPaths, QDir, QUrl, QMimeData, QIODevice,
+    QAbstractListModel, QAbstractTableModel, QModelIndex, QSortFilterProxyModel, QRunnable, QThreadPool, QSize,
+    QLockFile, QBuffer
 )
 import sys
 import os
@@ -24,12 +27,34 @@ import logging
 import json
 import math
 import random
-from typing import Optional, List, Dict, Any, Tuple, Union, Callable
-from dataclasses import dataclass, asdict
+import bisect
+import time
+import argparse
+import hashlib
+import io
+import queue
+import struct
+import mmap
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from typing import Optional, List, Dict, Any, Tuple, Union, Callable, Iterator, Mapping
+from types import MappingProxyType
+from dataclasses import dataclass, asdict, field
+from contextlib import contextmanager
+from functools import cached_property
 from enum import Enum, auto
 from pathlib import Path
+from fractions import Fraction
+from array import array
 import xml.etree.ElementTree as ET
 
+try:
+    import numpy
+except ImportError:  # Optional; bulk layer edits fall back to plain loops
+    numpy = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -46,6 +71,11 @@ PREVIEW_HEIGHT = 600
 CANVAS_WIDTH = 1200
 CANVAS_HEIGHT = 800
 
+# Default shape geometry (overridable per shape via custom_properties)
+DEFAULT_POLYGON_SIDES = 6
+DEFAULT_STAR_POINTS = 5
+DEFAULT_STAR_INNER_RATIO = 0.4
+
 # System font directories
 SYSTEM_FONT_PATHS = {
     'Windows': [
@@ -65,6 +95,8 @@ SYSTEM_FONT_PATHS = {
     ]
 }
 
+FONT_EXTENSIONS = ('.ttf', '.otf', '.woff', '.woff2')
+
 # Enums and Data Classes
 class ShapeType(Enum):
     RECTANGLE = auto()
@@ -112,24 +144,322 @@ class GradientData:
     radius: float
     angle: float
     stops: List[ColorStop]
+    
+    def cache_key(self) -> Tuple:
+        """Hashable value key describing the gradient."""
+        return (
+            self.type, self.start_point.x(), self.start_point.y(),
+            self.end_point.x(), self.end_point.y(), self.radius, self.angle,
+            tuple((stop.position, stop.color.rgba()) for stop in self.stops)
+        )
+
+def _rgba(color) -> int:
+    """Packed ARGB of a QColor or of anything QColor accepts."""
+    return color.rgba() if isinstance(color, QColor) else QColor(color).rgba()
+
+_NO_PROPERTIES: Dict[str, Any] = {}
 
-@dataclass
 class ShapeData:
-    shape_type: ShapeType
-    position: QPointF
-    size: QSizeF
-    rotation: float
-    fill_color: QColor
-    stroke_color: QColor
-    stroke_width: float
-    gradient: Optional[GradientData]
-    opacity: float
-    blend_mode: BlendMode
-    z_index: int
-    visible: bool
-    locked: bool
-    name: str
-    custom_properties: Dict[str, Any]
+    """A layer's fields, either held directly or viewed in a LayerStore row.
+    
+    Constructed like a dataclass with the fields listed in FIELDS. Adding
+    the shape to a LayerManager turns it into a view of the manager's
+    LayerStore. Qt values (QPointF, QSizeF, QColor) are built when read and
+    written through when assigned, so change fields by assignment; mutating
+    a returned QPointF in place has no effect and custom_properties is
+    read-only.
+    """
+    
+    __slots__ = ('_store', '_row', '_values')
+    
+    FIELDS = ('shape_type', 'position', 'size', 'rotation', 'fill_color', 'stroke_color',
+              'stroke_width', 'gradient', 'opacity', 'blend_mode', 'z_index', 'visible',
+              'locked', 'name', 'custom_properties')
+    
+    def __init__(self, shape_type: 'ShapeType', position: QPointF, size: QSizeF, rotation: float,
+                 fill_color: QColor, stroke_color: QColor, stroke_width: float,
+                 gradient: Optional[GradientData], opacity: float, blend_mode: 'BlendMode',
+                 z_index: int, visible: bool, locked: bool, name: str,
+                 custom_properties: Dict[str, Any]):
+        self._store: Optional['LayerStore'] = None
+        self._row = -1
+        self._values = [
+            position.x(), position.y(), size.width(), size.height(), rotation, stroke_width,
+            opacity, _rgba(fill_color), _rgba(stroke_color), z_index,
+            LayerStore.SHAPE_TYPE_INDEX[shape_type], LayerStore.BLEND_MODE_INDEX[blend_mode],
+            (LayerStore.VISIBLE if visible else 0) | (LayerStore.LOCKED if locked else 0),
+            name, gradient, dict(custom_properties) if custom_properties else None,
+        ]
+    
+    @classmethod
+    def from_raw(cls, values: List[Any]) -> 'ShapeData':
+        """Build a detached shape from values in LayerStore column order."""
+        shape = cls.__new__(cls)
+        shape._store = None
+        shape._row = -1
+        shape._values = values
+        return shape
+    
+    @classmethod
+    def from_row(cls, store: 'LayerStore', row: int) -> 'ShapeData':
+        """Build a view of a row already filled in a store."""
+        shape = cls.__new__(cls)
+        shape._store = store
+        shape._row = row
+        shape._values = None
+        return shape
+    
+    def raw(self) -> List[Any]:
+        """Field values in LayerStore column order."""
+        if self._store is None:
+            return list(self._values)
+        return self._store.read(self._row)
+    
+    def _get(self, column: int):
+        store = self._store
+        return self._values[column] if store is None else store.columns[column][self._row]
+    
+    def _set(self, column: int, value):
+        store = self._store
+        if store is None:
+            self._values[column] = value
+        else:
+            store.columns[column][self._row] = value
+    
+    def _set_flag(self, flag: int, enabled: bool):
+        flags = self._get(LayerStore.FLAGS)
+        self._set(LayerStore.FLAGS, flags | flag if enabled else flags & ~flag)
+    
+    shape_type = property(lambda self: LayerStore.SHAPE_TYPES[self._get(LayerStore.SHAPE_TYPE)],
+                          lambda self, value: self._set(LayerStore.SHAPE_TYPE, LayerStore.SHAPE_TYPE_INDEX[value]))
+    position = property(lambda self: QPointF(self._get(LayerStore.X), self._get(LayerStore.Y)),
+                        lambda self, value: (self._set(LayerStore.X, value.x()), self._set(LayerStore.Y, value.y())))
+    size = property(lambda self: QSizeF(self._get(LayerStore.WIDTH), self._get(LayerStore.HEIGHT)),
+                    lambda self, value: (self._set(LayerStore.WIDTH, value.width()),
+                                         self._set(LayerStore.HEIGHT, value.height())))
+    rotation = property(lambda self: self._get(LayerStore.ROTATION),
+                        lambda self, value: self._set(LayerStore.ROTATION, value))
+    fill_color = property(lambda self: QColor.fromRgba(self._get(LayerStore.FILL)),
+                          lambda self, value: self._set(LayerStore.FILL, _rgba(value)))
+    stroke_color = property(lambda self: QColor.fromRgba(self._get(LayerStore.STROKE)),
+                            lambda self, value: self._set(LayerStore.STROKE, _rgba(value)))
+    stroke_width = property(lambda self: self._get(LayerStore.STROKE_WIDTH),
+                            lambda self, value: self._set(LayerStore.STROKE_WIDTH, value))
+    gradient = property(lambda self: self._get(LayerStore.GRADIENT),
+                        lambda self, value: self._set(LayerStore.GRADIENT, value))
+    opacity = property(lambda self: self._get(LayerStore.OPACITY),
+                       lambda self, value: self._set(LayerStore.OPACITY, value))
+    blend_mode = property(lambda self: LayerStore.BLEND_MODES[self._get(LayerStore.BLEND_MODE)],
+                          lambda self, value: self._set(LayerStore.BLEND_MODE, LayerStore.BLEND_MODE_INDEX[value]))
+    z_index = property(lambda self: self._get(LayerStore.Z_INDEX),
+                       lambda self, value: self._set(LayerStore.Z_INDEX, value))
+    visible = property(lambda self: bool(self._get(LayerStore.FLAGS) & LayerStore.VISIBLE),
+                       lambda self, value: self._set_flag(LayerStore.VISIBLE, value))
+    locked = property(lambda self: bool(self._get(LayerStore.FLAGS) & LayerStore.LOCKED),
+                      lambda self, value: self._set_flag(LayerStore.LOCKED, value))
+    name = property(lambda self: self._get(LayerStore.NAME),
+                    lambda self, value: self._set(LayerStore.NAME, value))
+    
+    @property
+    def custom_properties(self) -> Mapping[str, Any]:
+        # Read-only, as saves share the stored dicts with the writer thread;
+        # assign a changed copy instead
+        return MappingProxyType(self._get(LayerStore.PROPERTIES) or _NO_PROPERTIES)
+    
+    @custom_properties.setter
+    def custom_properties(self, value: Mapping[str, Any]):
+        self._set(LayerStore.PROPERTIES, dict(value) if value else None)
+    
+    def geometry(self) -> Tuple[float, float, float, float, float, float]:
+        """(x, y, width, height, rotation, stroke_width) without building Qt values."""
+        store = self._store
+        if store is None:
+            values = self._values
+            return values[0], values[1], values[2], values[3], values[4], values[5]
+        row = self._row
+        return (store.x[row], store.y[row], store.width[row], store.height[row],
+                store.rotation[row], store.stroke_width[row])
+    
+    def cache_key(self) -> Tuple:
+        """Hashable key of everything that affects how the shape renders locally."""
+        (x, y, width, height, rotation, stroke_width, opacity, fill, stroke, z_index,
+         shape_type, blend_mode, flags, name, gradient, properties) = self.raw()
+        properties = properties or {}
+        return (
+            LayerStore.SHAPE_TYPES[shape_type], width, height, rotation, fill, stroke, stroke_width,
+            gradient.cache_key() if gradient else None, opacity,
+            properties.get('sides'), properties.get('points'), properties.get('inner_ratio')
+        )
+    
+    def effects(self) -> Optional['TextEffectData']:
+        """Glow and shadow settings stored in custom_properties['effects'], if any."""
+        properties = self._get(LayerStore.PROPERTIES)
+        if not properties or not properties.get('effects'):
+            return None
+        return TextEffectData.from_properties(properties['effects'])
+    
+    def animations(self) -> List['AnimationData']:
+        """Animations stored in custom_properties['animations']."""
+        properties = self._get(LayerStore.PROPERTIES)
+        if not properties or not properties.get('animations'):
+            return []
+        return [AnimationData.from_properties(animation) for animation in properties['animations']]
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ShapeData):
+            return NotImplemented
+        mine, theirs = self.raw(), other.raw()
+        mine[LayerStore.PROPERTIES] = mine[LayerStore.PROPERTIES] or {}
+        theirs[LayerStore.PROPERTIES] = theirs[LayerStore.PROPERTIES] or {}
+        return mine == theirs
+    
+    __hash__ = None
+    
+    def __reduce__(self):
+        # Pickles and copies are detached
+        return ShapeData.from_raw, (self.raw(),)
+    
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"ShapeData({fields})"
+
+class LayerStore:
+    """Columnar storage for the fields of many layers.
+    
+    Numeric fields live in typed arrays with one row per layer; colors are
+    packed 32-bit ARGB, enums and the visible/locked flags small integers.
+    Names, gradients and custom properties are object columns. Rows of
+    released shapes are reused. Bulk edits work on whole columns, through
+    numpy views of the arrays when numpy is installed.
+    """
+    
+    (X, Y, WIDTH, HEIGHT, ROTATION, STROKE_WIDTH, OPACITY, FILL, STROKE, Z_INDEX,
+     SHAPE_TYPE, BLEND_MODE, FLAGS, NAME, GRADIENT, PROPERTIES) = range(16)
+    TYPECODES = ('d', 'd', 'd', 'd', 'd', 'd', 'd', 'I', 'I', 'q', 'B', 'B', 'B')
+    VISIBLE = 0x01
+    LOCKED = 0x02
+    SHAPE_TYPES = tuple(ShapeType)
+    SHAPE_TYPE_INDEX = {shape_type: i for i, shape_type in enumerate(ShapeType)}
+    BLEND_MODES = tuple(BlendMode)
+    BLEND_MODE_INDEX = {blend_mode: i for i, blend_mode in enumerate(BlendMode)}
+    
+    def __init__(self):
+        self.columns: List[Any] = [array(code) for code in self.TYPECODES] + [[], [], []]
+        (self.x, self.y, self.width, self.height, self.rotation, self.stroke_width, self.opacity,
+         self.fill, self.stroke, self.z_index, self.shape_type, self.blend_mode, self.flags,
+         self.name, self.gradient, self.properties) = self.columns
+        self._free: List[int] = []
+    
+    def __len__(self) -> int:
+        return len(self.x) - len(self._free)
+    
+    def attach(self, shape: ShapeData):
+        """Move a shape's values into a row of this store and make it a view of it."""
+        if shape._store is self:
+            return
+        values = shape.raw()
+        if self._free:
+            row = self._free.pop()
+            for column, value in zip(self.columns, values):
+                column[row] = value
+        else:
+            row = len(self.x)
+            for column, value in zip(self.columns, values):
+                column.append(value)
+        shape._store, shape._row, shape._values = self, row, None
+    
+    def attach_all(self, shapes: List[ShapeData]):
+        """Attach many shapes, appending their values column by column."""
+        shapes = [shape for shape in shapes if shape._store is not self]
+        if not shapes:
+            return
+        start = self.extend(self.fields_of(shapes))
+        for row, shape in enumerate(shapes, start):
+            shape._store, shape._row, shape._values = self, row, None
+    
+    def extend(self, columns: List[Sequence]) -> int:
+        """Append rows given as one sequence per column and return the first new row."""
+        start = len(self.x)
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        return start
+    
+    def shapes(self, start: int, count: int) -> List[ShapeData]:
+        """Views of count rows from start, as filled by extend()."""
+        return [ShapeData.from_row(self, row) for row in range(start, start + count)]
+    
+    def detach(self, shape: ShapeData):
+        """Copy a shape's values out of its row and free the row for reuse."""
+        if shape._store is not self:
+            return
+        row = shape._row
+        shape._values = self.read(row)
+        shape._store, shape._row = None, -1
+        for column in self.columns[self.NAME:]:
+            column[row] = None
+        self._free.append(row)
+    
+    def read(self, row: int) -> List[Any]:
+        return [column[row] for column in self.columns]
+    
+    @classmethod
+    def fields_of(cls, layers: List[ShapeData]) -> List[List[Any]]:
+        """Values of many layers as one sequence per column, in layer order.
+        
+        Reading whole columns avoids allocating a container per layer, which
+        keeps the garbage collector quiet while large documents are saved.
+        The lists are a snapshot to hand to other threads, which must never
+        read ShapeData views as rows are freed and reused. Custom property
+        dicts are shared: ShapeData only exposes them read-only and copies
+        on assignment, so a stored dict is never mutated.
+        """
+        stores = {id(layer._store) for layer in layers}
+        store = layers[0]._store if len(stores) == 1 else None
+        if store is None:
+            return [list(values) for values in zip(*[layer.raw() for layer in layers])] or \
+                [[] for _ in range(cls.PROPERTIES + 1)]
+        rows = [layer._row for layer in layers]
+        first = rows[0]
+        if rows == list(range(first, first + len(rows))):
+            # Layers in row order, as after loading: slices copy without boxing values
+            return [column[first:first + len(rows)] for column in store.columns]
+        return [[column[row] for row in rows] for column in store.columns]
+    
+    def translate(self, rows: List[int], dx: float, dy: float):
+        """Offset the positions of rows."""
+        if numpy is not None:
+            index = numpy.asarray(rows, dtype=numpy.intp)
+            numpy.frombuffer(self.x, dtype=numpy.float64)[index] += dx
+            numpy.frombuffer(self.y, dtype=numpy.float64)[index] += dy
+            return
+        x, y = self.x, self.y
+        for row in rows:
+            x[row] += dx
+            y[row] += dy
+    
+    def assign(self, column: int, rows: List[int], values):
+        """Set a numeric column for rows to one value or to one value per row."""
+        target = self.columns[column]
+        per_row = not isinstance(values, (int, float))
+        if numpy is not None:
+            view = numpy.frombuffer(target, dtype=numpy.dtype(target.typecode))
+            view[numpy.asarray(rows, dtype=numpy.intp)] = (
+                numpy.asarray(values, dtype=view.dtype) if per_row else values)
+            return
+        if per_row:
+            for row, value in zip(rows, values):
+                target[row] = value
+        else:
+            for row in rows:
+                target[row] = values
+    
+    def gather(self, column: int, rows: List[int]) -> array:
+        """Values of a numeric column for rows, as a typed array."""
+        target = self.columns[column]
+        if numpy is not None:
+            view = numpy.frombuffer(target, dtype=numpy.dtype(target.typecode))
+            return array(target.typecode, view[numpy.asarray(rows, dtype=numpy.intp)].tobytes())
+        return array(target.typecode, (target[row] for row in rows))
 
 @dataclass
 class FontData:
@@ -154,6 +484,60 @@ class TextEffectData:
     outline_enabled: bool
     outline_color: QColor
     outline_width: float
+    
+    DEFAULT_GLOW_COLOR = '#ffffd700'
+    DEFAULT_SHADOW_COLOR = '#a0000000'
+    
+    @classmethod
+    def from_properties(cls, effects: Dict[str, Any]) -> 'TextEffectData':
+        """Build from the JSON form kept in custom_properties['effects'].
+        
+        Only enabled effects are stored: {'glow': {'color', 'radius'},
+        'shadow': {'color', 'offset': [x, y], 'blur'}, 'outline': {'color', 'width'}}
+        with colors as #AARRGGBB strings.
+        """
+        glow = effects.get('glow') or {}
+        shadow = effects.get('shadow') or {}
+        outline = effects.get('outline') or {}
+        offset = shadow.get('offset', (2, 2))
+        return cls(
+            glow_enabled=bool(glow),
+            glow_color=QColor(glow.get('color', cls.DEFAULT_GLOW_COLOR)),
+            glow_radius=int(glow.get('radius', 10)),
+            shadow_enabled=bool(shadow),
+            shadow_color=QColor(shadow.get('color', cls.DEFAULT_SHADOW_COLOR)),
+            shadow_offset=QPointF(offset[0], offset[1]),
+            shadow_blur=float(shadow.get('blur', 5)),
+            outline_enabled=bool(outline),
+            outline_color=QColor(outline.get('color', '#ff000000')),
+            outline_width=float(outline.get('width', 1)),
+        )
+    
+    def to_properties(self) -> Dict[str, Any]:
+        """The JSON form read by from_properties; empty when no effect is enabled."""
+        effects = {}
+        if self.glow_enabled:
+            effects['glow'] = {'color': self.glow_color.name(QColor.NameFormat.HexArgb),
+                               'radius': self.glow_radius}
+        if self.shadow_enabled:
+            effects['shadow'] = {'color': self.shadow_color.name(QColor.NameFormat.HexArgb),
+                                 'offset': [self.shadow_offset.x(), self.shadow_offset.y()],
+                                 'blur': self.shadow_blur}
+        if self.outline_enabled:
+            effects['outline'] = {'color': self.outline_color.name(QColor.NameFormat.HexArgb),
+                                  'width': self.outline_width}
+        return effects
+    
+    def extent(self) -> Tuple[float, float, float, float]:
+        """How far glow and shadow reach past a shape's bounds: (left, top, right, bottom)."""
+        left = top = right = bottom = 0.0
+        if self.glow_enabled:
+            left = top = right = bottom = float(self.glow_radius)
+        if self.shadow_enabled:
+            dx, dy, blur = self.shadow_offset.x(), self.shadow_offset.y(), self.shadow_blur
+            left, top = max(left, blur - dx), max(top, blur - dy)
+            right, bottom = max(right, blur + dx), max(bottom, blur + dy)
+        return left, top, right, bottom
 
 @dataclass
 class AnimationData:
@@ -163,46 +547,1365 @@ class AnimationData:
     start_value: Any
     end_value: Any
     loop_count: int
+    
+    @classmethod
+    def from_properties(cls, animation: Dict[str, Any]) -> 'AnimationData':
+        """Build from one entry of custom_properties['animations'].
+        
+        Entries look like {'type': 'ROTATE', 'duration': ms, 'easing': 'InOutQuad',
+        'start': value, 'end': value, 'loops': n}. Values are opacity or scale
+        factors, degrees, [x, y] offsets or #AARRGGBB fill colors; loops of -1
+        repeat forever.
+        """
+        animation_type = AnimationType[animation['type']]
+        
+        def value(raw):
+            if animation_type is AnimationType.COLOR_TRANSITION:
+                return QColor(raw)
+            if animation_type is AnimationType.TRANSLATE:
+                return QPointF(raw[0], raw[1])
+            return float(raw)
+        
+        return cls(animation_type, int(animation['duration']), animation.get('easing', 'Linear'),
+                   value(animation['start']), value(animation['end']), int(animation.get('loops', 1)))
+    
+    def to_properties(self) -> Dict[str, Any]:
+        """The JSON form read by from_properties."""
+        def value(raw):
+            if isinstance(raw, QColor):
+                return raw.name(QColor.NameFormat.HexArgb)
+            if isinstance(raw, QPointF):
+                return [raw.x(), raw.y()]
+            return raw
+        
+        return {'type': self.type.name, 'duration': self.duration, 'easing': self.easing,
+                'start': value(self.start_value), 'end': value(self.end_value), 'loops': self.loop_count}
+
+@dataclass
+class LayerOperation:
+    """A change made through LayerManager, emitted after it is applied.
+    
+    kind is one of 'add', 'remove', 'move', 'update', 'z_index', 'clear',
+    'translate', 'recolor' or 'reorder'. index is the affected list index
+    (the first one for 'add'), target the destination of a 'move', and
+    layers the added, removed or updated layers. changes maps each field set
+    by edit_layer or set_layer_z_index to its (old, new) values; in-place
+    edits reported by update_layer have none. The bulk 'translate' and
+    'recolor' edits list their layers' indices in indices and record the
+    offset, or the old and new packed ARGB arrays of 'fill' and 'stroke', in
+    changes. A 'reorder' lists in indices the old index of each layer in
+    its new order.
+    """
+    kind: str
+    index: int = -1
+    target: int = -1
+    layers: List['ShapeData'] = field(default_factory=list)
+    changes: Dict[str, Tuple[Any, Any]] = field(default_factory=dict)
+    indices: List[int] = field(default_factory=list)
+
+@dataclass
+class TransactionSummary:
+    """What a LayerManager.transaction() changed, reported once it ends.
+    
+    operations are the LayerOperations that took effect, in order; ones
+    undone by a rollback are left out. indices are the current list indices
+    of added, moved or edited layers that still exist, and bounds the
+    document area touched, including removed layers; a null rect means
+    everything. rolled_back tells whether the outermost transaction failed.
+    """
+    operations: List[LayerOperation]
+    indices: List[int]
+    bounds: QRectF
+    rolled_back: bool = False
+
+Bounds = Tuple[float, float, float, float]
+
+class GeometryCache:
+    """Memoized polygon and star outlines.
+
+    Vertex angles are computed once per (shape type, count, inner ratio) as a
+    unit outline; each size is then produced by a single QTransform.map call
+    and kept in a bounded LRU. Callers get copies, which share the cached
+    points until one of them is modified.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._unit: Dict[Tuple[ShapeType, int, float], QPolygonF] = {}
+        self._scaled: "OrderedDict[Tuple, QPolygonF]" = OrderedDict()
+
+    def unit_outline(self, shape_type: ShapeType, count: int, inner_ratio: float = 1.0) -> QPolygonF:
+        """Outline on the unit circle centred at the origin."""
+        key = (shape_type, count, inner_ratio)
+        outline = self._unit.get(key)
+        if outline is None:
+            if shape_type == ShapeType.STAR:
+                step = math.pi / count
+                outline = QPolygonF([
+                    QPointF(radius * math.cos(i * step - math.pi / 2), radius * math.sin(i * step - math.pi / 2))
+                    for i, radius in enumerate((1.0, inner_ratio) * count)
+                ])
+            else:
+                step = 2 * math.pi / count
+                outline = QPolygonF([QPointF(math.cos(i * step), math.sin(i * step)) for i in range(count)])
+            self._unit[key] = outline
+        return QPolygonF(outline)
+
+    def outline(self, shape_type: ShapeType, size: QSizeF, count: int, inner_ratio: float = 1.0) -> QPolygonF:
+        """Outline fitted to a shape's size: centred, radius half the shorter side."""
+        width, height = size.width(), size.height()
+        key = (shape_type, width, height, count, inner_ratio)
+        outline = self._scaled.get(key)
+        if outline is not None:
+            self._scaled.move_to_end(key)
+            return QPolygonF(outline)
+        radius = min(width, height) / 2
+        transform = QTransform(radius, 0, 0, radius, width / 2, height / 2)
+        outline = transform.map(self.unit_outline(shape_type, count, inner_ratio))
+        self._scaled[key] = outline
+        if len(self._scaled) > self.max_entries:
+            self._scaled.popitem(last=False)
+        return QPolygonF(outline)
+
+    def shape_outline(self, shape: ShapeData) -> Optional[QPolygonF]:
+        """Outline for polygon and star shapes, honouring their custom_properties."""
+        if shape.shape_type == ShapeType.POLYGON:
+            sides = shape.custom_properties.get('sides', DEFAULT_POLYGON_SIDES)
+            return self.outline(ShapeType.POLYGON, shape.size, sides)
+        if shape.shape_type == ShapeType.STAR:
+            points = shape.custom_properties.get('points', DEFAULT_STAR_POINTS)
+            inner_ratio = shape.custom_properties.get('inner_ratio', DEFAULT_STAR_INNER_RATIO)
+            return self.outline(ShapeType.STAR, shape.size, points, inner_ratio)
+        return None
+
+shape_geometry = GeometryCache()
+
+class GradientRegistry:
+    """Interns gradient definitions by value and caches their brushes.
+
+    Shapes with equal gradients share one GradientData instance, so interned
+    gradients should be replaced rather than edited in place.
+    """
+
+    def __init__(self, max_brushes: int = 1024):
+        self.max_brushes = max_brushes
+        self._definitions: Dict[Tuple, GradientData] = {}
+        self._references: Dict[Tuple, int] = {}
+        self._keys: Dict[int, Tuple] = {}
+        self._brushes: "OrderedDict[Tuple, QBrush]" = OrderedDict()
+        self.brush_hits = 0
+        self.brush_misses = 0
+
+    def intern(self, gradient: GradientData) -> GradientData:
+        """Return the shared instance equal to gradient and count a reference to it."""
+        key = gradient.cache_key()
+        shared = self._definitions.get(key)
+        if shared is None:
+            self._definitions[key] = shared = gradient
+            self._keys[id(shared)] = key
+        self._references[key] = self._references.get(key, 0) + 1
+        return shared
+
+    def release(self, gradient: GradientData):
+        """Drop a reference taken by intern, forgetting unused definitions."""
+        key = self._keys.get(id(gradient))
+        if key is None or self._definitions.get(key) is not gradient:
+            return
+        self._references[key] -= 1
+        if self._references[key] <= 0:
+            del self._references[key]
+            del self._definitions[key]
+            del self._keys[id(gradient)]
+
+    def brush(self, gradient: GradientData) -> QBrush:
+        """Return a cached brush for the gradient's current value."""
+        key = gradient.cache_key()
+        brush = self._brushes.get(key)
+        if brush is not None:
+            self._brushes.move_to_end(key)
+            self.brush_hits += 1
+            return brush
+        self.brush_misses += 1
+        
+        if gradient.type == GradientType.LINEAR:
+            grad = QLinearGradient(gradient.start_point, gradient.end_point)
+        elif gradient.type == GradientType.RADIAL:
+            grad = QRadialGradient(gradient.start_point, gradient.radius)
+        else:  # CONICAL
+            grad = QConicalGradient(gradient.start_point, gradient.angle)
+        
+        for stop in gradient.stops:
+            grad.setColorAt(stop.position, stop.color)
+        
+        brush = QBrush(grad)
+        self._brushes[key] = brush
+        if len(self._brushes) > self.max_brushes:
+            self._brushes.popitem(last=False)
+        return brush
+
+    def clear(self):
+        """Forget all definitions and cached brushes."""
+        self._definitions.clear()
+        self._references.clear()
+        self._keys.clear()
+        self._brushes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return deduplication and brush cache counters."""
+        references = sum(self._references.values())
+        definitions = len(self._definitions)
+        return {
+            'definitions': definitions,
+            'references': references,
+            'dedup_ratio': references / definitions if definitions else 0.0,
+            'brushes': len(self._brushes),
+            'brush_hits': self.brush_hits,
+            'brush_misses': self.brush_misses,
+        }
+
+gradient_registry = GradientRegistry()
+
+class SpatialIndex:
+    """Uniform grid spatial hash over axis-aligned bounds.
+
+    Items are stored under an integer key in every grid cell their bounds
+    overlap. Items spanning more than ``max_cells`` cells are kept in a
+    separate oversized set and tested linearly, so huge backgrounds do not
+    flood the grid.
+    """
+
+    def __init__(self, cell_size: float = 128.0, max_cells: int = 256):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._cells: Dict[Tuple[int, int], set] = {}
+        self._bounds: Dict[int, Bounds] = {}
+        self._cell_ranges: Dict[int, Tuple[int, int, int, int]] = {}
+        self._oversized: set = set()
+
+    def __len__(self) -> int:
+        return len(self._bounds)
+
+    def _cell_range(self, bounds: Bounds) -> Tuple[int, int, int, int]:
+        x0, y0, x1, y1 = bounds
+        size = self.cell_size
+        return (math.floor(x0 / size), math.floor(y0 / size),
+                math.floor(x1 / size), math.floor(y1 / size))
+
+    def insert(self, key: int, bounds: Bounds):
+        """Insert an item, replacing any previous bounds for the key."""
+        cell_range = self._cell_range(bounds)
+        if key in self._bounds:
+            if self._cell_ranges.get(key) == cell_range:
+                # Small moves usually stay within the same cells
+                self._bounds[key] = bounds
+                return
+            self.remove(key)
+        self._bounds[key] = bounds
+        cx0, cy0, cx1, cy1 = cell_range
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.max_cells:
+            self._oversized.add(key)
+            return
+        self._cell_ranges[key] = (cx0, cy0, cx1, cy1)
+        cells = self._cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    cells[(cx, cy)] = bucket = set()
+                bucket.add(key)
+
+    def insert_many(self, keys: Sequence[int], all_bounds: Sequence[Bounds]):
+        """Insert many items; insert() with the per-call lookups hoisted out of the loop."""
+        size, max_cells, floor = self.cell_size, self.max_cells, math.floor
+        stored, cell_ranges, cells, oversized = self._bounds, self._cell_ranges, self._cells, self._oversized
+        for key, bounds in zip(keys, all_bounds):
+            if key in stored:
+                self.insert(key, bounds)
+                continue
+            stored[key] = bounds
+            x0, y0, x1, y1 = bounds
+            cx0, cy0, cx1, cy1 = floor(x0 / size), floor(y0 / size), floor(x1 / size), floor(y1 / size)
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > max_cells:
+                oversized.add(key)
+                continue
+            cell_ranges[key] = (cx0, cy0, cx1, cy1)
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket is None:
+                        cells[(cx, cy)] = bucket = set()
+                    bucket.add(key)
+
+    def remove(self, key: int) -> bool:
+        """Remove an item from the index."""
+        if self._bounds.pop(key, None) is None:
+            return False
+        if key in self._oversized:
+            self._oversized.discard(key)
+            return True
+        cx0, cy0, cx1, cy1 = self._cell_ranges.pop(key)
+        cells = self._cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del cells[(cx, cy)]
+        return True
+
+    def clear(self):
+        """Remove all items."""
+        self._cells.clear()
+        self._bounds.clear()
+        self._cell_ranges.clear()
+        self._oversized.clear()
+
+    def bounds(self, key: int) -> Optional[Bounds]:
+        """Return the stored bounds for a key."""
+        return self._bounds.get(key)
+
+    def query_point(self, x: float, y: float) -> List[int]:
+        """Return keys whose bounds contain the point."""
+        size = self.cell_size
+        candidates = self._cells.get((math.floor(x / size), math.floor(y / size)), ())
+        all_bounds = self._bounds
+        hits = []
+        for key in candidates:
+            x0, y0, x1, y1 = all_bounds[key]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                hits.append(key)
+        for key in self._oversized:
+            x0, y0, x1, y1 = all_bounds[key]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                hits.append(key)
+        return hits
+
+    def query_rect(self, bounds: Bounds) -> List[int]:
+        """Return keys whose bounds intersect the rectangle."""
+        qx0, qy0, qx1, qy1 = bounds
+        cx0, cy0, cx1, cy1 = self._cell_range(bounds)
+        all_bounds = self._bounds
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # Query covers more cells than are populated: walk the buckets
+            candidates = set()
+            for (cx, cy), bucket in self._cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    candidates.update(bucket)
+        else:
+            candidates = set()
+            cells = self._cells
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket:
+                        candidates.update(bucket)
+        candidates.update(self._oversized)
+        hits = []
+        for key in candidates:
+            x0, y0, x1, y1 = all_bounds[key]
+            if x0 <= qx1 and qx0 <= x1 and y0 <= qy1 and qy0 <= y1:
+                hits.append(key)
+        return hits
 
 class LayerManager(QObject):
     """Manages layers and their z-ordering."""
-    
+
     layerChanged = pyqtSignal()
-    
+    selectionChanged = pyqtSignal()
+    # Document-space area touched by a mutation; a null rect means everything
+    regionChanged = pyqtSignal(QRectF)
+    # LayerOperation describing each mutation, for journaling and history
+    layerOperation = pyqtSignal(object)
+    # TransactionSummary at the end of each outermost transaction()
+    transactionFinished = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.layers: List[ShapeData] = []
         self.selected_layers: List[int] = []
-        
+        # Field values of every layer; the ShapeData objects are views of it
+        self.store = LayerStore()
+
+        # Stable layer ids parallel to self.layers, used as spatial index keys
+        self._layer_ids: List[int] = []
+        self._next_layer_id = 0
+        self._positions: Optional[Dict[int, int]] = {}
+        self.spatial_index = SpatialIndex()
+
+        # Draw order: layer ids sorted by (z_index, list index), with the
+        # z_index each id was filed under and the layer itself kept in
+        # parallel lists for bisect and allocation-free iteration
+        self._z_order: List[int] = []
+        self._z_keys: List[int] = []
+        self._z_layers: List[ShapeData] = []
+        self._z_of: Dict[int, int] = {}
+
+        # Open transaction state: nesting depth, operations applied so far,
+        # and the region and layer ids touched
+        self._batch_depth = 0
+        self._batch_operations: List[LayerOperation] = []
+        self._batch_region = QRectF()
+        self._batch_everything = False
+        self._batch_ids: set = set()
+        self._rolling_back = False
+
+    @contextmanager
+    def transaction(self) -> Iterator['LayerManager']:
+        """Group mutations so they are reported together.
+        
+        Inside the block layerOperation still fires for every change, but
+        layerChanged and regionChanged are held back and emitted once when
+        the outermost transaction ends, followed by transactionFinished with
+        a TransactionSummary. Transactions nest. If a block raises, the
+        changes made inside that block are reverted before the exception
+        propagates; an enclosing transaction keeps its own changes.
+        """
+        mark = len(self._batch_operations)
+        self._batch_depth += 1
+        failed = False
+        try:
+            yield self
+        except BaseException:
+            failed = True
+            self._rollback(mark)
+            raise
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._finish_transaction(failed)
+
+    def in_transaction(self) -> bool:
+        return self._batch_depth > 0
+
+    def _notify(self, region: QRectF, operation: LayerOperation, layer_ids=()):
+        """Report a mutation now, or fold it into the open transaction."""
+        if self._batch_depth:
+            if region.isNull():
+                self._batch_everything = True
+            else:
+                self._batch_region = self._batch_region.united(region)
+            self._batch_ids.update(layer_ids)
+            if not self._rolling_back:
+                self._batch_operations.append(operation)
+        else:
+            self.layerChanged.emit()
+            self.regionChanged.emit(region)
+        self.layerOperation.emit(operation)
+
+    def _rollback(self, mark: int):
+        """Revert the operations applied since mark, newest first."""
+        operations = self._batch_operations[mark:]
+        del self._batch_operations[mark:]
+        self._rolling_back = True
+        try:
+            for operation in reversed(operations):
+                self.apply_operation(operation, reverse=True)
+        finally:
+            self._rolling_back = False
+
+    def _finish_transaction(self, rolled_back: bool):
+        touched = self._batch_everything or not self._batch_region.isNull() or self._batch_ids
+        region = QRectF() if self._batch_everything else self._batch_region
+        z_of = self._z_of
+        summary = TransactionSummary(
+            self._batch_operations,
+            sorted(self._index_of(layer_id) for layer_id in self._batch_ids if layer_id in z_of),
+            region,
+            rolled_back,
+        )
+        self._batch_operations = []
+        self._batch_region = QRectF()
+        self._batch_everything = False
+        self._batch_ids = set()
+        if touched:
+            self.layerChanged.emit()
+            self.regionChanged.emit(region)
+            self.transactionFinished.emit(summary)
+
     def add_layer(self, shape: ShapeData) -> int:
         """Add a new layer and return its index."""
+        layer_id = self._next_layer_id
+        self._next_layer_id += 1
+        self.store.attach(shape)
+        if shape.gradient is not None:
+            shape.gradient = gradient_registry.intern(shape.gradient)
         self.layers.append(shape)
-        self.layerChanged.emit()
+        self._layer_ids.append(layer_id)
+        if self._positions is not None:
+            self._positions[layer_id] = len(self.layers) - 1
+        # Appended layers sort last among equal z_index values
+        slot = bisect.bisect_right(self._z_keys, shape.z_index)
+        self._z_order.insert(slot, layer_id)
+        self._z_keys.insert(slot, shape.z_index)
+        self._z_layers.insert(slot, shape)
+        self._z_of[layer_id] = shape.z_index
+        bounds = self.paint_bounds(shape)
+        self.spatial_index.insert(layer_id, bounds)
+        self._notify(self._bounds_rect(bounds), LayerOperation('add', len(self.layers) - 1, layers=[shape]),
+                     (layer_id,))
         return len(self.layers) - 1
-    
+
+    def add_layers(self, shapes) -> int:
+        """Append many layers with one change notification and return how many were added."""
+        start = len(self.layers)
+        # Packed records go straight into columns instead of being decoded one by one
+        shapes = shapes.shapes() if isinstance(shapes, PackedLayers) else list(shapes)
+        self.store.attach_all(shapes)
+        layer_ids = range(self._next_layer_id, self._next_layer_id + len(shapes))
+        self._next_layer_id += len(shapes)
+        rows = [shape._row for shape in shapes]
+        gradients = self.store.gradient
+        for row in rows:
+            if gradients[row] is not None:
+                gradients[row] = gradient_registry.intern(gradients[row])
+        self.layers += shapes
+        self._layer_ids += layer_ids
+        z_index = self.store.z_index
+        self._z_of.update(zip(layer_ids, [z_index[row] for row in rows]))
+        self.spatial_index.insert_many(layer_ids, self.paint_bounds_all(shapes))
+        added = len(self.layers) - start
+        if added:
+            if self._positions is not None:
+                self._positions.update(zip(layer_ids, range(start, start + added)))
+            self._merge_z_order(start)
+            self._notify(QRectF(), LayerOperation('add', start, layers=self.layers[start:]),
+                         self._layer_ids[start:])
+        return added
+
     def remove_layer(self, index: int) -> bool:
         """Remove layer at index."""
         if 0 <= index < len(self.layers):
+            removed = self.layers[index]
+            if removed.gradient is not None:
+                gradient_registry.release(removed.gradient)
+            self.store.detach(removed)
+            layer_id = self._layer_ids[index]
+            self._unfile_z_order(layer_id)
             del self.layers[index]
-            if index in self.selected_layers:
-                self.selected_layers.remove(index)
-            self.layerChanged.emit()
+            del self._layer_ids[index]
+            bounds = self.spatial_index.bounds(layer_id)
+            self.spatial_index.remove(layer_id)
+            del self._z_of[layer_id]
+            self._positions = None
+            self._remap_selection(lambda i: None if i == index else (i - 1 if i > index else i))
+            self._notify(self._bounds_rect(bounds), LayerOperation('remove', index, layers=[removed]))
             return True
         return False
-    
+
+    def remove_layers(self, indices: List[int]) -> int:
+        """Remove many layers in one pass and return how many were removed.
+        
+        Reported as one transaction of 'remove' operations in descending
+        index order, so each one is valid when replayed in sequence.
+        """
+        doomed = sorted({i for i in indices if 0 <= i < len(self.layers)})
+        if not doomed:
+            return 0
+        doomed_set = set(doomed)
+        layer_ids, spatial_index = self._layer_ids, self.spatial_index
+        removed = [(i, self.layers[i], layer_ids[i], spatial_index.bounds(layer_ids[i])) for i in reversed(doomed)]
+        removed_ids = {layer_id for _, _, layer_id, _ in removed}
+        with self.transaction():
+            for _, layer, layer_id, _ in removed:
+                if layer.gradient is not None:
+                    gradient_registry.release(layer.gradient)
+                self.store.detach(layer)
+                spatial_index.remove(layer_id)
+                del self._z_of[layer_id]
+            self.layers = [layer for i, layer in enumerate(self.layers) if i not in doomed_set]
+            self._layer_ids = [layer_id for i, layer_id in enumerate(layer_ids) if i not in doomed_set]
+            self._positions = None
+            kept = [slot for slot, layer_id in enumerate(self._z_order) if layer_id not in removed_ids]
+            self._z_order = [self._z_order[slot] for slot in kept]
+            self._z_keys = [self._z_keys[slot] for slot in kept]
+            self._z_layers = [self._z_layers[slot] for slot in kept]
+            self._remap_selection(lambda i: None if i in doomed_set else i - bisect.bisect_left(doomed, i))
+            for index, layer, _, bounds in removed:
+                self._notify(self._bounds_rect(bounds), LayerOperation('remove', index, layers=[layer]))
+        return len(removed)
+
+    def reorder_layers(self, order: List[int]) -> bool:
+        """Rearrange the layer list; order holds each layer's old index in its new place."""
+        order = list(order)
+        if sorted(order) != list(range(len(self.layers))):
+            raise ValueError("order must be a permutation of the layer indices")
+        moved = [self._layer_ids[old] for new, old in enumerate(order) if new != old]
+        if not moved:
+            return False
+        self.layers = [self.layers[i] for i in order]
+        self._layer_ids = [self._layer_ids[i] for i in order]
+        self._positions = None
+        # List order breaks z_index ties, so the draw order is rebuilt
+        self._z_order, self._z_keys, self._z_layers = [], [], []
+        self._merge_z_order(0)
+        new_index = [0] * len(order)
+        for new, old in enumerate(order):
+            new_index[old] = new
+        self._remap_selection(new_index.__getitem__)
+        self._notify(QRectF(), LayerOperation('reorder', 0, indices=order), moved)
+        return True
+
     def move_layer(self, from_index: int, to_index: int) -> bool:
         """Move layer from one position to another."""
+        if from_index == to_index:
+            return False
         if 0 <= from_index < len(self.layers) and 0 <= to_index < len(self.layers):
+            layer_id = self._layer_ids[from_index]
+            # Only the moved layer changes place relative to its equal-z peers
+            self._unfile_z_order(layer_id)
             layer = self.layers.pop(from_index)
             self.layers.insert(to_index, layer)
-            self.layerChanged.emit()
+            self._layer_ids.pop(from_index)
+            self._layer_ids.insert(to_index, layer_id)
+            if self._positions is not None:
+                # Only layers between the two indices shift
+                low, high = min(from_index, to_index), max(from_index, to_index) + 1
+                self._positions.update(zip(self._layer_ids[low:high], range(low, high)))
+            self._file_z_order(layer_id, layer.z_index)
+
+            def remap(i: int) -> int:
+                if i == from_index:
+                    return to_index
+                if from_index < i <= to_index:
+                    return i - 1
+                if to_index <= i < from_index:
+                    return i + 1
+                return i
+            self._remap_selection(remap)
+            self._notify(self.layer_bounds(to_index), LayerOperation('move', from_index, to_index, [layer]),
+                         (layer_id,))
             return True
         return False
-    
+
+    def insert_layer(self, index: int, shape: ShapeData) -> int:
+        """Insert a layer at a list index and return the index it landed at."""
+        index = max(0, min(index, len(self.layers)))
+        if index == len(self.layers):
+            return self.add_layer(shape)
+        layer_id = self._next_layer_id
+        self._next_layer_id += 1
+        self.store.attach(shape)
+        if shape.gradient is not None:
+            shape.gradient = gradient_registry.intern(shape.gradient)
+        self.layers.insert(index, shape)
+        self._layer_ids.insert(index, layer_id)
+        if self._positions is not None:
+            self._positions.update(zip(self._layer_ids[index:], range(index, len(self._layer_ids))))
+        self._file_z_order(layer_id, shape.z_index)
+        bounds = self.paint_bounds(shape)
+        self.spatial_index.insert(layer_id, bounds)
+        self._remap_selection(lambda i: i + 1 if i >= index else i)
+        self._notify(self._bounds_rect(bounds), LayerOperation('add', index, layers=[shape]), (layer_id,))
+        return index
+
+    def update_layer(self, index: int) -> bool:
+        """Re-index a layer after its geometry was edited in place."""
+        return self._reindex(index, {})
+
+    def edit_layer(self, index: int, **changes) -> bool:
+        """Assign ShapeData fields of a layer, reporting their old and new values."""
+        if not 0 <= index < len(self.layers):
+            return False
+        layer = self.layers[index]
+        delta = {}
+        for name, value in changes.items():
+            if not hasattr(layer, name):
+                raise AttributeError(f"ShapeData has no field {name!r}")
+            old = getattr(layer, name)
+            if old != value:
+                delta[name] = (old, value)
+        if not delta:
+            return True
+        if 'gradient' in delta:
+            old_gradient, new_gradient = delta['gradient']
+            if old_gradient is not None:
+                gradient_registry.release(old_gradient)
+            if new_gradient is not None:
+                changes['gradient'] = gradient_registry.intern(new_gradient)
+        for name in delta:
+            setattr(layer, name, changes[name])
+        return self._reindex(index, delta)
+
+    def _reindex(self, index: int, changes: Dict[str, Tuple[Any, Any]]) -> bool:
+        if 0 <= index < len(self.layers):
+            layer_id = self._layer_ids[index]
+            layer = self.layers[index]
+            old_rect = self._bounds_rect(self.spatial_index.bounds(layer_id))
+            bounds = self.paint_bounds(layer)
+            self.spatial_index.insert(layer_id, bounds)
+            if layer.z_index != self._z_of[layer_id]:
+                self._unfile_z_order(layer_id)
+                self._file_z_order(layer_id, layer.z_index)
+            self._notify(old_rect.united(self._bounds_rect(bounds)),
+                         LayerOperation('update', index, layers=[layer], changes=changes), (layer_id,))
+            return True
+        return False
+
+    def set_layer_z_index(self, index: int, z_index: int) -> bool:
+        """Change a layer's z_index, keeping the draw order sorted."""
+        if 0 <= index < len(self.layers):
+            layer = self.layers[index]
+            previous = layer.z_index
+            layer.z_index = z_index
+            layer_id = self._layer_ids[index]
+            if z_index != self._z_of[layer_id]:
+                self._unfile_z_order(layer_id)
+                self._file_z_order(layer_id, z_index)
+                self._notify(self.layer_bounds(index),
+                             LayerOperation('z_index', index, layers=[layer], changes={'z_index': (previous, z_index)}),
+                             (layer_id,))
+            return True
+        return False
+
+    def translate_layers(self, indices: List[int], dx: float, dy: float) -> bool:
+        """Move many layers by the same offset in one column update."""
+        indices = [i for i in indices if 0 <= i < len(self.layers)]
+        if not indices or (dx == 0 and dy == 0):
+            return False
+        layers, layer_ids, spatial_index = self.layers, self._layer_ids, self.spatial_index
+        self.store.translate([layers[i]._row for i in indices], dx, dy)
+        # Translation leaves extents unchanged, so indexed bounds shift as they are
+        region = self._indices_rect(indices)
+        for i in indices:
+            layer_id = layer_ids[i]
+            x0, y0, x1, y1 = spatial_index.bounds(layer_id)
+            spatial_index.insert(layer_id, (x0 + dx, y0 + dy, x1 + dx, y1 + dy))
+        self._notify(region.united(region.translated(dx, dy)),
+                     LayerOperation('translate', indices[0], layers=[layers[i] for i in indices],
+                                    changes={'offset': ((0.0, 0.0), (dx, dy))}, indices=indices),
+                     [layer_ids[i] for i in indices])
+        return True
+
+    def recolor_layers(self, indices: List[int], fill=None, stroke=None) -> bool:
+        """Set fill and/or stroke colors of many layers in one column update.
+        
+        fill and stroke are a QColor for every layer, a sequence of QColors
+        or packed ARGB values with one per index, or None to leave unchanged.
+        """
+        indices = [i for i in indices if 0 <= i < len(self.layers)]
+        if not indices or (fill is None and stroke is None):
+            return False
+        store = self.store
+        rows = [self.layers[i]._row for i in indices]
+        changes = {}
+        for name, column, colors in (('fill', LayerStore.FILL, fill), ('stroke', LayerStore.STROKE, stroke)):
+            if colors is None:
+                continue
+            if isinstance(colors, QColor):
+                values = array('I', [colors.rgba()]) * len(rows)
+            else:
+                values = array('I', (color.rgba() if isinstance(color, QColor) else color for color in colors))
+            changes[name] = (store.gather(column, rows), values)
+            store.assign(column, rows, values)
+        self._notify(self._indices_rect(indices),
+                     LayerOperation('recolor', indices[0], layers=[self.layers[i] for i in indices],
+                                    changes=changes, indices=indices),
+                     [self._layer_ids[i] for i in indices])
+        return True
+
+    def clear(self):
+        """Remove all layers."""
+        removed = list(self.layers)
+        for layer in self.layers:
+            if layer.gradient is not None:
+                gradient_registry.release(layer.gradient)
+        # Removed layers keep viewing the old store rather than being copied out
+        self.store = LayerStore()
+        self.layers.clear()
+        self._layer_ids.clear()
+        self._positions = {}
+        self.spatial_index.clear()
+        self._z_order.clear()
+        self._z_keys.clear()
+        self._z_layers.clear()
+        self._z_of.clear()
+        self.selected_layers.clear()
+        self._notify(QRectF(), LayerOperation('clear', layers=removed))
+
+    def apply_operation(self, operation: LayerOperation, reverse: bool = False):
+        """Re-apply a reported operation, or revert it with reverse."""
+        kind, index = operation.kind, operation.index
+        if kind == 'add':
+            if reverse:
+                self.remove_layers(range(index, index + len(operation.layers)))
+            elif index == len(self.layers):
+                self.add_layers(operation.layers)
+            else:
+                for offset, layer in enumerate(operation.layers):
+                    self.insert_layer(index + offset, layer)
+        elif kind == 'remove':
+            if reverse:
+                self.insert_layer(index, operation.layers[0])
+            else:
+                self.remove_layer(index)
+        elif kind == 'clear':
+            if reverse:
+                self.add_layers(operation.layers)
+            else:
+                self.clear()
+        elif kind == 'move':
+            if reverse:
+                self.move_layer(operation.target, index)
+            else:
+                self.move_layer(index, operation.target)
+        elif kind in ('update', 'z_index'):
+            self.edit_layer(index, **{name: change[0 if reverse else 1] for name, change in operation.changes.items()})
+        elif kind == 'translate':
+            dx, dy = operation.changes['offset'][1]
+            if reverse:
+                dx, dy = -dx, -dy
+            self.translate_layers(operation.indices, dx, dy)
+        elif kind == 'recolor':
+            self.recolor_layers(operation.indices,
+                                **{name: change[0 if reverse else 1] for name, change in operation.changes.items()})
+        elif kind == 'reorder':
+            order = operation.indices
+            if reverse:
+                inverse = [0] * len(order)
+                for new, old in enumerate(order):
+                    inverse[old] = new
+                order = inverse
+            self.reorder_layers(order)
+
     def get_sorted_layers(self) -> List[Tuple[int, ShapeData]]:
         """Get layers sorted by z-index."""
-        indexed_layers = [(i, layer) for i, layer in enumerate(self.layers)]
-        return sorted(indexed_layers, key=lambda x: x[1].z_index)
+        return [(self._index_of(layer_id), layer) for layer_id, layer in zip(self._z_order, self._z_layers)]
+
+    @property
+    def draw_order(self) -> List[ShapeData]:
+        """Layers sorted by z-index; the maintained list itself, not a copy."""
+        return self._z_layers
+
+    def layer_bounds(self, index: int) -> QRectF:
+        """Indexed document bounds of the layer at index, glow and shadow included."""
+        return self._bounds_rect(self.spatial_index.bounds(self._layer_ids[index]))
+
+    def layers_in_region(self, rect: QRectF, after: Optional[Tuple[int, int]] = None,
+                         before: Optional[Tuple[int, int]] = None, include=()) -> List[ShapeData]:
+        """Get layers whose bounds intersect a document rectangle, sorted by z-index.
+        
+        after and before optionally keep only layers drawn strictly between
+        the layers with those draw_key()s. include holds ids of layers to
+        return whatever their indexed bounds, such as ones being animated.
+        """
+        rect = rect.normalized()
+        layer_ids = self.spatial_index.query_rect((rect.left(), rect.top(), rect.right(), rect.bottom()))
+        if include:
+            layer_ids = set(layer_ids).union(include)
+        if len(layer_ids) == len(self.layers) and after is None and before is None:
+            return self._z_layers
+        z_of = self._z_of
+        keys = sorted((z_of[layer_id], self._index_of(layer_id)) for layer_id in layer_ids)
+        if after is not None or before is not None:
+            keys = [key for key in keys if (after is None or key > after) and (before is None or key < before)]
+        return [self.layers[i] for _, i in keys]
+    
+    def layer_id(self, index: int) -> int:
+        """Stable id of the layer at index, which unlike the index survives reordering."""
+        return self._layer_ids[index]
+    
+    def draw_key(self, index: int) -> Tuple[int, int]:
+        """Sort key of the layer at index in the draw order."""
+        return self._z_of[self._layer_ids[index]], index
+    
+    def draw_positions(self, indices: List[int]) -> List[int]:
+        """Positions in draw_order of the layers at indices."""
+        position_of = {layer_id: position for position, layer_id in enumerate(self._z_order)}
+        return [position_of[self._layer_ids[i]] for i in indices]
+
+    def _indices_rect(self, indices: List[int]) -> QRectF:
+        """Union of the indexed bounds of the layers at indices."""
+        layer_ids, all_bounds = self._layer_ids, self.spatial_index.bounds
+        boxes = [all_bounds(layer_ids[i]) for i in indices]
+        return self._bounds_rect((min(box[0] for box in boxes), min(box[1] for box in boxes),
+                                  max(box[2] for box in boxes), max(box[3] for box in boxes)))
+
+    @staticmethod
+    def _bounds_rect(bounds: Optional[Bounds]) -> QRectF:
+        if bounds is None:
+            return QRectF()
+        x0, y0, x1, y1 = bounds
+        return QRectF(x0, y0, x1 - x0, y1 - y0)
+
+    def _merge_z_order(self, start: int):
+        """Merge layers appended from index start into the draw order in one pass."""
+        z_of, layer_ids, layers = self._z_of, self._layer_ids, self.layers
+        # Appended layers sort after existing ones of equal z_index
+        batch = sorted(range(start, len(layers)), key=lambda i: (z_of[layer_ids[i]], i))
+        old_order, old_keys, old_layers = self._z_order, self._z_keys, self._z_layers
+        z_order: List[int] = []
+        z_keys: List[int] = []
+        z_layers: List[ShapeData] = []
+        lo = 0
+        for i in batch:
+            z_index = z_of[layer_ids[i]]
+            slot = bisect.bisect_right(old_keys, z_index, lo)
+            if slot > lo:
+                z_order += old_order[lo:slot]
+                z_keys += old_keys[lo:slot]
+                z_layers += old_layers[lo:slot]
+                lo = slot
+            z_order.append(layer_ids[i])
+            z_keys.append(z_index)
+            z_layers.append(layers[i])
+        z_order += old_order[lo:]
+        z_keys += old_keys[lo:]
+        z_layers += old_layers[lo:]
+        self._z_order, self._z_keys, self._z_layers = z_order, z_keys, z_layers
+
+    def _file_z_order(self, layer_id: int, z_index: int):
+        """Insert a layer id into the draw order among its equal-z peers by list index."""
+        lo = bisect.bisect_left(self._z_keys, z_index)
+        hi = bisect.bisect_right(self._z_keys, z_index)
+        position = self._index_of(layer_id)
+        # Equal-z peers are kept in list order
+        lo = bisect.bisect_left(self._z_order, position, lo, hi, key=self._index_of)
+        self._z_order.insert(lo, layer_id)
+        self._z_keys.insert(lo, z_index)
+        self._z_layers.insert(lo, self.layers[position])
+        self._z_of[layer_id] = z_index
+
+    def _unfile_z_order(self, layer_id: int):
+        """Remove a layer id from the draw order; call it before the layer's list index changes."""
+        z_index = self._z_of[layer_id]
+        lo = bisect.bisect_left(self._z_keys, z_index)
+        hi = bisect.bisect_right(self._z_keys, z_index)
+        slot = bisect.bisect_left(self._z_order, self._index_of(layer_id), lo, hi, key=self._index_of)
+        del self._z_order[slot]
+        del self._z_keys[slot]
+        del self._z_layers[slot]
+
+    def _remap_selection(self, remap: Callable[[int], Optional[int]]):
+        """Rewrite selected indices after a structural change, dropping removed ones."""
+        if not self.selected_layers:
+            return
+        selected = [remap(i) for i in self.selected_layers]
+        selected = [i for i in selected if i is not None]
+        if selected != self.selected_layers:
+            self.selected_layers = selected
+            self.selectionChanged.emit()
+
+    def _index_of(self, layer_id: int) -> int:
+        """Map a stable layer id back to its current list index."""
+        if self._positions is None:
+            self._positions = dict(zip(self._layer_ids, range(len(self._layer_ids))))
+        return self._positions[layer_id]
+
+    @staticmethod
+    def shape_bounds(shape: ShapeData) -> Bounds:
+        """Axis-aligned document bounds of a shape, including rotation and stroke."""
+        return LayerManager.geometry_bounds(*shape.geometry())
+
+    @staticmethod
+    def geometry_bounds(x: float, y: float, w: float, h: float, rotation: float, stroke_width: float) -> Bounds:
+        """shape_bounds of a shape given as its geometry() values."""
+        pad = stroke_width / 2
+        if rotation % 360 == 0:
+            return (x - pad, y - pad, x + w + pad, y + h + pad)
+        # Shapes rotate around their position (see AdvancedCanvas.draw_shape)
+        angle = math.radians(rotation)
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+        xs = [x + px * cos_a - py * sin_a for px, py in ((0, 0), (w, 0), (w, h), (0, h))]
+        ys = [y + px * sin_a + py * cos_a for px, py in ((0, 0), (w, 0), (w, h), (0, h))]
+        return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
+    @staticmethod
+    def paint_bounds(shape: ShapeData) -> Bounds:
+        """shape_bounds grown to cover the shape's glow and shadow; what the spatial index holds."""
+        bounds = LayerManager.shape_bounds(shape)
+        effects = shape.effects()
+        if effects is None:
+            return bounds
+        # One unit of slack for antialiased edges of the blurred masks
+        left, top, right, bottom = effects.extent()
+        return (bounds[0] - left - 1, bounds[1] - top - 1, bounds[2] + right + 1, bounds[3] + bottom + 1)
+
+    @staticmethod
+    def paint_bounds_all(shapes: List[ShapeData]) -> List[Bounds]:
+        """paint_bounds of many shapes, computed a column at a time."""
+        if not shapes:
+            return []
+        columns = LayerStore.fields_of(shapes)
+        xs, ys, widths, heights, rotations, stroke_widths = columns[LayerStore.X:LayerStore.STROKE_WIDTH + 1]
+        if numpy is None:
+            bounds = list(map(LayerManager.geometry_bounds, xs, ys, widths, heights, rotations, stroke_widths))
+        else:
+            x, y, w, h, rotation, pad = (numpy.asarray(values, dtype=numpy.float64)
+                                         for values in (xs, ys, widths, heights, rotations, stroke_widths))
+            pad = pad / 2
+            angle = numpy.radians(rotation)
+            cos_a, sin_a = numpy.cos(angle), numpy.sin(angle)
+            # Corners (0, 0), (w, 0), (w, h), (0, h) rotated around the position
+            xs = numpy.stack((x, x + w * cos_a, x + w * cos_a - h * sin_a, x - h * sin_a))
+            ys = numpy.stack((y, y + w * sin_a, y + w * sin_a + h * cos_a, y + h * cos_a))
+            upright = rotation % 360 == 0
+            x0 = numpy.where(upright, x, xs.min(axis=0)) - pad
+            y0 = numpy.where(upright, y, ys.min(axis=0)) - pad
+            x1 = numpy.where(upright, x + w, xs.max(axis=0)) + pad
+            y1 = numpy.where(upright, y + h, ys.max(axis=0)) + pad
+            bounds = list(zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()))
+        for i, properties in enumerate(columns[LayerStore.PROPERTIES]):
+            if properties and properties.get('effects'):
+                bounds[i] = LayerManager.paint_bounds(shapes[i])
+        return bounds
+
+    @staticmethod
+    def shape_contains(shape: ShapeData, point: QPointF) -> bool:
+        """Test a document point against a shape's rotated outline."""
+        x, y, w, h, rotation, stroke_width = shape.geometry()
+        dx = point.x() - x
+        dy = point.y() - y
+        if rotation % 360:
+            angle = math.radians(-rotation)
+            cos_a, sin_a = math.cos(angle), math.sin(angle)
+            dx, dy = dx * cos_a - dy * sin_a, dx * sin_a + dy * cos_a
+        pad = stroke_width / 2
+        if not (-pad <= dx <= w + pad and -pad <= dy <= h + pad):
+            return False
+        if shape.shape_type == ShapeType.ELLIPSE and w > 0 and h > 0:
+            rx, ry = w / 2 + pad, h / 2 + pad
+            nx, ny = (dx - w / 2) / rx, (dy - h / 2) / ry
+            return nx * nx + ny * ny <= 1.0
+        outline = shape_geometry.shape_outline(shape)
+        if outline is not None:
+            return outline.containsPoint(QPointF(dx, dy), Qt.FillRule.OddEvenFill)
+        return True
+
+    def pick_layer(self, point: QPointF) -> int:
+        """Return the index of the topmost visible, unlocked layer under a point, or -1."""
+        best_index = -1
+        best_key = None
+        for layer_id in self.spatial_index.query_point(point.x(), point.y()):
+            index = self._index_of(layer_id)
+            layer = self.layers[index]
+            if not layer.visible or layer.locked:
+                continue
+            key = (layer.z_index, index)
+            if best_key is not None and key < best_key:
+                continue
+            if self.shape_contains(layer, point):
+                best_index, best_key = index, key
+        return best_index
+
+    def layers_in_rect(self, rect: QRectF, contained: bool = False) -> List[int]:
+        """Return indices of visible, unlocked layers touching (or inside) a rectangle."""
+        rect = rect.normalized()
+        query = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        indices = []
+        for layer_id in self.spatial_index.query_rect(query):
+            index = self._index_of(layer_id)
+            layer = self.layers[index]
+            if not layer.visible or layer.locked:
+                continue
+            if contained:
+                x0, y0, x1, y1 = self.shape_bounds(layer)
+                if not (query[0] <= x0 and query[1] <= y0 and x1 <= query[2] and y1 <= query[3]):
+                    continue
+            indices.append(index)
+        indices.sort()
+        return indices
+
+    def select_in_rect(self, rect: QRectF, contained: bool = False) -> List[int]:
+        """Replace the selection with the layers inside a rubber-band rectangle."""
+        self.selected_layers = self.layers_in_rect(rect, contained)
+        self.selectionChanged.emit()
+        return self.selected_layers
+
+    def select_layer(self, index: int):
+        """Replace the selection with a single layer (or clear it with -1)."""
+        self.selected_layers = [index] if 0 <= index < len(self.layers) else []
+        self.selectionChanged.emit()
+
+@dataclass
+class HistoryStep:
+    """One undoable step: the operations it undoes, in the order they were applied."""
+    operations: List[LayerOperation]
+    size: int
+    updated: float
+    sealed: bool = False
+
+class EditHistory(QObject):
+    """Undo and redo built from the deltas LayerManager reports.
+    
+    Steps keep LayerOperation records instead of copies of the document:
+    added layers are shared with it, removed layers are kept alive, and
+    field edits keep only their old and new values, so undo and redo cost
+    is proportional to the change rather than to the document. Field edits
+    to the same fields arriving within coalesce_ms of each other, such as
+    the stream from a drag, merge into one step until seal() is called. The
+    oldest steps are dropped once the history's estimated size passes
+    max_bytes.
+    """
+    
+    changed = pyqtSignal()
+    
+    # Rough footprints used for the memory cap
+    OPERATION_BYTES = 128
+    CHANGE_BYTES = 96
+    LAYER_BYTES = 1024
+    
+    def __init__(self, layer_manager: LayerManager, max_bytes: int = 32 * 1024 * 1024,
+                 coalesce_ms: float = 500.0):
+        super().__init__()
+        self.layer_manager = layer_manager
+        self.max_bytes = max_bytes
+        self.coalesce_ms = coalesce_ms
+        self._undo: deque = deque()
+        self._redo: List[HistoryStep] = []
+        self._bytes = 0
+        self._applying = False
+        layer_manager.layerOperation.connect(self._on_operation)
+        layer_manager.transactionFinished.connect(self._on_transaction)
+    
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+    
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+    
+    def undo(self) -> bool:
+        """Revert the most recent step."""
+        if not self._undo:
+            return False
+        step = self._undo.pop()
+        step.sealed = True
+        self._replay(step, reverse=True)
+        self._redo.append(step)
+        self.changed.emit()
+        return True
+    
+    def redo(self) -> bool:
+        """Re-apply the most recently undone step."""
+        if not self._redo:
+            return False
+        step = self._redo.pop()
+        self._replay(step, reverse=False)
+        self._undo.append(step)
+        self.changed.emit()
+        return True
+    
+    def seal(self):
+        """End coalescing, so the next edit starts a new step."""
+        if self._undo:
+            self._undo[-1].sealed = True
+    
+    def clear(self):
+        """Forget all steps, e.g. after a different document was loaded."""
+        self._undo.clear()
+        self._redo.clear()
+        self._bytes = 0
+        self.changed.emit()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {'undo_steps': len(self._undo), 'redo_steps': len(self._redo), 'bytes': self._bytes}
+    
+    def _on_operation(self, operation: LayerOperation):
+        if self._applying or self.layer_manager.in_transaction():
+            return  # Transactions arrive whole through _on_transaction
+        if operation.kind == 'update' and not operation.changes:
+            return  # In-place edits without a delta cannot be reverted
+        self._drop_redo()
+        
+        now = time.monotonic()
+        top = self._undo[-1] if self._undo else None
+        if (operation.kind in ('update', 'translate') and top is not None and not top.sealed
+                and (now - top.updated) * 1000 <= self.coalesce_ms
+                and all(existing.kind == operation.kind and existing.changes.keys() == operation.changes.keys()
+                        for existing in top.operations)):
+            self._coalesce(top, operation)
+            top.updated = now
+        else:
+            size = self._estimate(operation)
+            self._undo.append(HistoryStep([operation], size, now))
+            self._bytes += size
+        self._trim()
+    
+    def _on_transaction(self, summary: TransactionSummary):
+        """Record a whole transaction as one sealed step."""
+        if self._applying:
+            return
+        operations = [operation for operation in summary.operations
+                      if operation.kind != 'update' or operation.changes]
+        if not operations:
+            return
+        self._drop_redo()
+        size = sum(self._estimate(operation) for operation in operations)
+        self._undo.append(HistoryStep(operations, size, time.monotonic(), sealed=True))
+        self._bytes += size
+        self._trim()
+    
+    def _drop_redo(self):
+        for step in self._redo:
+            self._bytes -= step.size
+        self._redo.clear()
+    
+    def _trim(self):
+        while self._bytes > self.max_bytes and self._undo:
+            self._bytes -= self._undo.popleft().size
+        self.changed.emit()
+    
+    def _coalesce(self, step: HistoryStep, operation: LayerOperation):
+        """Fold a field edit into a step, keeping each layer's first old value."""
+        if operation.kind == 'translate':
+            # Offsets of the same layers add up
+            for i, existing in enumerate(step.operations):
+                if existing.indices == operation.indices:
+                    (x0, y0), (x1, y1) = existing.changes['offset'][1], operation.changes['offset'][1]
+                    step.operations[i] = LayerOperation(
+                        'translate', operation.index, layers=operation.layers,
+                        changes={'offset': ((0.0, 0.0), (x0 + x1, y0 + y1))}, indices=operation.indices)
+                    return
+        for i, existing in enumerate(step.operations):
+            if existing.kind == 'update' and existing.index == operation.index:
+                merged = {name: (existing.changes[name][0], new) for name, (_, new) in operation.changes.items()}
+                step.operations[i] = LayerOperation('update', operation.index, layers=operation.layers, changes=merged)
+                return
+        step.operations.append(operation)
+        size = self._estimate(operation)
+        step.size += size
+        self._bytes += size
+    
+    def _estimate(self, operation: LayerOperation) -> int:
+        size = self.OPERATION_BYTES + self.CHANGE_BYTES * len(operation.changes) + 8 * len(operation.indices)
+        if operation.kind == 'recolor':
+            size += sum(old.itemsize * len(old) * 2 for old, _ in operation.changes.values())
+        # Removed layers live on only in the history; added ones are shared
+        if operation.kind in ('remove', 'clear'):
+            size += self.LAYER_BYTES * len(operation.layers)
+        else:
+            size += 8 * len(operation.layers)
+        return size
+    
+    def _replay(self, step: HistoryStep, reverse: bool):
+        manager = self.layer_manager
+        self._applying = True
+        try:
+            with manager.transaction():
+                for operation in (reversed(step.operations) if reverse else step.operations):
+                    manager.apply_operation(operation, reverse)
+        finally:
+            self._applying = False
+
+class LayerTableModel(QAbstractTableModel):
+    """Name, visibility and lock state of every layer, one row per list index.
+    
+    Rows follow the LayerOperations LayerManager reports, so each change
+    inserts, removes, moves or refreshes only the rows it touched. The model
+    mirrors the layer list in its own list of references, because
+    operations arrive after the list changed and rows must keep showing the
+    old layers until the matching begin/end notifications. Operations inside
+    a transaction are applied when it ends; large transactions reset the
+    model instead. Checking Visible or Locked, or renaming a layer, writes
+    back through LayerManager.edit_layer and so is journaled and undoable.
+    """
+    
+    NAME, VISIBLE, LOCKED = range(3)
+    HEADERS = ("Name", "Visible", "Locked")
+    # Fields shown in the table; edits to others need no refresh
+    SHOWN = {'name', 'visible', 'locked'}
+    NAME_FLAGS = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEditable
+    TOGGLE_FLAGS = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsUserCheckable
+    # Transactions with more operations than this reset the model
+    RESET_OPERATIONS = 64
+    
+    def __init__(self, layer_manager: LayerManager):
+        super().__init__()
+        self.layer_manager = layer_manager
+        self._layers: List[ShapeData] = list(layer_manager.layers)
+        self._pending: List[LayerOperation] = []
+        layer_manager.layerOperation.connect(self._on_operation)
+        layer_manager.transactionFinished.connect(self._on_transaction)
+    
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._layers)
+    
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def headerData(self, section: int, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+    
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        layer = self._layers[index.row()]
+        column = index.column()
+        if column == self.NAME:
+            if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+                return layer.name
+        elif role == Qt.ItemDataRole.CheckStateRole:
+            checked = layer.visible if column == self.VISIBLE else layer.locked
+            return Qt.CheckState.Checked if checked else Qt.CheckState.Unchecked
+        return None
+    
+    def flags(self, index: QModelIndex) -> Qt.ItemFlag:
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return self.NAME_FLAGS if index.column() == self.NAME else self.TOGGLE_FLAGS
+    
+    def setData(self, index: QModelIndex, value, role=Qt.ItemDataRole.EditRole) -> bool:
+        if not index.isValid():
+            return False
+        column = index.column()
+        if column == self.NAME and role == Qt.ItemDataRole.EditRole:
+            return self.layer_manager.edit_layer(index.row(), name=str(value))
+        if column != self.NAME and role == Qt.ItemDataRole.CheckStateRole:
+            checked = Qt.CheckState(value) == Qt.CheckState.Checked
+            field_name = 'visible' if column == self.VISIBLE else 'locked'
+            return self.layer_manager.edit_layer(index.row(), **{field_name: checked})
+        return False
+    
+    def _on_operation(self, operation: LayerOperation):
+        if self.layer_manager.in_transaction():
+            self._pending.append(operation)
+        else:
+            self._apply(operation)
+    
+    def _on_transaction(self, summary: TransactionSummary):
+        pending, self._pending = self._pending, []
+        if len(pending) > self.RESET_OPERATIONS:
+            self.beginResetModel()
+            self._layers = list(self.layer_manager.layers)
+            self.endResetModel()
+            return
+        for operation in pending:
+            self._apply(operation)
+    
+    def _apply(self, operation: LayerOperation):
+        kind, index = operation.kind, operation.index
+        if kind == 'add':
+            self.beginInsertRows(QModelIndex(), index, index + len(operation.layers) - 1)
+            self._layers[index:index] = operation.layers
+            self.endInsertRows()
+        elif kind == 'remove':
+            self.beginRemoveRows(QModelIndex(), index, index)
+            del self._layers[index]
+            self.endRemoveRows()
+        elif kind == 'move':
+            # Qt counts the destination before the moved row is taken out
+            target = operation.target + 1 if operation.target > index else operation.target
+            if self.beginMoveRows(QModelIndex(), index, index, QModelIndex(), target):
+                self._layers.insert(operation.target, self._layers.pop(index))
+                self.endMoveRows()
+        elif kind == 'clear':
+            self.beginResetModel()
+            self._layers = []
+            self.endResetModel()
+        elif kind == 'reorder':
+            self.layoutAboutToBeChanged.emit()
+            self._layers = [self._layers[i] for i in operation.indices]
+            new_row = [0] * len(operation.indices)
+            for new, old in enumerate(operation.indices):
+                new_row[old] = new
+            persistent = self.persistentIndexList()
+            self.changePersistentIndexList(
+                persistent, [self.index(new_row[index.row()], index.column()) for index in persistent])
+            self.layoutChanged.emit()
+        elif kind == 'update' and (not operation.changes or self.SHOWN.intersection(operation.changes)):
+            self.dataChanged.emit(self.index(index, 0), self.index(index, len(self.HEADERS) - 1))
 
 class ColorPalette:
     """Manages color palettes and harmony generation."""
@@ -242,17 +1945,836 @@ class ColorPalette:
             QColor.fromHsv((h + 30) % 360, s, v, a)
         ]
 
-class AdvancedCanvas(QLabel):
-    """Advanced canvas with shape drawing and manipulation capabilities."""
+class LayerRasterCache:
+    """LRU cache of pre-rendered layer images within a memory budget."""
     
-    shapeSelected = pyqtSignal(int)
-    shapeModified = pyqtSignal(int)
+    def __init__(self, budget_bytes: int = 64 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[Tuple, Tuple[QImage, QRectF]]" = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
     
-    def __init__(self, layer_manager: LayerManager):
-        super().__init__()
-        self.layer_manager = layer_manager
-        self.setMinimumSize(CANVAS_WIDTH, CANVAS_HEIGHT)
-        self.setStyleSheet("border: 2px solid #333; background: white;")
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, key: Tuple) -> Optional[Tuple[QImage, QRectF]]:
+        """Return a cached (image, local target rect) pair and mark it recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    def put(self, key: Tuple, image: QImage, target: QRectF) -> bool:
+        """Store an image, evicting least recently used entries to stay in budget."""
+        cost = image.sizeInBytes()
+        if cost > self.budget_bytes:
+            return False
+        if key in self._entries:
+            self.used_bytes -= self._entries.pop(key)[0].sizeInBytes()
+        while self._entries and self.used_bytes + cost > self.budget_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.used_bytes -= evicted.sizeInBytes()
+            self.evictions += 1
+        self._entries[key] = (image, target)
+        self.used_bytes += cost
+        return True
+    
+    def set_budget(self, budget_bytes: int):
+        """Change the memory budget, evicting entries if needed."""
+        self.budget_bytes = budget_bytes
+        while self._entries and self.used_bytes > self.budget_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.used_bytes -= evicted.sizeInBytes()
+            self.evictions += 1
+    
+    def clear(self):
+        """Drop all cached images (counters are kept)."""
+        self._entries.clear()
+        self.used_bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and memory usage."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'used_bytes': self.used_bytes,
+            'budget_bytes': self.budget_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+class ShapeRenderer:
+    """Draws shapes with QPainter, optionally through a LayerRasterCache.
+    
+    Shared by AdvancedCanvas and headless rendering so both produce the same
+    pixels. Blend modes map onto QPainter composition modes, which the raster
+    engine implements for every BlendMode; a blended shape is drawn as one
+    image so its fill and stroke blend together, as a flattened layer would.
+    """
+    
+    COMPOSITION_MODES = {
+        BlendMode.NORMAL: QPainter.CompositionMode.CompositionMode_SourceOver,
+        BlendMode.MULTIPLY: QPainter.CompositionMode.CompositionMode_Multiply,
+        BlendMode.SCREEN: QPainter.CompositionMode.CompositionMode_Screen,
+        BlendMode.OVERLAY: QPainter.CompositionMode.CompositionMode_Overlay,
+        BlendMode.SOFT_LIGHT: QPainter.CompositionMode.CompositionMode_SoftLight,
+        BlendMode.HARD_LIGHT: QPainter.CompositionMode.CompositionMode_HardLight,
+        BlendMode.COLOR_DODGE: QPainter.CompositionMode.CompositionMode_ColorDodge,
+        BlendMode.COLOR_BURN: QPainter.CompositionMode.CompositionMode_ColorBurn,
+    }
+    
+    def __init__(self, raster_cache: Optional[LayerRasterCache] = None,
+                 effect_cache: Optional[LayerRasterCache] = None):
+        self.raster_cache_enabled = True
+        self.raster_cache = raster_cache if raster_cache is not None else LayerRasterCache()
+        # Blurred glow and shadow images, kept even when raster_cache_enabled is off
+        self.effect_cache = effect_cache if effect_cache is not None else LayerRasterCache(32 * 1024 * 1024)
+        # AnimationFrames to draw layers with, by id() of the layer's ShapeData
+        self.animation_frames: Dict[int, 'AnimationFrame'] = {}
+    
+    def render_layers(self, painter: QPainter, layers, zoom: float = 1.0):
+        """Draw visible layers in the given (draw) order."""
+        for layer in layers:
+            if layer.visible:
+                self.draw_shape(painter, layer, zoom)
+    
+    def draw_shape(self, painter: QPainter, shape: ShapeData, zoom: float = 1.0):
+        """Draw a shape in its blend mode, from the raster cache when enabled."""
+        if self.animation_frames:
+            frame = self.animation_frames.get(id(shape))
+            if frame is not None:
+                self._draw_animated(painter, shape, frame, zoom)
+                return
+        self._draw_blended(painter, shape, zoom)
+    
+    def _draw_animated(self, painter: QPainter, shape: ShapeData, frame: 'AnimationFrame', zoom: float):
+        painter.save()
+        painter.setTransform(frame.transform, True)
+        painter.setOpacity(painter.opacity() * frame.opacity)
+        if frame.fill is None:
+            self._draw_blended(painter, shape, zoom)
+        else:
+            shape = ShapeData.from_raw(shape.raw())
+            shape.fill_color = frame.fill
+            # Every frame brings a new color, which would only churn the raster cache
+            enabled, self.raster_cache_enabled = self.raster_cache_enabled, False
+            try:
+                self._draw_blended(painter, shape, zoom)
+            finally:
+                self.raster_cache_enabled = enabled
+        painter.restore()
+    
+    def _draw_blended(self, painter: QPainter, shape: ShapeData, zoom: float):
+        blend_mode = shape.blend_mode
+        effects = shape.effects()
+        # Devices such as PDF or SVG output cannot blend and draw every shape normally
+        if blend_mode is BlendMode.NORMAL or not painter.paintEngine().hasFeature(
+                QPaintEngine.PaintEngineFeature.BlendModes):
+            if effects is not None:
+                self.paint_effects(painter, shape, effects, zoom)
+            self._draw_shape(painter, shape, zoom, self.raster_cache_enabled)
+            return
+        # Glow and shadow are composited normally; only the shape itself blends
+        if effects is not None:
+            self.paint_effects(painter, shape, effects, zoom)
+        painter.setCompositionMode(self.COMPOSITION_MODES[blend_mode])
+        self._draw_shape(painter, shape, zoom, True)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+    
+    def _draw_shape(self, painter: QPainter, shape: ShapeData, zoom: float, as_image: bool):
+        if not as_image:
+            self.paint_shape(painter, shape)
+            return
+        
+        if not self.raster_cache_enabled:
+            self.paint_shape_image(painter, shape)
+            return
+        
+        scale = zoom * painter.device().devicePixelRatioF()
+        key = (shape.cache_key(), scale)
+        entry = self.raster_cache.get(key)
+        if entry is None:
+            entry = self.render_shape_image(shape, scale)
+            if entry is not None:
+                self.raster_cache.put(key, *entry)
+        if entry is None:
+            self.paint_shape(painter, shape)
+            return
+        
+        image, target = entry
+        painter.drawImage(target.translated(shape.position), image)
+    
+    def paint_shape_image(self, painter: QPainter, shape: ShapeData):
+        """Draw a shape through an image rasterized on the painter's pixel grid.
+        
+        Unlike cached images, which are drawn at fractional offsets, this
+        matches painting the shape directly, but fill and stroke reach the
+        device as one image.
+        """
+        x0, y0, x1, y1 = LayerManager.shape_bounds(shape)
+        transform = painter.combinedTransform()
+        device = painter.device()
+        rect = transform.mapRect(QRectF(x0, y0, x1 - x0, y1 - y0)).toAlignedRect().adjusted(-1, -1, 1, 1)
+        rect = rect.intersected(QRect(0, 0, device.width(), device.height()))
+        if rect.isEmpty():
+            return
+        
+        dpr = device.devicePixelRatioF()
+        image = QImage(math.ceil(rect.width() * dpr), math.ceil(rect.height() * dpr),
+                       QImage.Format.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(dpr)
+        image.fill(Qt.GlobalColor.transparent)
+        image_painter = QPainter(image)
+        image_painter.setRenderHints(painter.renderHints())
+        image_painter.setTransform(transform * QTransform.fromTranslate(-rect.x(), -rect.y()))
+        self.paint_shape(image_painter, shape)
+        image_painter.end()
+        
+        painter.save()
+        painter.resetTransform()
+        painter.drawImage(rect.topLeft(), image)
+        painter.restore()
+    
+    def render_shape_image(self, shape: ShapeData, scale: float) -> Optional[Tuple[QImage, QRectF]]:
+        """Rasterize a shape at its origin; returns the image and its target rect relative to position."""
+        x0, y0, x1, y1 = LayerManager.shape_bounds(shape)
+        x0 -= shape.position.x() + 1
+        y0 -= shape.position.y() + 1
+        x1 -= shape.position.x() - 1
+        y1 -= shape.position.y() - 1
+        width, height = math.ceil((x1 - x0) * scale), math.ceil((y1 - y0) * scale)
+        if width <= 0 or height <= 0 or width * height * 4 > self.raster_cache.budget_bytes:
+            return None
+        
+        image = QImage(width, height, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.GlobalColor.transparent)
+        image_painter = QPainter(image)
+        image_painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        image_painter.scale(scale, scale)
+        image_painter.translate(-x0 - shape.position.x(), -y0 - shape.position.y())
+        self.paint_shape(image_painter, shape)
+        image_painter.end()
+        
+        return image, QRectF(x0, y0, width / scale, height / scale)
+    
+    def paint_effects(self, painter: QPainter, shape: ShapeData, effects: 'TextEffectData',
+                      zoom: float = 1.0):
+        """Draw a shape's drop shadow and glow, which go beneath the shape itself."""
+        scale = zoom * painter.device().devicePixelRatioF()
+        passes = []
+        if effects.shadow_enabled:
+            passes.append((effects.shadow_blur, effects.shadow_color, effects.shadow_offset))
+        if effects.glow_enabled:
+            passes.append((effects.glow_radius, effects.glow_color, QPointF(0, 0)))
+        for blur, color, offset in passes:
+            entry = self.effect_image(shape, scale, blur, color)
+            if entry is not None:
+                image, target = entry
+                painter.drawImage(target.translated(shape.position + offset), image)
+    
+    def effect_image(self, shape: ShapeData, scale: float, blur: float,
+                     color: QColor) -> Optional[Tuple[QImage, QRectF]]:
+        """Cached blurred silhouette of a shape in a color, with its target rect relative to position.
+        
+        Position and offset are not part of the key, so dragging a shape or
+        its shadow reuses the image; only a new blur, color or geometry blurs again.
+        """
+        key = (shape.cache_key(), scale, blur, color.rgba())
+        entry = self.effect_cache.get(key)
+        if entry is None:
+            entry = self.render_effect_image(shape, scale, blur, color)
+            if entry is not None:
+                self.effect_cache.put(key, *entry)
+        return entry
+    
+    def render_effect_image(self, shape: ShapeData, scale: float, blur: float,
+                            color: QColor) -> Optional[Tuple[QImage, QRectF]]:
+        """Blur a shape's alpha by blur document units and tint it with color."""
+        rendered = self.render_shape_image(shape, scale)
+        if rendered is None:
+            return None
+        source, target = rendered
+        # Three box passes of this radius reach 3 * radius pixels, at most blur units
+        radius = int(blur * scale / 3)
+        pad = 3 * radius
+        if (source.width() + 2 * pad) * (source.height() + 2 * pad) * 4 > self.effect_cache.budget_bytes:
+            return None
+        
+        mask = self.blur_alpha(source, radius, pad)
+        image = QImage(mask.width(), mask.height(), QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(color)
+        image_painter = QPainter(image)
+        image_painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationIn)
+        image_painter.drawImage(0, 0, mask)
+        image_painter.end()
+        
+        return image, target.adjusted(-pad / scale, -pad / scale, pad / scale, pad / scale)
+    
+    @staticmethod
+    def blur_alpha(image: QImage, radius: int, pad: int) -> QImage:
+        """Alpha8 mask of image's alpha, padded by pad pixels and box blurred three times.
+        
+        Three box passes approximate a Gaussian; with NumPy each is a running
+        sum, so the cost grows with the pixel count but not with radius.
+        """
+        width, height = image.width() + 2 * pad, image.height() + 2 * pad
+        if numpy is not None:
+            source = image.convertToFormat(QImage.Format.Format_Alpha8)
+            alpha = numpy.zeros((height, width), numpy.float32)
+            alpha[pad:height - pad, pad:width - pad] = ShapeRenderer.alpha_pixels(source)
+            if radius:
+                for _ in range(3):
+                    alpha = _box_blur(_box_blur(alpha, radius, 0), radius, 1)
+            mask = QImage(width, height, QImage.Format.Format_Alpha8)
+            numpy.clip(alpha + 0.5, 0, 255, out=alpha)
+            ShapeRenderer.alpha_pixels(mask)[...] = alpha
+            return mask
+        
+        # Without NumPy, a smooth downscale and upscale stands in for the box passes
+        padded = QImage(width, height, QImage.Format.Format_ARGB32_Premultiplied)
+        padded.fill(Qt.GlobalColor.transparent)
+        image_painter = QPainter(padded)
+        image_painter.drawImage(pad, pad, image)
+        image_painter.end()
+        if radius:
+            factor = 2 * radius
+            padded = padded.scaled(max(1, width // factor), max(1, height // factor),
+                                   Qt.AspectRatioMode.IgnoreAspectRatio,
+                                   Qt.TransformationMode.SmoothTransformation).scaled(
+                width, height, Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.SmoothTransformation)
+        return padded.convertToFormat(QImage.Format.Format_Alpha8)
+    
+    @staticmethod
+    def alpha_pixels(image: QImage) -> 'numpy.ndarray':
+        """Writable (height, width) view of an Alpha8 image's pixels, valid while image lives."""
+        bits = image.bits()
+        bits.setsize(image.sizeInBytes())
+        return numpy.ndarray((image.height(), image.width()), numpy.uint8, buffer=bits,
+                             strides=(image.bytesPerLine(), 1))
+    
+    def paint_shape(self, painter: QPainter, shape: ShapeData):
+        """Draw a shape's vector geometry directly."""
+        painter.save()
+        
+        # Apply transformations
+        painter.translate(shape.position)
+        painter.rotate(shape.rotation)
+        painter.setOpacity(shape.opacity)
+        
+        # Set up brush and pen
+        if shape.gradient:
+            brush = self.create_gradient_brush(shape.gradient)
+        else:
+            brush = QBrush(shape.fill_color)
+        
+        pen = QPen(shape.stroke_color, shape.stroke_width)
+        painter.setBrush(brush)
+        painter.setPen(pen)
+        
+        # Draw based on shape type
+        if shape.shape_type == ShapeType.RECTANGLE:
+            painter.drawRect(QRectF(0, 0, shape.size.width(), shape.size.height()))
+        elif shape.shape_type == ShapeType.ELLIPSE:
+            painter.drawEllipse(QRectF(0, 0, shape.size.width(), shape.size.height()))
+        elif shape.shape_type in (ShapeType.POLYGON, ShapeType.STAR):
+            painter.drawPolygon(shape_geometry.shape_outline(shape))
+        
+        painter.restore()
+    
+    def create_gradient_brush(self, gradient: GradientData) -> QBrush:
+        """Create a gradient brush from gradient data."""
+        return gradient_registry.brush(gradient)
+
+def _box_blur(values: 'numpy.ndarray', radius: int, axis: int) -> 'numpy.ndarray':
+    """Mean over a window of 2 * radius + 1 along axis, zero outside, from running sums."""
+    values = numpy.moveaxis(values, axis, 0)
+    size = values.shape[0]
+    sums = numpy.empty((size + 1,) + values.shape[1:], numpy.float32)
+    sums[0] = 0
+    numpy.cumsum(values, axis=0, out=sums[1:])
+    index = numpy.arange(size)
+    result = sums[numpy.minimum(index + radius + 1, size)]
+    result -= sums[numpy.maximum(index - radius, 0)]
+    result *= 1.0 / (2 * radius + 1)
+    return numpy.moveaxis(result, 0, axis)
+
+# Separable blend functions of the W3C compositing spec, over unpremultiplied
+# backdrop (cb) and source (cs) color arrays in [0, 1]
+
+def _blend_multiply(cb, cs):
+    return cb * cs
+
+def _blend_screen(cb, cs):
+    return cb + cs - cb * cs
+
+def _blend_hard_light(cb, cs):
+    return numpy.where(cs <= 0.5, cb * 2 * cs, _blend_screen(cb, 2 * cs - 1))
+
+def _blend_overlay(cb, cs):
+    return _blend_hard_light(cs, cb)
+
+def _blend_soft_light(cb, cs):
+    d = numpy.where(cb <= 0.25, ((16 * cb - 12) * cb + 4) * cb, numpy.sqrt(cb))
+    return numpy.where(cs <= 0.5, cb - (1 - 2 * cs) * cb * (1 - cb), cb + (2 * cs - 1) * (d - cb))
+
+def _blend_color_dodge(cb, cs):
+    dodged = numpy.minimum(1, numpy.divide(cb, 1 - cs, out=numpy.ones_like(cb), where=cs < 1))
+    return numpy.where(cb <= 0, 0, dodged)
+
+def _blend_color_burn(cb, cs):
+    burned = 1 - numpy.minimum(1, numpy.divide(1 - cb, cs, out=numpy.ones_like(cb), where=cs > 0))
+    return numpy.where(cb >= 1, 1, burned)
+
+class LayerCompositor:
+    """Composites layers with NumPy, blending each whole layer buffer at once.
+    
+    Every layer is rasterized on its own, then blended into the output with
+    the separable blend formulas of the W3C compositing spec, vectorized over
+    the layer's pixels. The result does not depend on which composition modes
+    a paint device supports, which suits high-resolution export; the canvas
+    uses QPainter composition modes instead.
+    """
+    
+    BLEND_FUNCTIONS = {
+        BlendMode.MULTIPLY: _blend_multiply,
+        BlendMode.SCREEN: _blend_screen,
+        BlendMode.OVERLAY: _blend_overlay,
+        BlendMode.SOFT_LIGHT: _blend_soft_light,
+        BlendMode.HARD_LIGHT: _blend_hard_light,
+        BlendMode.COLOR_DODGE: _blend_color_dodge,
+        BlendMode.COLOR_BURN: _blend_color_burn,
+    }
+    
+    def __init__(self, renderer: Optional[ShapeRenderer] = None):
+        if numpy is None:
+            raise RuntimeError("LayerCompositor needs NumPy")
+        self.renderer = renderer if renderer is not None else ShapeRenderer()
+    
+    def render(self, layers, width: int, height: int, scale: float = 1.0,
+               background: Optional[QColor] = None, origin: Optional[QPointF] = None) -> QImage:
+        """Composite visible layers in the given (draw) order onto a new image."""
+        image = QImage(max(1, round(width * scale)), max(1, round(height * scale)),
+                       QImage.Format.Format_RGBA8888_Premultiplied)
+        image.fill(background if background is not None else Qt.GlobalColor.transparent)
+        output = self.pixels(image)
+        origin = origin if origin is not None else QPointF(0, 0)
+        for layer in layers:
+            if layer.visible:
+                self.composite_layer(output, layer, scale, origin)
+        return image.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+    
+    def composite_layer(self, output: 'numpy.ndarray', shape: ShapeData, scale: float, origin: QPointF):
+        """Rasterize one shape and blend it into output in the shape's blend mode.
+        
+        Glow and shadow are composited normally beneath it first, as ShapeRenderer draws them.
+        """
+        x0, y0, x1, y1 = LayerManager.paint_bounds(shape)
+        height, width = output.shape[:2]
+        left = max(0, math.floor((x0 - origin.x()) * scale) - 1)
+        top = max(0, math.floor((y0 - origin.y()) * scale) - 1)
+        right = min(width, math.ceil((x1 - origin.x()) * scale) + 1)
+        bottom = min(height, math.ceil((y1 - origin.y()) * scale) + 1)
+        if left >= right or top >= bottom:
+            return
+        
+        target = output[top:bottom, left:right]
+        layer = QImage(right - left, bottom - top, QImage.Format.Format_RGBA8888_Premultiplied)
+        effects = shape.effects()
+        passes = [(BlendMode.NORMAL, effects)] if effects is not None else []
+        passes.append((shape.blend_mode, None))
+        for blend_mode, pass_effects in passes:
+            layer.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(layer)
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.translate(-left, -top)
+            painter.scale(scale, scale)
+            painter.translate(-origin)
+            if pass_effects is not None:
+                self.renderer.paint_effects(painter, shape, pass_effects, scale)
+            else:
+                self.renderer.paint_shape(painter, shape)
+            painter.end()
+            target[...] = self.blend(target, self.pixels(layer), blend_mode)
+    
+    @staticmethod
+    def pixels(image: QImage) -> 'numpy.ndarray':
+        """Writable (height, width, 4) view of an RGBA8888 image's pixels, valid while image lives."""
+        bits = image.bits()
+        bits.setsize(image.sizeInBytes())
+        return numpy.ndarray((image.height(), image.width(), 4), numpy.uint8, buffer=bits,
+                             strides=(image.bytesPerLine(), 4, 1))
+    
+    @classmethod
+    def blend(cls, backdrop: 'numpy.ndarray', source: 'numpy.ndarray', mode: BlendMode) -> 'numpy.ndarray':
+        """Composite premultiplied RGBA8 source over backdrop in a blend mode."""
+        if mode is BlendMode.NORMAL:
+            # Source over in 16-bit integers, with an exact rounding division by 255
+            result = backdrop.astype(numpy.uint16)
+            result *= 255 - source[..., 3:].astype(numpy.uint16)
+            result += 128
+            result += result >> 8
+            result >>= 8
+            result += source
+            numpy.minimum(result, 255, out=result)
+            return result.astype(numpy.uint8)
+        
+        s = source.astype(numpy.float32)
+        s *= 1 / 255
+        b = backdrop.astype(numpy.float32)
+        b *= 1 / 255
+        sa, ba = s[..., 3:], b[..., 3:]
+        # Premultiplied separable blending: the blended color replaces source
+        # over backdrop where both are opaque
+        cs = numpy.divide(s[..., :3], sa, out=numpy.zeros_like(s[..., :3]), where=sa > 0)
+        if ba.min() == 1:
+            cb = b[..., :3]  # Opaque backdrop, typically over a background color
+        else:
+            cb = numpy.divide(b[..., :3], ba, out=numpy.zeros_like(cs), where=ba > 0)
+        mixed = cls.BLEND_FUNCTIONS[mode](cb, cs)
+        mixed -= cs
+        mixed *= sa * ba
+        b *= 1 - sa
+        b += s
+        b[..., :3] += mixed
+        numpy.clip(b, 0, 1, out=b)
+        b *= 255
+        b += 0.5
+        return b.astype(numpy.uint8)
+
+@dataclass
+class AnimationFrame:
+    """How running animations draw a layer at one instant; the layer itself is not edited.
+    
+    transform maps the layer's document coordinates (applied on top of the
+    view), opacity multiplies the layer's own, fill replaces its fill color
+    when set, and rect is the document area the animated layer covers.
+    """
+    transform: QTransform
+    opacity: float
+    fill: Optional[QColor]
+    rect: QRectF
+
+@dataclass
+class AnimationTrack:
+    """One AnimationData playing on a layer, started at start_ms on the engine clock."""
+    layer_id: int
+    shape: ShapeData
+    animation: AnimationData
+    start_ms: float
+    easing: 'array'
+    start: Tuple[float, ...]
+    delta: Tuple[float, ...]
+    
+    def value_at(self, time_ms: float) -> Optional[Tuple[float, ...]]:
+        """Eased value at time_ms, or None once the last loop has ended."""
+        progress = (time_ms - self.start_ms) / self.animation.duration
+        loops = self.animation.loop_count
+        if progress < 0:
+            progress = 0.0
+        elif loops >= 0 and progress >= max(1, loops):
+            return None
+        position = (progress % 1.0) * AnimationEngine.EASING_STEPS
+        step = int(position)
+        table = self.easing
+        eased = table[step] + (table[step + 1] - table[step]) * (position - step)
+        return tuple(start + delta * eased for start, delta in zip(self.start, self.delta))
+
+class AnimationEngine(QObject):
+    """Plays layer animations from one shared frame clock.
+    
+    Each tick samples every running AnimationTrack through a precomputed
+    easing table, combines the tracks of each layer into an AnimationFrame
+    for ShapeRenderer.animation_frames, and reports only the document areas
+    animated layers covered before and after the tick. Layers are never
+    edited, so playback stays out of the undo history and autosave journal.
+    """
+    
+    frameAdvanced = pyqtSignal(list)  # document QRectFs to repaint
+    finished = pyqtSignal()
+    
+    EASING_STEPS = 1024
+    EASING_TYPES = {name.lower(): member for name, member in QEasingCurve.Type.__members__.items()
+                    if name not in ('BezierSpline', 'TCBSpline', 'Custom', 'NCurveTypes')}
+    _easing_tables: Dict[QEasingCurve.Type, 'array'] = {}
+    
+    def __init__(self, layer_manager: LayerManager, fps: int = 60, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.layer_manager = layer_manager
+        self.fps = fps
+        self.tracks: List[AnimationTrack] = []
+        self.frames: Dict[int, AnimationFrame] = {}
+        self._rects: Dict[int, Tuple[ShapeData, QRectF]] = {}
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self._timer.setInterval(round(1000 / fps))
+        self._timer.timeout.connect(self.tick)
+        self._clock_start = time.perf_counter()
+        self._last_tick: Optional[float] = None
+        self.ticks = 0
+        self.dropped_frames = 0
+        self._tick_costs: deque = deque(maxlen=fps * 2)
+        layer_manager.layerOperation.connect(self._on_layer_operation)
+    
+    @classmethod
+    def easing_table(cls, easing: str) -> 'array':
+        """Eased progress sampled at EASING_STEPS + 1 points, shared by every track using the curve."""
+        curve_type = cls.EASING_TYPES.get(easing.replace('_', '').replace('-', '').lower())
+        if curve_type is None:
+            raise ValueError(f"Unknown easing curve {easing!r}")
+        table = cls._easing_tables.get(curve_type)
+        if table is None:
+            curve = QEasingCurve(curve_type)
+            table = array('d', (curve.valueForProgress(step / cls.EASING_STEPS)
+                                for step in range(cls.EASING_STEPS + 1)))
+            # A final element equal to the last keeps interpolation in range
+            table.append(table[-1])
+            cls._easing_tables[curve_type] = table
+        return table
+    
+    @staticmethod
+    def _vector(animation_type: AnimationType, value: Any) -> Tuple[float, ...]:
+        if animation_type is AnimationType.COLOR_TRANSITION:
+            color = QColor(value)
+            return (color.redF(), color.greenF(), color.blueF(), color.alphaF())
+        if animation_type is AnimationType.TRANSLATE:
+            if isinstance(value, QPointF):
+                return (value.x(), value.y())
+            return (float(value[0]), float(value[1]))
+        return (float(value),)
+    
+    @classmethod
+    def make_track(cls, layer_id: int, shape: ShapeData, animation: AnimationData,
+                   start_ms: float = 0.0) -> AnimationTrack:
+        """Prepare an animation for sampling; raises ValueError for unusable settings."""
+        if animation.duration <= 0:
+            raise ValueError("Animation duration must be positive")
+        start = cls._vector(animation.type, animation.start_value)
+        end = cls._vector(animation.type, animation.end_value)
+        return AnimationTrack(layer_id, shape, animation, start_ms, cls.easing_table(animation.easing),
+                              start, tuple(b - a for a, b in zip(start, end)))
+    
+    @classmethod
+    def make_tracks(cls, layers: List[ShapeData], start_ms: float = 0.0) -> List[AnimationTrack]:
+        """Tracks for the animations stored on detached layers, identified by list index."""
+        return [cls.make_track(index, layer, animation, start_ms)
+                for index, layer in enumerate(layers) for animation in layer.animations()]
+    
+    @staticmethod
+    def timeline_ms(tracks: List[AnimationTrack]) -> float:
+        """When the last finite track ends, or the longest single loop if every track repeats forever."""
+        ends = [track.start_ms + track.animation.duration * max(1, track.animation.loop_count)
+                for track in tracks if track.animation.loop_count >= 0]
+        if ends:
+            return max(ends)
+        return max((track.start_ms + track.animation.duration for track in tracks), default=0.0)
+    
+    @staticmethod
+    def sample(tracks: List[AnimationTrack], time_ms: float) -> Tuple[Dict[int, AnimationFrame], List[AnimationTrack]]:
+        """Frames of the layers animated at time_ms, keyed by id() of their ShapeData, and the tracks that ended."""
+        layers: Dict[int, List] = {}
+        ended = []
+        for track in tracks:
+            value = track.value_at(time_ms)
+            if value is None:
+                ended.append(track)
+                continue
+            # [shape, dx, dy, scale, rotation, opacity, fill]
+            state = layers.get(id(track.shape))
+            if state is None:
+                state = layers[id(track.shape)] = [track.shape, 0.0, 0.0, 1.0, 0.0, 1.0, None]
+            animation_type = track.animation.type
+            if animation_type is AnimationType.TRANSLATE:
+                state[1] += value[0]
+                state[2] += value[1]
+            elif animation_type is AnimationType.SCALE:
+                state[3] *= value[0]
+            elif animation_type is AnimationType.ROTATE:
+                state[4] += value[0]
+            elif animation_type is AnimationType.FADE:
+                state[5] *= value[0]
+            else:
+                state[6] = QColor.fromRgbF(*(min(1.0, max(0.0, channel)) for channel in value))
+        
+        frames = {}
+        for key, (shape, dx, dy, scale, rotation, opacity, fill) in layers.items():
+            x0, y0, x1, y1 = LayerManager.paint_bounds(shape)
+            rect = QRectF(x0, y0, x1 - x0, y1 - y0)
+            if scale == 1.0 and rotation == 0.0:
+                transform = QTransform.fromTranslate(dx, dy)
+            else:
+                # Scale and rotate about the center of the shape's own bounds,
+                # built in one step as painter-style calls are costly per layer
+                x0, y0, x1, y1 = LayerManager.shape_bounds(shape)
+                cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+                angle = math.radians(rotation)
+                m11, m12 = scale * math.cos(angle), scale * math.sin(angle)
+                transform = QTransform(m11, m12, -m12, m11,
+                                       cx + dx - m11 * cx + m12 * cy, cy + dy - m12 * cx - m11 * cy)
+            frames[key] = AnimationFrame(transform, min(1.0, max(0.0, opacity)), fill, transform.mapRect(rect))
+        return frames, ended
+    
+    def now(self) -> float:
+        """Milliseconds on the engine clock."""
+        return (time.perf_counter() - self._clock_start) * 1000
+    
+    def animate(self, index: int, animation: AnimationData) -> AnimationTrack:
+        """Start an animation on the layer at index from the current clock time."""
+        track = self.make_track(self.layer_manager.layer_id(index), self.layer_manager.layers[index],
+                                animation, self.now())
+        self.tracks.append(track)
+        self._start()
+        return track
+    
+    def play(self, indices: Optional[List[int]] = None) -> int:
+        """Start the animations stored on the given layers (all by default); returns how many started."""
+        manager = self.layer_manager
+        if indices is None:
+            indices = range(len(manager.layers))
+        start_ms = self.now()
+        started = 0
+        for index in indices:
+            layer = manager.layers[index]
+            for animation in layer.animations():
+                self.tracks.append(self.make_track(manager.layer_id(index), layer, animation, start_ms))
+                started += 1
+        if started:
+            self._start()
+        return started
+    
+    def stop(self):
+        """End all animations and redraw the layers as stored."""
+        self.tracks = []
+        self.tick()
+    
+    @property
+    def active(self) -> bool:
+        return bool(self.tracks or self.frames)
+    
+    def animated_ids(self, rect: QRectF) -> List[int]:
+        """Ids of layers whose animated area intersects a document rectangle."""
+        return [layer_id for layer_id, (_, area) in self._rects.items() if area.intersects(rect)]
+    
+    def tick(self):
+        """Advance every running animation to the current clock time."""
+        started = time.perf_counter()
+        if self._last_tick is not None and self._timer.isActive():
+            # A tick later than one interval means the frames in between were never shown
+            late = (started - self._last_tick) * 1000 / self._timer.interval()
+            self.dropped_frames += max(0, round(late) - 1)
+        self._last_tick = started
+        
+        frames, ended = self.sample(self.tracks, (started - self._clock_start) * 1000)
+        if ended:
+            ended = set(map(id, ended))
+            self.tracks = [track for track in self.tracks if id(track) not in ended]
+        
+        # Repaint where animated layers were and now are, or their stored
+        # bounds when they start or stop animating
+        tracks_of = {id(track.shape): track for track in self.tracks}
+        previous = self._rects
+        rects = {}
+        dirty = []
+        for key, frame in frames.items():
+            track = tracks_of[key]
+            rects[track.layer_id] = (track.shape, frame.rect)
+            if track.layer_id in previous:
+                dirty.append(previous[track.layer_id][1].united(frame.rect))
+            else:
+                dirty.append(self._stored_rect(track.shape).united(frame.rect))
+        for layer_id, (shape, area) in previous.items():
+            if layer_id not in rects:
+                dirty.append(area.united(self._stored_rect(shape)))
+        self._rects = rects
+        self.frames.clear()
+        self.frames.update(frames)
+        
+        self.ticks += 1
+        if dirty:
+            self.frameAdvanced.emit(dirty)
+        if not self.tracks:
+            self._timer.stop()
+            self._last_tick = None
+            if previous:
+                self.finished.emit()
+        self._tick_costs.append((time.perf_counter() - started) * 1000)
+    
+    @staticmethod
+    def _stored_rect(shape: ShapeData) -> QRectF:
+        x0, y0, x1, y1 = LayerManager.paint_bounds(shape)
+        return QRectF(x0, y0, x1 - x0, y1 - y0)
+    
+    def _start(self):
+        if not self._timer.isActive():
+            self._timer.start()
+    
+    def _on_layer_operation(self, operation: LayerOperation):
+        """Forget animations of removed layers."""
+        if not self.tracks or operation.kind not in ('remove', 'clear'):
+            return
+        removed = set(map(id, operation.layers))
+        self.tracks = [track for track in self.tracks if id(track.shape) not in removed]
+        for key in removed & self.frames.keys():
+            del self.frames[key]
+        # The layer manager repaints stored bounds; the animated areas are ours
+        dirty = [area for layer_id, (shape, area) in self._rects.items() if id(shape) in removed]
+        self._rects = {layer_id: entry for layer_id, entry in self._rects.items() if id(entry[0]) not in removed}
+        if dirty:
+            self.frameAdvanced.emit(dirty)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Running tracks, dropped frames and the cost of recent ticks."""
+        costs = self._tick_costs
+        return {
+            'tracks': len(self.tracks),
+            'animated_layers': len(self.frames),
+            'fps': self.fps,
+            'ticks': self.ticks,
+            'dropped_frames': self.dropped_frames,
+            'last_tick_ms': costs[-1] if costs else 0.0,
+            'mean_tick_ms': sum(costs) / len(costs) if costs else 0.0,
+            'max_tick_ms': max(costs) if costs else 0.0,
+        }
+
+@dataclass
+class EditBackdrop:
+    """Layers drawn below and above an edit in progress, flattened into images.
+    
+    Both images cover the whole widget but are painted lazily: valid is the
+    widget area already filled in, so starting an edit costs no more than the
+    repaints it triggers. edited are the layers drawn live between them, and
+    below and above the draw keys bounding them.
+    """
+    view: Tuple
+    below_image: QImage
+    above_image: QImage
+    edited: List[ShapeData]
+    below: Tuple[int, int]
+    above: Tuple[int, int]
+    valid: QRegion = field(default_factory=QRegion)
+
+class AdvancedCanvas(QLabel):
+    """Advanced canvas with shape drawing and manipulation capabilities."""
+    
+    shapeSelected = pyqtSignal(int)
+    shapeModified = pyqtSignal(int)
+    
+    GRID_COLOR = QColor(220, 220, 220)
+    # Most cells a grid tile may span to cover a whole number of device pixels
+    GRID_TILE_CELLS = 8
+    
+    def __init__(self, layer_manager: LayerManager):
+        super().__init__()
+        self.layer_manager = layer_manager
+        self.setMinimumSize(CANVAS_WIDTH, CANVAS_HEIGHT)
+        self.setStyleSheet("border: 2px solid #333; background: white;")
         self.setAcceptDrops(True)
         
         # Drawing state
@@ -263,249 +2785,2235 @@ class AdvancedCanvas(QLabel):
         self.grid_enabled = True
         self.grid_size = 20
         self.snap_to_grid = True
+        self.selecting = False
+        self.moving = False
+        self._move_origin = QPointF()
+        self._move_indices: List[int] = []
+        self._move_applied = QPointF()
+        self.polygon_sides = DEFAULT_POLYGON_SIDES
+        self.star_points = DEFAULT_STAR_POINTS
+        self.star_inner_ratio = DEFAULT_STAR_INNER_RATIO
         
         # Zoom and pan
         self.zoom_factor = 1.0
         self.pan_offset = QPointF(0, 0)
         
-        self.layer_manager.layerChanged.connect(self.update)
+        # Last painted overlay (widget space) and selection (document space),
+        # so only the area they cover is repainted when they change
+        self._overlay_rect = QRect()
+        self._selection_rect = QRectF()
+        
+        # Pre-rendered grid cell tiled across the exposed area
+        self._grid_tile: Optional[QPixmap] = None
+        self._grid_tile_key: Optional[Tuple[int, float, float]] = None
+        
+        # Shared renderer; its raster cache blits unchanged layers
+        self.renderer = ShapeRenderer()
+        
+        # While the selection is edited repeatedly, everything drawn below and
+        # above it is flattened into two widget-sized images, so each repaint
+        # only draws the edited layers between them
+        self._edit_count = 0
+        self._backdrop: Optional[EditBackdrop] = None
+        self._backdrop_blocked = False
+        
+        # One clock drives every layer animation; the renderer draws its frames
+        self.animations = AnimationEngine(layer_manager, parent=self)
+        self.renderer.animation_frames = self.animations.frames
+        self.animations.frameAdvanced.connect(self._on_animation_frame)
+        
+        self.layer_manager.regionChanged.connect(self.invalidate_document_rect)
+        self.layer_manager.selectionChanged.connect(self._on_selection_changed)
+        self.layer_manager.layerOperation.connect(self._on_layer_operation)
         
     def paintEvent(self, event):
         """Custom paint event for canvas rendering."""
+        exposed = event.rect()
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         
-        # Fill background
-        painter.fillRect(self.rect(), QColor(255, 255, 255))
-        
-        # Draw grid
-        if self.grid_enabled:
-            self.draw_grid(painter)
+        backdrop = self._current_backdrop(exposed)
+        if backdrop is None:
+            # Draw layers touching the exposed area, where they are or are animated to
+            region = self.widget_to_document(exposed)
+            animated = self.animations.animated_ids(region) if self.animations.frames else ()
+            self.paint_scene(painter, exposed, self.layer_manager.layers_in_region(region, include=animated))
+        else:
+            dpr = backdrop.below_image.devicePixelRatio()
+            source = QRectF(exposed.x() * dpr, exposed.y() * dpr, exposed.width() * dpr, exposed.height() * dpr)
+            painter.drawImage(QRectF(exposed), backdrop.below_image, source)
+            painter.save()
+            self.apply_view(painter)
+            self.renderer.render_layers(painter, backdrop.edited, self.zoom_factor)
+            painter.restore()
+            painter.drawImage(QRectF(exposed), backdrop.above_image, source)
+            self.apply_view(painter)
+        
+        # Highlight selected layers
+        if self.layer_manager.selected_layers:
+            self.draw_selection(painter)
         
-        # Apply zoom and pan
+        # Draw current shape being created
+        if self.drawing_mode:
+            self.draw_preview_shape(painter)
+        elif self.selecting:
+            self.draw_marquee(painter)
+    
+    def paint_scene(self, painter: QPainter, exposed: QRect, layers, background: bool = True):
+        """Draw the background, grid and layers over exposed, leaving the view transform applied."""
+        if background:
+            painter.fillRect(exposed, QColor(255, 255, 255))
+            if self.grid_enabled:
+                self.draw_grid(painter, exposed)
+        self.apply_view(painter)
+        self.renderer.render_layers(painter, layers, self.zoom_factor)
+    
+    def apply_view(self, painter: QPainter):
+        """Map document coordinates onto the widget (zoom and pan)."""
         painter.scale(self.zoom_factor, self.zoom_factor)
         painter.translate(self.pan_offset)
+    
+    def _current_backdrop(self, exposed: QRect) -> Optional[EditBackdrop]:
+        """Backdrop for the edited selection with exposed filled in, or None outside an edit."""
+        # Animated layers may be on either side of the edit
+        if self._edit_count < 2 or self._backdrop_blocked or self.animations.active:
+            return None
+        dpr = self.devicePixelRatioF()
+        view = (self.width(), self.height(), dpr, self.zoom_factor, self.pan_offset.x(), self.pan_offset.y(),
+                self.grid_enabled, self.grid_size)
+        backdrop = self._backdrop
+        if backdrop is None or backdrop.view != view:
+            manager = self.layer_manager
+            selected = manager.selected_layers
+            positions = manager.draw_positions(selected)
+            # A layer blending with what is below it cannot be flattened without the edit
+            if any(layer.blend_mode is not BlendMode.NORMAL for layer in manager.draw_order[max(positions) + 1:]):
+                self._backdrop_blocked = True
+                return None
+            images = []
+            for _ in range(2):
+                image = QImage(math.ceil(self.width() * dpr), math.ceil(self.height() * dpr),
+                               QImage.Format.Format_ARGB32_Premultiplied)
+                image.setDevicePixelRatio(dpr)
+                image.fill(Qt.GlobalColor.transparent)
+                images.append(image)
+            backdrop = self._backdrop = EditBackdrop(
+                view, images[0], images[1],
+                # Unselected layers drawn in between the selected ones are repainted with them
+                manager.draw_order[min(positions):max(positions) + 1],
+                min(manager.draw_key(i) for i in selected), max(manager.draw_key(i) for i in selected),
+            )
+        
+        missing = QRegion(exposed).subtracted(backdrop.valid)
+        if not missing.isEmpty():
+            rect = missing.boundingRect()
+            region = self.widget_to_document(rect)
+            for image, background, layers in (
+                (backdrop.below_image, True, self.layer_manager.layers_in_region(region, before=backdrop.below)),
+                (backdrop.above_image, False, self.layer_manager.layers_in_region(region, after=backdrop.above)),
+            ):
+                image_painter = QPainter(image)
+                image_painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+                image_painter.setClipRegion(missing)
+                self.paint_scene(image_painter, rect, layers, background)
+                image_painter.end()
+            backdrop.valid = backdrop.valid.united(missing)
+        return backdrop
+    
+    def _drop_backdrops(self):
+        self._edit_count = 0
+        self._backdrop = None
+        self._backdrop_blocked = False
+    
+    def _on_layer_operation(self, operation: LayerOperation):
+        """Count edits confined to the selection; any other change drops the backdrops."""
+        selected = self.layer_manager.selected_layers
+        if operation.kind in ('translate', 'recolor'):
+            confined = set(operation.indices) <= set(selected)
+        else:
+            confined = (operation.kind == 'update' and operation.index in selected
+                        and 'z_index' not in operation.changes)
+        if confined:
+            self._edit_count += 1
+        else:
+            self._drop_backdrops()
+    
+    def draw_grid(self, painter: QPainter, rect: Optional[QRect] = None):
+        """Draw grid lines over rect, tiling a cached pattern when its period is whole device pixels."""
+        if rect is None:
+            rect = self.rect()
+        
+        cell = self.grid_size * self.zoom_factor
+        if cell * self.devicePixelRatioF() < 2:
+            return  # Lines closer than two device pixels would fill the canvas
+        # Keep lines aligned with the panned document origin
+        origin_x = self.pan_offset.x() * self.zoom_factor
+        origin_y = self.pan_offset.y() * self.zoom_factor
+        tile = self.grid_tile()
+        if tile is None:
+            # Any tile would round the cell and drift from the document; draw exact lines instead
+            # Lines start on even coordinates so dots line up across repainted regions
+            left, top = rect.left() & ~1, rect.top() & ~1
+            right, bottom = rect.right() + 1, rect.bottom() + 1
+            painter.save()
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+            painter.setPen(QPen(self.GRID_COLOR, 1, Qt.PenStyle.DotLine))
+            painter.drawLines([QLineF(x, top, x, bottom) for x in self._grid_positions(origin_x, cell, left, right)])
+            painter.drawLines([QLineF(left, y, right, y) for y in self._grid_positions(origin_y, cell, top, bottom)])
+            painter.restore()
+            return
+        period = tile.width() / tile.devicePixelRatio()
+        offset = QPointF((rect.x() - origin_x) % period, (rect.y() - origin_y) % period)
+        painter.drawTiledPixmap(QRectF(rect), tile, offset)
+    
+    @staticmethod
+    def _grid_positions(origin: float, cell: float, low: float, high: float) -> List[float]:
+        """Widget coordinates of the grid lines from low to high along one axis."""
+        first = math.ceil((low - origin) / cell)
+        last = math.floor((high - origin) / cell)
+        return [origin + i * cell for i in range(first, last + 1)]
+    
+    def grid_tile(self) -> Optional[QPixmap]:
+        """Return the grid pattern pixmap, rebuilding it when grid size, zoom or DPR change.
+        
+        The tile spans as few cells as make a whole number of device pixels,
+        so tiling it never rounds the cell size. None if more than
+        GRID_TILE_CELLS cells would be needed; draw_grid then draws lines.
+        """
+        dpr = self.devicePixelRatioF()
+        key = (self.grid_size, self.zoom_factor, dpr)
+        if self._grid_tile_key == key:
+            return self._grid_tile
+        self._grid_tile_key = key
+        self._grid_tile = None
+        
+        cell = self.grid_size * self.zoom_factor
+        for cells in range(1, self.GRID_TILE_CELLS + 1):
+            size = cells * cell * dpr
+            if abs(size - round(size)) < 1e-6:
+                break
+        else:
+            return None
+        size = round(size)
+        tile = QPixmap(size, size)
+        tile.setDevicePixelRatio(dpr)
+        tile.fill(Qt.GlobalColor.transparent)
+        
+        extent = size / dpr
+        tile_painter = QPainter(tile)
+        tile_painter.setPen(QPen(self.GRID_COLOR, 1, Qt.PenStyle.DotLine))
+        for i in range(cells):
+            tile_painter.drawLine(QLineF(i * cell, 0, i * cell, extent))
+            tile_painter.drawLine(QLineF(0, i * cell, extent, i * cell))
+        tile_painter.end()
+        
+        self._grid_tile = tile
+        return tile
+    
+    def draw_shape(self, painter: QPainter, shape: ShapeData):
+        """Draw a shape on the canvas."""
+        self.renderer.draw_shape(painter, shape, self.zoom_factor)
+    
+    def create_gradient_brush(self, gradient: GradientData) -> QBrush:
+        """Create a gradient brush from gradient data."""
+        return self.renderer.create_gradient_brush(gradient)
+    
+    def create_polygon_points(self, size: QSizeF, sides: int) -> QPolygonF:
+        """Create polygon points."""
+        return shape_geometry.outline(ShapeType.POLYGON, size, sides)
+    
+    def create_star_points(self, size: QSizeF, points: int,
+                           inner_ratio: float = DEFAULT_STAR_INNER_RATIO) -> QPolygonF:
+        """Create star points."""
+        return shape_geometry.outline(ShapeType.STAR, size, points, inner_ratio)
+    
+    def draw_preview_shape(self, painter: QPainter):
+        """Draw preview of shape being created."""
+        painter.setPen(QPen(QColor(100, 100, 100), 1, Qt.PenStyle.DashLine))
+        painter.setBrush(Qt.BrushStyle.NoBrush)
         
-        # Draw layers
-        for index, layer in self.layer_manager.get_sorted_layers():
-            if layer.visible:
-                self.draw_shape(painter, layer)
+        rect = QRectF(self.start_point, self.current_point).normalized()
+        if self.current_tool == ShapeType.RECTANGLE:
+            painter.drawRect(rect)
+        elif self.current_tool == ShapeType.ELLIPSE:
+            painter.drawEllipse(rect)
+    
+    def draw_selection(self, painter: QPainter):
+        """Outline the bounds of selected layers."""
+        painter.setPen(QPen(QColor(42, 130, 218), 1, Qt.PenStyle.DashLine))
+        painter.setBrush(Qt.BrushStyle.NoBrush)
         
-        # Draw current shape being created
+        layers = self.layer_manager.layers
+        for index in self.layer_manager.selected_layers:
+            x0, y0, x1, y1 = LayerManager.shape_bounds(layers[index])
+            painter.drawRect(QRectF(x0, y0, x1 - x0, y1 - y0))
+    
+    def draw_marquee(self, painter: QPainter):
+        """Draw the rubber-band selection rectangle."""
+        painter.setPen(QPen(QColor(42, 130, 218), 1, Qt.PenStyle.DashLine))
+        painter.setBrush(QColor(42, 130, 218, 40))
+        painter.drawRect(QRectF(
+            self.map_to_document(self.start_point), self.map_to_document(self.current_point)
+        ).normalized())
+    
+    def map_to_document(self, point: QPointF) -> QPointF:
+        """Map a widget position to document coordinates (inverse of zoom and pan)."""
+        return QPointF(point.x() / self.zoom_factor, point.y() / self.zoom_factor) - self.pan_offset
+    
+    def widget_to_document(self, rect: QRect) -> QRectF:
+        """Map a widget rectangle to document coordinates."""
+        return QRectF(
+            self.map_to_document(QPointF(rect.topLeft())),
+            self.map_to_document(QPointF(rect.bottomRight()) + QPointF(1, 1))
+        )
+    
+    def document_to_widget(self, rect: QRectF) -> QRect:
+        """Map a document rectangle to the widget pixels it covers, padded for antialiasing."""
+        zoom = self.zoom_factor
+        widget_rect = QRectF(
+            (rect.x() + self.pan_offset.x()) * zoom, (rect.y() + self.pan_offset.y()) * zoom,
+            rect.width() * zoom, rect.height() * zoom
+        )
+        return widget_rect.toAlignedRect().adjusted(-2, -2, 2, 2)
+    
+    def invalidate_document_rect(self, rect: QRectF):
+        """Schedule a repaint of a document area (a null rect repaints everything)."""
+        if rect.isNull():
+            self.update()
+        else:
+            self.update(self.document_to_widget(rect))
+    
+    def _on_animation_frame(self, rects: List[QRectF]):
+        """Repaint the areas animated layers left and entered."""
+        for rect in rects:
+            self.update(self.document_to_widget(rect))
+    
+    def _on_selection_changed(self):
+        """Repaint the old and new selection outlines."""
+        self._drop_backdrops()
+        selection_rect = QRectF()
+        for index in self.layer_manager.selected_layers:
+            selection_rect = selection_rect.united(self.layer_manager.layer_bounds(index))
+        
+        dirty = self._selection_rect.united(selection_rect)
+        self._selection_rect = selection_rect
+        if not dirty.isNull():
+            self.update(self.document_to_widget(dirty))
+    
+    def _update_overlay(self):
+        """Repaint only the area covered by the previous and current preview/marquee."""
         if self.drawing_mode:
-            self.draw_preview_shape(painter)
+            overlay = self.document_to_widget(QRectF(self.start_point, self.current_point).normalized())
+        elif self.selecting:
+            overlay = QRectF(self.start_point, self.current_point).normalized().toAlignedRect().adjusted(-2, -2, 2, 2)
+        else:
+            overlay = QRect()
+        
+        dirty = self._overlay_rect.united(overlay)
+        self._overlay_rect = overlay
+        if not dirty.isEmpty():
+            self.update(dirty)
+    
+    def mousePressEvent(self, event):
+        """Handle mouse press for selection and shape creation."""
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.start_point = QPointF(event.position())
+            self.current_point = self.start_point
+            
+            # Shift-drag starts a rubber-band selection
+            if event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+                self.selecting = True
+                return
+            
+            # Clicking an existing shape selects it instead of drawing;
+            # dragging then moves the selection
+            index = self.layer_manager.pick_layer(self.map_to_document(self.start_point))
+            if index >= 0:
+                if index not in self.layer_manager.selected_layers:
+                    self.layer_manager.select_layer(index)
+                self.shapeSelected.emit(index)
+                layers = self.layer_manager.layers
+                self.moving = True
+                self._move_origin = self.map_to_document(self.start_point)
+                self._move_indices = [i for i in self.layer_manager.selected_layers if not layers[i].locked]
+                self._move_applied = QPointF()
+                return
+            
+            self.drawing_mode = True
+    
+    def mouseMoveEvent(self, event):
+        """Handle mouse move for shape preview."""
+        if self.drawing_mode:
+            self.current_point = QPointF(event.position())
+            if self.snap_to_grid:
+                self.current_point = self.snap_to_grid_point(self.current_point)
+            self._update_overlay()
+        elif self.selecting:
+            self.current_point = QPointF(event.position())
+            self._update_overlay()
+        elif self.moving:
+            delta = self.map_to_document(QPointF(event.position())) - self._move_origin
+            if self.snap_to_grid:
+                delta = self.snap_to_grid_point(delta)
+            # The whole selection moves by the part of the drag not yet applied
+            step = delta - self._move_applied
+            if self.layer_manager.translate_layers(self._move_indices, step.x(), step.y()):
+                self._move_applied = delta
+    
+    def mouseReleaseEvent(self, event):
+        """Handle mouse release to create shape or finish a selection."""
+        if event.button() == Qt.MouseButton.LeftButton and self.moving:
+            self.moving = False
+            if self._move_indices and not self._move_applied.isNull():
+                self.shapeModified.emit(self._move_indices[0])
+            self._move_indices = []
+        elif event.button() == Qt.MouseButton.LeftButton and self.selecting:
+            self.selecting = False
+            rect = QRectF(
+                self.map_to_document(self.start_point), self.map_to_document(self.current_point)
+            )
+            selected = self.layer_manager.select_in_rect(rect)
+            if selected:
+                self.shapeSelected.emit(selected[0])
+            self._update_overlay()
+        elif event.button() == Qt.MouseButton.LeftButton and self.drawing_mode:
+            self.drawing_mode = False
+            rect = QRectF(self.start_point, self.current_point).normalized()
+            
+            if rect.width() > 5 and rect.height() > 5:  # Minimum size
+                custom_properties = {}
+                if self.current_tool == ShapeType.POLYGON:
+                    custom_properties['sides'] = self.polygon_sides
+                elif self.current_tool == ShapeType.STAR:
+                    custom_properties['points'] = self.star_points
+                    custom_properties['inner_ratio'] = self.star_inner_ratio
+                shape = ShapeData(
+                    shape_type=self.current_tool,
+                    position=rect.topLeft(),
+                    size=rect.size(),
+                    rotation=0.0,
+                    fill_color=QColor(100, 150, 255, 200),
+                    stroke_color=QColor(50, 100, 200),
+                    stroke_width=2.0,
+                    gradient=None,
+                    opacity=1.0,
+                    blend_mode=BlendMode.NORMAL,
+                    z_index=len(self.layer_manager.layers),
+                    visible=True,
+                    locked=False,
+                    name=f"{self.current_tool.name.title()} {len(self.layer_manager.layers) + 1}",
+                    custom_properties=custom_properties
+                )
+                self.layer_manager.add_layer(shape)
+            self._update_overlay()
+    
+    def snap_to_grid_point(self, point: QPointF) -> QPointF:
+        """Snap point to grid."""
+        x = round(point.x() / self.grid_size) * self.grid_size
+        y = round(point.y() / self.grid_size) * self.grid_size
+        return QPointF(x, y)
+
+@dataclass(frozen=True)
+class ThemeIR:
+    """Normalized theme data shared by every exporter backend.
+    
+    Sections are None when the theme has no such key, so backends can tell an
+    empty section from a missing one. Each section is validated when a backend
+    first reads it, so a malformed section only fails the formats that use it.
+    `data` is the JSON-safe copy of the whole theme, including keys no backend
+    interprets.
+    """
+    digest: str
+    data: Dict[str, Any]
+    
+    @classmethod
+    def build(cls, data: Any, digest: str) -> 'ThemeIR':
+        """Wrap freshly decoded JSON theme data; the IR takes ownership of it."""
+        if not isinstance(data, dict):
+            raise ValueError("Theme data must be an object")
+        return cls(digest, data)
+    
+    @cached_property
+    def colors(self) -> Optional[Tuple[Tuple[str, int, int, int, int], ...]]:
+        if 'colors' not in self.data:
+            return None
+        colors = []
+        for name, color in self._section(self.data, 'colors').items():
+            if not isinstance(color, dict):
+                continue  # Only structured colors are exported
+            try:
+                colors.append((name, *(int(color[channel]) for channel in 'rgba')))
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Color '{name}' needs integer r, g, b and a values")
+        return tuple(colors)
+    
+    @cached_property
+    def fonts(self) -> Optional[Tuple[Tuple[str, str, Union[int, float], bool, bool], ...]]:
+        if 'fonts' not in self.data:
+            return None
+        fonts = []
+        for name, font in self._section(self.data, 'fonts').items():
+            if (not isinstance(font, dict) or not isinstance(font.get('family'), str)
+                    or isinstance(font.get('size'), bool) or not isinstance(font.get('size'), (int, float))):
+                raise ValueError(f"Font '{name}' needs a family name and a numeric size")
+            fonts.append((name, font['family'], font['size'], bool(font.get('bold')), bool(font.get('italic'))))
+        return tuple(fonts)
+    
+    @cached_property
+    def stylesheets(self) -> Optional[Tuple[Tuple[str, Dict[str, Any]], ...]]:
+        if 'stylesheets' not in self.data:
+            return None
+        stylesheets = []
+        for widget_type, styles in self._section(self.data, 'stylesheets').items():
+            if not isinstance(styles, dict):
+                raise ValueError(f"Stylesheet for '{widget_type}' must map properties to values")
+            stylesheets.append((widget_type, styles))
+        return tuple(stylesheets)
+    
+    @staticmethod
+    def _section(data: Dict[str, Any], key: str) -> Dict[str, Any]:
+        section = data[key]
+        if not isinstance(section, dict):
+            raise ValueError(f"Theme '{key}' must be an object")
+        return section
+
+class ThemeExporter:
+    """Handles theme export in various formats.
+    
+    Theme data is compiled once into a ThemeIR, memoized by a hash of its
+    content, and each format is a backend writing that IR to a text stream.
+    Exporting several formats, or regenerating one after an edit that was
+    undone, therefore costs a single traversal of the theme.
+    """
+    
+    # Bump when generated output changes so batch exports rebuild everything
+    VERSION = 2
+    
+    MAX_COMPILED = 8
+    _compiled: "OrderedDict[str, ThemeIR]" = OrderedDict()
+    _compiled_lock = QMutex()
+    
+    @classmethod
+    def compile(cls, theme_data: Dict[str, Any]) -> ThemeIR:
+        """IR for theme_data; raises ValueError unless it is an object."""
+        return cls.compile_json(json.dumps(theme_data, default=str))
+    
+    @classmethod
+    def compile_json(cls, text: str) -> ThemeIR:
+        """IR for theme data already serialized with json.dumps."""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        cls._compiled_lock.lock()
+        try:
+            theme = cls._compiled.get(digest)
+            if theme is not None:
+                cls._compiled.move_to_end(digest)
+                return theme
+        finally:
+            cls._compiled_lock.unlock()
+        
+        theme = ThemeIR.build(json.loads(text), digest)
+        cls._compiled_lock.lock()
+        try:
+            cls._compiled[digest] = theme
+            if len(cls._compiled) > cls.MAX_COMPILED:
+                cls._compiled.popitem(last=False)
+        finally:
+            cls._compiled_lock.unlock()
+        return theme
+    
+    @staticmethod
+    def write_python(theme: ThemeIR, stream):
+        """Write the theme as Python code."""
+        stream.write(
+            "# Generated by Selene Theme Stylizer Pro\n"
+            "from PyQt6.QtGui import QColor, QFont, QLinearGradient\n"
+            "from PyQt6.QtCore import Qt\n"
+            "\n"
+            "# Theme Configuration\n"
+            "class Theme:\n"
+            "    def __init__(self):"
+        )
+        
+        # Colors
+        if theme.colors is not None:
+            stream.write("\n        # Colors")
+            stream.write("".join(f"\n        self.{name} = QColor({r}, {g}, {b}, {a})"
+                                 for name, r, g, b, a in theme.colors))
+        
+        # Fonts
+        if theme.fonts is not None:
+            stream.write("\n        # Fonts")
+            for name, family, size, bold, italic in theme.fonts:
+                stream.write(f"\n        self.{name} = QFont('{family}', {size})")
+                if bold:
+                    stream.write(f"\n        self.{name}.setBold(True)")
+                if italic:
+                    stream.write(f"\n        self.{name}.setItalic(True)")
+        
+        # Stylesheets
+        if theme.stylesheets is not None:
+            stream.write("\n        # Stylesheets")
+            for widget_type, styles in theme.stylesheets:
+                stream.write(f"\n        self.{widget_type}_style = '''")
+                stream.write("".join(f"\n            {property_name}: {value};"
+                                     for property_name, value in styles.items()))
+                stream.write("\n        '''")
+    
+    @staticmethod
+    def write_css(theme: ThemeIR, stream):
+        """Write the theme as CSS/Qt StyleSheet."""
+        stream.write("/* Generated by Selene Theme Stylizer Pro */\n")
+        for widget_type, styles in theme.stylesheets or ():
+            stream.write(f"\n{widget_type} {{\n")
+            stream.write("".join(f"    {property_name}: {value};\n" for property_name, value in styles.items()))
+            stream.write("}\n")
+    
+    @staticmethod
+    def write_json(theme: ThemeIR, stream):
+        """Write the theme as JSON."""
+        # json.dump writes every token separately; hand the stream larger pieces
+        chunks = []
+        for chunk in json.JSONEncoder(indent=2).iterencode(theme.data):
+            chunks.append(chunk)
+            if len(chunks) >= 8192:
+                stream.write("".join(chunks))
+                chunks.clear()
+        stream.write("".join(chunks))
+    
+    @classmethod
+    def export_to_python(cls, theme_data: Dict[str, Any]) -> str:
+        """Export theme as Python code."""
+        return cls._export(cls.write_python, theme_data)
+    
+    @classmethod
+    def export_to_css(cls, theme_data: Dict[str, Any]) -> str:
+        """Export theme as CSS/Qt StyleSheet."""
+        return cls._export(cls.write_css, theme_data)
+    
+    @classmethod
+    def export_to_json(cls, theme_data: Dict[str, Any]) -> str:
+        """Export theme as JSON."""
+        return cls._export(cls.write_json, theme_data)
+    
+    @classmethod
+    def _export(cls, writer: Callable[[ThemeIR, Any], None], theme_data: Dict[str, Any]) -> str:
+        buffer = io.StringIO()
+        writer(cls.compile(theme_data), buffer)
+        return buffer.getvalue()
+
+class CodeGenerationSignals(QObject):
+    """Carries generated code back to the GUI thread."""
+    
+    generated = pyqtSignal(int, str, str)
+
+class CodeGenerationTask(QRunnable):
+    """Runs one exporter backend over a JSON theme snapshot on the thread pool."""
+    
+    WRITERS = {
+        'Python': ThemeExporter.write_python,
+        'CSS': ThemeExporter.write_css,
+        'JSON': ThemeExporter.write_json,
+    }
+    
+    def __init__(self, revision: int, format_type: str, theme_json: str,
+                 signals: CodeGenerationSignals):
+        super().__init__()
+        self.revision = revision
+        self.format_type = format_type
+        self.theme_json = theme_json
+        self.signals = signals
+    
+    def run(self):
+        try:
+            buffer = io.StringIO()
+            self.WRITERS[self.format_type](ThemeExporter.compile_json(self.theme_json), buffer)
+            code = buffer.getvalue()
+        except Exception as e:
+            logger.error(f"Code generation error: {e}")
+            code = f"Error generating code: {str(e)}"
+        self.signals.generated.emit(self.revision, self.format_type, code)
+
+class CodeGenerator(QObject):
+    """Generates the code panel's output off the GUI thread.
+    
+    Every theme change bumps a revision counter and (re)starts a short debounce
+    timer, so a burst of color picks costs one generation. At most one task runs
+    at a time; results are cached per format under the revision they were built
+    from, which makes switching back to an up-to-date format free. Results for an
+    outdated revision are cached but not shown, and trigger a fresh generation.
+    """
+    
+    codeReady = pyqtSignal(str, str)  # format, code
+    
+    DEBOUNCE_MS = 150
+    
+    def __init__(self, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.revision = 0
+        self.format_type = "Python"
+        self._theme: Dict[str, Any] = {}
+        self._snapshot: Tuple[int, str] = (-1, "")
+        self._cache: Dict[str, Tuple[int, str]] = {}
+        self._running = False
+        self._signals = CodeGenerationSignals()
+        self._signals.generated.connect(self._on_generated)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DEBOUNCE_MS)
+        self._timer.timeout.connect(self._start)
+    
+    def set_theme(self, theme_data: Dict[str, Any]):
+        """Note a theme change; output is regenerated once edits pause."""
+        self._theme = theme_data
+        self.revision += 1
+        self._timer.start()
+    
+    def request(self, format_type: str):
+        """Switch to format_type, answering from the cache when it is current."""
+        self.format_type = format_type
+        cached = self._cache.get(format_type)
+        if cached and cached[0] == self.revision:
+            self.codeReady.emit(format_type, cached[1])
+        elif not self._timer.isActive():
+            self._start()
+    
+    def _start(self):
+        cached = self._cache.get(self.format_type)
+        if self._running or (cached and cached[0] == self.revision):
+            return
+        self._running = True
+        # The task works on a snapshot; the GUI keeps editing the live dict
+        if self._snapshot[0] != self.revision:
+            self._snapshot = (self.revision, json.dumps(self._theme, default=str))
+        task = CodeGenerationTask(self.revision, self.format_type, self._snapshot[1], self._signals)
+        QThreadPool.globalInstance().start(task)
+    
+    def _on_generated(self, revision: int, format_type: str, code: str):
+        self._running = False
+        cached = self._cache.get(format_type)
+        if not cached or cached[0] <= revision:
+            self._cache[format_type] = (revision, code)
+        if revision == self.revision and format_type == self.format_type:
+            self.codeReady.emit(format_type, code)
+        elif not self._timer.isActive():
+            self._start()
+
+def _common_prefix_length(a: str, b: str) -> int:
+    """Length of the longest common prefix, by binary search over C-level slice compares."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _utf16_length(text: str) -> int:
+    """Length of text in the UTF-16 code units Qt documents count positions in."""
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+def replace_text_incrementally(editor: QTextEdit, text: str):
+    """Replace the editor's plain text by rewriting only the span that differs.
+    
+    Unlike setPlainText this keeps the cursor and any selection outside the
+    changed span where they were. Wholesale changes such as a format switch are
+    cheaper to reload than to splice, so those only keep the scroll position.
+    """
+    old = editor.toPlainText()
+    if old == text:
+        return
+    prefix = _common_prefix_length(old, text)
+    suffix = _common_prefix_length(old[prefix:][::-1], text[prefix:][::-1])
+    
+    vertical, horizontal = editor.verticalScrollBar(), editor.horizontalScrollBar()
+    scroll = (vertical.value(), horizontal.value())
+    if prefix + suffix < min(len(old), len(text)) // 2:
+        editor.setPlainText(text)
+    else:
+        start = _utf16_length(old[:prefix])
+        removed = _utf16_length(old[prefix:len(old) - suffix])
+        cursor = QTextCursor(editor.document())
+        cursor.setPosition(start)
+        cursor.setPosition(start + removed, QTextCursor.MoveMode.KeepAnchor)
+        cursor.insertText(text[prefix:len(text) - suffix])
+    vertical.setValue(scroll[0])
+    horizontal.setValue(scroll[1])
+
+class ProjectSerializer:
+    """Converts projects to and from the JSON .stheme format.
+    
+    Files ending in .sthemeb are written in the packed binary format instead,
+    and packed files are recognized by their magic bytes on load.
+    """
+    
+    VERSION = '1.1'
+    # Packed records decoded per LayerStore handed to iter_load's consumer
+    PACKED_CHUNK = 5000
+    
+    @staticmethod
+    def color_to_dict(color: QColor) -> Dict[str, int]:
+        return {'r': color.red(), 'g': color.green(), 'b': color.blue(), 'a': color.alpha()}
+    
+    @staticmethod
+    def rgba_to_dict(rgba: int) -> Dict[str, int]:
+        """color_to_dict of a packed ARGB value."""
+        return {'r': rgba >> 16 & 0xff, 'g': rgba >> 8 & 0xff, 'b': rgba & 0xff, 'a': rgba >> 24}
+    
+    @staticmethod
+    def color_from_dict(data: Dict[str, int]) -> QColor:
+        return QColor(data['r'], data['g'], data['b'], data.get('a', 255))
+    
+    @classmethod
+    def gradient_to_dict(cls, gradient: GradientData) -> Dict[str, Any]:
+        return {
+            'type': gradient.type.name,
+            'start_point': [gradient.start_point.x(), gradient.start_point.y()],
+            'end_point': [gradient.end_point.x(), gradient.end_point.y()],
+            'radius': gradient.radius,
+            'angle': gradient.angle,
+            'stops': [
+                {'position': stop.position, 'color': cls.color_to_dict(stop.color)}
+                for stop in gradient.stops
+            ],
+        }
+    
+    @classmethod
+    def gradient_from_dict(cls, data: Dict[str, Any]) -> GradientData:
+        return GradientData(
+            type=GradientType[data['type']],
+            start_point=QPointF(*data['start_point']),
+            end_point=QPointF(*data['end_point']),
+            radius=data['radius'],
+            angle=data['angle'],
+            stops=[ColorStop(stop['position'], cls.color_from_dict(stop['color'])) for stop in data['stops']],
+        )
+    
+    @classmethod
+    def shape_to_dict(cls, shape: ShapeData) -> Dict[str, Any]:
+        return cls.values_to_dict(shape.raw())
+    
+    @classmethod
+    def values_to_dict(cls, values: Sequence) -> Dict[str, Any]:
+        """Dictionary form of one layer's field values in LayerStore column order."""
+        (x, y, width, height, rotation, stroke_width, opacity, fill, stroke, z_index,
+         shape_type, blend_mode, flags, name, gradient, properties) = values
+        return {
+            'shape_type': LayerStore.SHAPE_TYPES[shape_type].name,
+            'position': [x, y],
+            'size': [width, height],
+            'rotation': rotation,
+            'fill_color': cls.rgba_to_dict(fill),
+            'stroke_color': cls.rgba_to_dict(stroke),
+            'stroke_width': stroke_width,
+            'gradient': cls.gradient_to_dict(gradient) if gradient else None,
+            'opacity': opacity,
+            'blend_mode': LayerStore.BLEND_MODES[blend_mode].name,
+            'z_index': z_index,
+            'visible': bool(flags & LayerStore.VISIBLE),
+            'locked': bool(flags & LayerStore.LOCKED),
+            'name': name,
+            'custom_properties': properties or {},
+        }
+    
+    @classmethod
+    def shape_from_dict(cls, data: Dict[str, Any]) -> ShapeData:
+        fill, stroke = data['fill_color'], data['stroke_color']
+        x, y = data['position']
+        width, height = data['size']
+        return ShapeData.from_raw([
+            float(x), float(y), float(width), float(height), data['rotation'], data['stroke_width'],
+            data['opacity'],
+            # Packed ARGB, as QColor.rgba() gives it
+            fill.get('a', 255) << 24 | fill['r'] << 16 | fill['g'] << 8 | fill['b'],
+            stroke.get('a', 255) << 24 | stroke['r'] << 16 | stroke['g'] << 8 | stroke['b'],
+            data['z_index'],
+            LayerStore.SHAPE_TYPE_INDEX[ShapeType[data['shape_type']]],
+            LayerStore.BLEND_MODE_INDEX[BlendMode[data['blend_mode']]],
+            (LayerStore.VISIBLE if data['visible'] else 0) | (LayerStore.LOCKED if data['locked'] else 0),
+            data['name'],
+            cls.gradient_from_dict(data['gradient']) if data.get('gradient') else None,
+            data.get('custom_properties') or None,
+        ])
+    
+    @classmethod
+    def to_dict(cls, theme: Dict[str, Any], layers: List[ShapeData]) -> Dict[str, Any]:
+        return {
+            'version': cls.VERSION,
+            'theme': theme,
+            'layers': [cls.shape_to_dict(layer) for layer in layers],
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[ShapeData]]:
+        layers = [cls._read_layer(layer_data) for layer_data in data.get('layers', [])]
+        return data.get('theme', {}), [layer for layer in layers if layer is not None]
+    
+    @classmethod
+    def _read_layer(cls, layer_data: Dict[str, Any]) -> Optional[ShapeData]:
+        try:
+            return cls.shape_from_dict(layer_data)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            # Version 1.0 files stored layers as unparseable reprs
+            name = layer_data.get('name') if isinstance(layer_data, dict) else None
+            logger.warning("Skipping unreadable layer %r: %s", name, e)
+            return None
+    
+    @classmethod
+    def save(cls, file_path: str, theme: Dict[str, Any], layers: List[ShapeData]):
+        cls.save_columns(file_path, theme, LayerStore.fields_of(layers))
+    
+    @classmethod
+    def save_columns(cls, file_path: str, theme: Dict[str, Any], columns: List[List[Any]]):
+        """Save layer values taken with LayerStore.fields_of, e.g. on a thread other than the GUI's."""
+        if file_path.lower().endswith(PackedProject.EXTENSION):
+            PackedProject.save_columns(file_path, theme, columns)
+            return
+        with open(file_path, 'w') as f:
+            json.dump({
+                'version': cls.VERSION,
+                'theme': theme,
+                'layers': [cls.values_to_dict(values) for values in zip(*columns)],
+            }, f, indent=2, default=str)
+    
+    @classmethod
+    def load(cls, file_path: str) -> Tuple[Dict[str, Any], Sequence]:
+        """Read a project; packed files return lazily decoded PackedLayers."""
+        if PackedProject.is_packed(file_path):
+            return PackedProject.open(file_path)
+        with open(file_path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def iter_load(cls, file_path: str) -> Iterator[Tuple[str, Any, float]]:
+        """Read a project incrementally.
+        
+        Yields ('theme', dict, fraction) and ('layer', ShapeData, fraction)
+        events in file order, where fraction is how much of the file has
+        been read. JSON layers are decoded one array element at a time
+        rather than with a single json.load of the whole document.
+        """
+        if PackedProject.is_packed(file_path):
+            theme, layers = PackedProject.open(file_path)
+            try:
+                yield 'theme', theme, 0.0
+                count = len(layers)
+                for start in range(0, count, cls.PACKED_CHUNK):
+                    for i, shape in enumerate(layers.shapes(start, start + cls.PACKED_CHUNK), start):
+                        yield 'layer', shape, (i + 1) / count
+            finally:
+                layers.close()
+            return
+        
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        decoder = json.JSONDecoder()
+        skip = json.decoder.WHITESPACE.match
+        length = max(1, len(text))
+        
+        def expect(pos: int, token: str) -> int:
+            pos = skip(text, pos).end()
+            if text[pos:pos + 1] != token:
+                raise ValueError(f"Expected {token!r} at offset {pos} of {file_path}")
+            return skip(text, pos + 1).end()
+        
+        pos = expect(0, '{')
+        while text[pos:pos + 1] != '}':
+            key, pos = decoder.raw_decode(text, pos)
+            pos = expect(pos, ':')
+            if key == 'layers' and text[pos:pos + 1] == '[':
+                pos = skip(text, pos + 1).end()
+                while text[pos:pos + 1] != ']':
+                    layer_data, pos = decoder.raw_decode(text, pos)
+                    layer = cls._read_layer(layer_data)
+                    if layer is not None:
+                        yield 'layer', layer, pos / length
+                    pos = skip(text, pos).end()
+                    if text[pos:pos + 1] == ',':
+                        pos = skip(text, pos + 1).end()
+                pos += 1
+            else:
+                value, pos = decoder.raw_decode(text, pos)
+                if key == 'theme':
+                    yield 'theme', value, pos / length
+            pos = skip(text, pos).end()
+            if text[pos:pos + 1] == ',':
+                pos = skip(text, pos + 1).end()
+
+class ProjectLoadWorker(QThread):
+    """Parses a project off the GUI thread, emitting its layers in batches."""
+    
+    themeLoaded = pyqtSignal(object)
+    layersParsed = pyqtSignal(list, float)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, file_path: str, first_batch: int = 2000, batch_size: int = 5000):
+        super().__init__()
+        self.file_path = file_path
+        self.first_batch = first_batch
+        self.batch_size = batch_size
+    
+    def run(self):
+        batch = []
+        # A small first batch makes the canvas useful as early as possible
+        limit = self.first_batch
+        fraction = 0.0
+        try:
+            for kind, value, fraction in ProjectSerializer.iter_load(self.file_path):
+                if kind == 'theme':
+                    self.themeLoaded.emit(value)
+                    continue
+                batch.append(value)
+                if len(batch) >= limit:
+                    if self.isInterruptionRequested():
+                        return
+                    self.layersParsed.emit(batch, fraction)
+                    batch = []
+                    limit = self.batch_size
+            self.layersParsed.emit(batch, 1.0)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class ProjectLoader(QObject):
+    """Streams a project file into a LayerManager without blocking the GUI thread.
+    
+    A ProjectLoadWorker parses layers in batches; parsed layers are queued
+    and added to the layer manager from a zero-interval timer, a bounded
+    time slice per tick, so the canvas repaints and input stays responsive
+    while a large project arrives.
+    """
+    
+    themeLoaded = pyqtSignal(object)
+    # Index of the first added layer and how many were added
+    layersLoaded = pyqtSignal(int, int)
+    progressChanged = pyqtSignal(int)
+    loadFinished = pyqtSignal(str, int)
+    loadFailed = pyqtSignal(str, str)
+    
+    def __init__(self, layer_manager: LayerManager, time_slice_ms: float = 12.0, step: int = 500):
+        super().__init__()
+        self.layer_manager = layer_manager
+        self.time_slice_ms = time_slice_ms
+        self.step = step
+        self.file_path = ''
+        
+        self._worker: Optional[ProjectLoadWorker] = None
+        self._pending: deque = deque()
+        self._parsed_fraction = 0.0
+        self._parsing = False
+        self._loaded = 0
+        
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._process_pending)
+    
+    def load(self, file_path: str):
+        """Replace the layer manager's contents with the project at file_path."""
+        self.cancel()
+        self.layer_manager.clear()
+        self.file_path = file_path
+        self._parsed_fraction = 0.0
+        self._parsing = True
+        self._loaded = 0
+        self.progressChanged.emit(0)
+        
+        worker = ProjectLoadWorker(file_path)
+        worker.themeLoaded.connect(self._on_theme_loaded)
+        worker.layersParsed.connect(self._on_layers_parsed)
+        worker.failed.connect(self._on_failed)
+        self._worker = worker
+        worker.start()
+    
+    def is_busy(self) -> bool:
+        """True while a project is being parsed or fed into the layer manager."""
+        return self._parsing or bool(self._pending)
+    
+    def cancel(self):
+        """Abandon the current load, keeping whatever layers already arrived."""
+        self._timer.stop()
+        self._pending.clear()
+        self._parsing = False
+        if self._worker is not None:
+            self._worker.requestInterruption()
+            self._worker.wait()
+            self._worker = None
+    
+    def _on_theme_loaded(self, theme: Dict[str, Any]):
+        if self.sender() is self._worker:
+            self.themeLoaded.emit(theme)
+    
+    def _on_layers_parsed(self, batch: list, fraction: float):
+        if self.sender() is not self._worker:
+            return  # A cancelled load's last queued batch
+        if batch:
+            self._pending.append(batch)
+        self._parsed_fraction = fraction
+        if fraction >= 1.0:
+            self._parsing = False
+        if not self._timer.isActive():
+            self._timer.start()
+    
+    def _on_failed(self, message: str):
+        if self.sender() is not self._worker:
+            return
+        self._parsing = False
+        self._worker.wait()
+        self._worker = None
+        logger.error("Failed to load project %s: %s", self.file_path, message)
+        self.loadFailed.emit(self.file_path, message)
+    
+    def _process_pending(self):
+        """Add queued layers until this tick's time slice is used up."""
+        deadline = time.perf_counter() + self.time_slice_ms / 1000
+        while self._pending and time.perf_counter() < deadline:
+            batch = self._pending[0]
+            piece = batch[:self.step]
+            start = len(self.layer_manager.layers)
+            # Dequeue only afterwards so is_busy() holds while listeners react
+            self.layer_manager.add_layers(piece)
+            if len(batch) > self.step:
+                self._pending[0] = batch[self.step:]
+            else:
+                self._pending.popleft()
+            self._loaded += len(piece)
+            self.layersLoaded.emit(start, len(piece))
+        
+        queued = sum(len(batch) for batch in self._pending)
+        total = self._loaded + queued
+        fed = self._loaded / total if total else 1.0
+        self.progressChanged.emit(round(100 * self._parsed_fraction * fed))
+        if not self.is_busy():
+            self._timer.stop()
+            if self._worker is not None:
+                self._worker.wait()
+                self._worker = None
+                logger.info("Project loaded from %s (%d layers)", self.file_path, self._loaded)
+                self.loadFinished.emit(self.file_path, self._loaded)
+
+class PackedProject:
+    """Versioned binary .sthemeb project format.
+    
+    A fixed header is followed by one fixed-size record per layer, a heap of
+    UTF-8 names and custom property JSON, and a JSON block holding the theme,
+    the enum name tables records index into and the de-duplicated gradients.
+    Records are read in place from a memory map, so opening costs the same
+    whatever the layer count. Adding the layers to a document still reads
+    every record, column by column into the LayerStore, since the layer
+    manager indexes each layer's bounds.
+    """
+    
+    MAGIC = b'STHB'
+    VERSION = 1
+    EXTENSION = '.sthemeb'
+    # magic, version, flags, layer count, record size,
+    # records offset, heap offset, heap length, meta offset, meta length
+    HEADER = struct.Struct('<4sHHIIQQQQQ')
+    # shape type, blend mode, flags, x, y, width, height, rotation, stroke width,
+    # opacity, fill rgba, stroke rgba, z_index, gradient (-1 for none),
+    # then heap offset and length of the name and of the custom properties
+    RECORD = struct.Struct('<BBBxdddddddIIiiQIQI')
+    VISIBLE = 0x01
+    LOCKED = 0x02
+    
+    @classmethod
+    def is_packed(cls, file_path: str) -> bool:
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+    
+    @classmethod
+    def save(cls, file_path: str, theme: Dict[str, Any], layers: List[ShapeData]):
+        """Write layers as packed records, replacing the file atomically."""
+        cls.save_columns(file_path, theme, LayerStore.fields_of(layers))
+    
+    @classmethod
+    def save_columns(cls, file_path: str, theme: Dict[str, Any], columns: List[List[Any]]):
+        """Write layer values taken with LayerStore.fields_of as packed records."""
+        count = len(columns[0])
+        gradients: List[Dict[str, Any]] = []
+        gradient_slots: Dict[Tuple, int] = {}
+        heap = bytearray()
+        # Identical custom property blobs are stored once and shared by offset
+        property_offsets: Dict[bytes, int] = {}
+        records = bytearray(cls.RECORD.size * count)
+        
+        # Enum indices and flag bits are LayerStore's, matching the meta lists below
+        for i, (x, y, width, height, rotation, stroke_width, opacity, fill, stroke, z_index,
+                shape_type, blend_mode, flags, name, gradient_data,
+                custom_properties) in enumerate(zip(*columns)):
+            gradient = -1
+            if gradient_data is not None:
+                key = gradient_data.cache_key()
+                gradient = gradient_slots.get(key, -1)
+                if gradient < 0:
+                    gradient = gradient_slots[key] = len(gradients)
+                    gradients.append(ProjectSerializer.gradient_to_dict(gradient_data))
+            name = name.encode('utf-8')
+            name_offset = len(heap)
+            heap += name
+            properties = b''
+            properties_offset = 0
+            if custom_properties:
+                properties = json.dumps(custom_properties, separators=(',', ':'), default=str).encode('utf-8')
+                properties_offset = property_offsets.get(properties, -1)
+                if properties_offset < 0:
+                    properties_offset = property_offsets[properties] = len(heap)
+                    heap += properties
+            cls.RECORD.pack_into(
+                records, i * cls.RECORD.size,
+                shape_type, blend_mode, flags, x, y, width, height, rotation, stroke_width, opacity,
+                fill, stroke, z_index, gradient, name_offset, len(name), properties_offset, len(properties)
+            )
+        
+        meta = json.dumps({
+            'theme': theme,
+            'shape_types': [shape_type.name for shape_type in LayerStore.SHAPE_TYPES],
+            'blend_modes': [blend_mode.name for blend_mode in LayerStore.BLEND_MODES],
+            'gradients': gradients,
+        }, default=str).encode('utf-8')
+        records_offset = cls.HEADER.size
+        heap_offset = records_offset + len(records)
+        meta_offset = heap_offset + len(heap)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, count, cls.RECORD.size,
+                                 records_offset, heap_offset, len(heap), meta_offset, len(meta))
+        
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for block in (header, records, heap, meta):
+                f.write(block)
+        os.replace(temp_path, file_path)
+    
+    @classmethod
+    def open(cls, file_path: str) -> Tuple[Dict[str, Any], 'PackedLayers']:
+        """Map a packed project and return its theme and lazily decoded layers."""
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < cls.HEADER.size:
+                raise ValueError(f"{file_path} is truncated")
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, _flags, count, record_size, records_offset,
+             heap_offset, heap_length, meta_offset, meta_length) = cls.HEADER.unpack_from(buffer)
+            if magic != cls.MAGIC:
+                raise ValueError(f"{file_path} is not a packed project")
+            if version > cls.VERSION:
+                raise ValueError(f"{file_path} uses packed format version {version}, newer than {cls.VERSION}")
+            # Records may grow trailing fields in later versions; the stride comes from the header
+            if (record_size < cls.RECORD.size or records_offset + count * record_size > size
+                    or heap_offset + heap_length > size or meta_offset + meta_length > size):
+                raise ValueError(f"{file_path} is corrupt")
+            meta = json.loads(buffer[meta_offset:meta_offset + meta_length])
+            layers = PackedLayers(buffer, count, record_size, records_offset, heap_offset, meta)
+        except Exception:
+            buffer.close()
+            raise
+        return meta.get('theme', {}), layers
+
+class PackedLayers(Sequence):
+    """Layer records of a packed project, decoded into ShapeData on first access.
+    
+    Indexing a record again returns the same object. The memory map is
+    released once every record has been decoded, or by close().
+    """
+    
+    def __init__(self, buffer: mmap.mmap, count: int, record_size: int,
+                 records_offset: int, heap_offset: int, meta: Dict[str, Any]):
+        self._buffer: Optional[mmap.mmap] = buffer
+        self._count = count
+        self._record_size = record_size
+        self._records_offset = records_offset
+        self._heap_offset = heap_offset
+        # File enum indices mapped to LayerStore ones; the flag bits are shared
+        self._shape_types = [LayerStore.SHAPE_TYPE_INDEX[ShapeType[name]] for name in meta['shape_types']]
+        self._blend_modes = [LayerStore.BLEND_MODE_INDEX[BlendMode[name]] for name in meta['blend_modes']]
+        self._gradient_data: List[Dict[str, Any]] = meta.get('gradients', [])
+        self._gradients: Dict[int, GradientData] = {}
+        self._properties: Dict[int, Dict[str, Any]] = {}
+        self._decoded: List[Optional[ShapeData]] = [None] * count
+        self._remaining = count
+        if not count:
+            self.close()
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("layer index out of range")
+        shape = self._decoded[index]
+        if shape is None:
+            shape = self._decoded[index] = self._decode(index)
+            self._remaining -= 1
+            if not self._remaining:
+                self.close()
+        return shape
+    
+    @property
+    def decoded_count(self) -> int:
+        return self._count - self._remaining
+    
+    def columns(self, start: int = 0, stop: Optional[int] = None) -> List[List[Any]]:
+        """Records start to stop decoded straight into LayerStore column order.
+    
+        No ShapeData is built and the records are not cached, so this is
+        the cheap way to move many records into a store at once.
+        """
+        buffer = self._buffer
+        if buffer is None:
+            raise ValueError("packed project is closed")
+        stop = self._count if stop is None else min(stop, self._count)
+        count = max(0, stop - start)
+        record = PackedProject.RECORD
+        begin = self._records_offset + start * self._record_size
+        if self._record_size == record.size:
+            records = list(record.iter_unpack(buffer[begin:begin + count * record.size]))
+        else:
+            records = [record.unpack_from(buffer, begin + i * self._record_size) for i in range(count)]
+        if not records:
+            return [[] for _ in range(LayerStore.PROPERTIES + 1)]
+        (shape_types, blend_modes, flags, x, y, width, height, rotation, stroke_width, opacity,
+         fill, stroke, z_index, gradients, name_offsets, name_lengths,
+         properties_offsets, properties_lengths) = zip(*records)
+        heap = self._heap_offset
+        shape_type_of, blend_mode_of = self._shape_types, self._blend_modes
+        mask = PackedProject.VISIBLE | PackedProject.LOCKED
+        return [
+            x, y, width, height, rotation, stroke_width, opacity, fill, stroke, z_index,
+            [shape_type_of[i] for i in shape_types], [blend_mode_of[i] for i in blend_modes],
+            [value & mask for value in flags],
+            [buffer[heap + offset:heap + offset + length].decode('utf-8')
+             for offset, length in zip(name_offsets, name_lengths)],
+            [self._gradient(slot) if slot >= 0 else None for slot in gradients],
+            [self._custom_properties(heap + offset, length) if length else None
+             for offset, length in zip(properties_offsets, properties_lengths)],
+        ]
+    
+    def shapes(self, start: int = 0, stop: Optional[int] = None) -> List[ShapeData]:
+        """Records start to stop as views of a LayerStore of their own.
+    
+        Unlike indexing, every call returns new shapes. LayerStore.attach_all
+        moves them into another store column by column.
+        """
+        columns = self.columns(start, stop)
+        store = LayerStore()
+        return store.shapes(store.extend(columns), len(columns[0]))
+    
+    def close(self):
+        """Release the memory map; records not yet decoded become unreadable."""
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+    
+    def _gradient(self, slot: int) -> GradientData:
+        gradient = self._gradients.get(slot)
+        if gradient is None:
+            gradient = self._gradients[slot] = ProjectSerializer.gradient_from_dict(self._gradient_data[slot])
+        return gradient
+    
+    def _custom_properties(self, offset: int, length: int) -> Dict[str, Any]:
+        """Decode a shared property blob once; flat dicts are handed out as copies."""
+        properties = self._properties.get(offset)
+        if properties is None:
+            properties = json.loads(self._buffer[offset:offset + length].decode('utf-8'))
+            if any(isinstance(value, (dict, list)) for value in properties.values()):
+                return properties
+            self._properties[offset] = properties
+        return dict(properties)
+    
+    def _decode(self, index: int) -> ShapeData:
+        buffer = self._buffer
+        if buffer is None:
+            raise ValueError("packed project is closed")
+        (shape_type, blend_mode, flags, x, y, width, height, rotation, stroke_width, opacity,
+         fill, stroke, z_index, gradient, name_offset, name_length,
+         properties_offset, properties_length) = PackedProject.RECORD.unpack_from(
+            buffer, self._records_offset + index * self._record_size)
+        name_offset += self._heap_offset
+        properties_offset += self._heap_offset
+        return ShapeData.from_raw([
+            x, y, width, height, rotation, stroke_width, opacity, fill, stroke, z_index,
+            self._shape_types[shape_type], self._blend_modes[blend_mode],
+            flags & (PackedProject.VISIBLE | PackedProject.LOCKED),
+            buffer[name_offset:name_offset + name_length].decode('utf-8'),
+            self._gradient(gradient) if gradient >= 0 else None,
+            self._custom_properties(properties_offset, properties_length) if properties_length else None,
+        ])
+
+class BackgroundWriter(QThread):
+    """Runs file-writing tasks one after another on a single background thread."""
+    
+    # Name given to submit() and an error message, empty on success
+    taskFinished = pyqtSignal(str, str)
+    
+    def __init__(self):
+        super().__init__()
+        self._tasks: queue.Queue = queue.Queue()
+    
+    def submit(self, task: Callable[[], None], name: str = ''):
+        """Queue a task; named tasks report completion through taskFinished."""
+        self._tasks.put((task, name))
+        if not self.isRunning():
+            self.start()
+    
+    def stop(self):
+        """Finish queued tasks and end the thread."""
+        if self.isRunning():
+            self._tasks.put(None)
+            self.wait()
+    
+    def run(self):
+        while True:
+            item = self._tasks.get()
+            if item is None:
+                return
+            task, name = item
+            error = ''
+            try:
+                task()
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                logger.error("Background write %s failed: %s", name or task, error)
+            if name:
+                self.taskFinished.emit(name, error)
+
+class AutosaveJournal(QObject):
+    """Crash protection through an append-only journal of document changes.
+    
+    Every LayerManager operation and theme change is appended to
+    journal-<generation>.jsonl on a BackgroundWriter, so the GUI thread pays
+    per edit rather than per document. Periodically, or once the journal
+    holds max_operations entries, the document is compacted into
+    snapshot-<generation>.sthemeb for the next generation and a fresh journal
+    is started. Recovery loads the newest generation's snapshot and replays
+    its journal; a line torn by a crash ends the replay.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, layer_manager: LayerManager, writer: BackgroundWriter,
+                 directory: Optional[str] = None, compact_interval_ms: int = 60000,
+                 max_operations: int = 10000):
+        super().__init__()
+        if directory is None:
+            data_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.AppDataLocation)
+            directory = os.path.join(data_dir, "autosave")
+        self.directory = directory
+        self.layer_manager = layer_manager
+        self.writer = writer
+        self.max_operations = max_operations
+        self.generation = 0
+        self.enabled = False
+        
+        self._suspended = False
+        self._operations = 0
+        # Operations of an open transaction, journaled in one write when it ends
+        self._batch: List[str] = []
+        self._theme: Dict[str, Any] = {}
+        self._lock: Optional[QLockFile] = None
+        # Only touched on the writer thread
+        self._journal = None
+        
+        self._timer = QTimer(self)
+        self._timer.setInterval(compact_interval_ms)
+        self._timer.timeout.connect(self._on_timer)
+        layer_manager.layerOperation.connect(self._on_operation)
+        layer_manager.transactionFinished.connect(self._on_transaction)
+    
+    def open(self) -> Optional[Tuple[Dict[str, Any], List[ShapeData]]]:
+        """Claim the autosave directory and return any document left by a crashed session."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.warning("Autosave disabled, cannot create %s: %s", self.directory, e)
+            return None
+        lock = QLockFile(os.path.join(self.directory, "autosave.lock"))
+        if not lock.tryLock(0):
+            logger.warning("Autosave disabled, %s is used by another instance", self.directory)
+            return None
+        self._lock = lock
+        
+        generations = self._generations()
+        if not generations:
+            return None
+        self.generation = max(generations)
+        try:
+            return self._recover(self.generation)
+        except Exception as e:
+            logger.error("Failed to recover autosave generation %d: %s", self.generation, e)
+            return None
+    
+    def start(self, theme: Dict[str, Any]):
+        """Begin journaling from the current document in a new generation."""
+        if self._lock is None:
+            return
+        self.enabled = True
+        self._theme = self._copy_theme(theme)
+        self.compact()
+        self._timer.start()
+    
+    def record_theme(self, theme: Dict[str, Any]):
+        """Journal a change to the theme data."""
+        self._theme = self._copy_theme(theme)
+        if self.enabled and not self._suspended:
+            line = json.dumps({'op': 'theme', 'theme': self._theme})
+            self._submit(lambda: self._append(line))
+    
+    def suspend(self):
+        """Stop journaling, e.g. while a project streams in."""
+        self._suspended = True
+    
+    def resume(self):
+        """Journal again, starting from a snapshot of the current document."""
+        if self._suspended:
+            self._suspended = False
+            self.compact()
+    
+    def compact(self):
+        """Snapshot the document and start the next journal generation."""
+        if not self.enabled:
+            return
+        self.generation += 1
+        generation, theme = self.generation, self._theme
+        columns = LayerStore.fields_of(self.layer_manager.layers)
+        self._operations = 0
+        self.writer.submit(lambda: self._write_snapshot(generation, theme, columns))
+    
+    def close(self):
+        """Stop journaling and delete the journal after a clean shutdown."""
+        self._timer.stop()
+        self.enabled = False
+        if self._lock is not None:
+            lock, self._lock = self._lock, None
+            self.writer.submit(lambda: self._discard(lock))
+    
+    def _on_operation(self, operation: LayerOperation):
+        if not self.enabled or self._suspended:
+            return
+        # Encode now: the layers keep changing after this, and relative
+        # entries such as 'translate' must follow the state they were applied to
+        line = self._encode(operation)
+        if self.layer_manager.in_transaction():
+            self._batch.append(line)
+            return
+        self._submit(lambda: self._append(line))
+    
+    def _on_transaction(self, summary: TransactionSummary):
+        # Rolled back operations stay in the batch, followed by their inverses
+        batch, self._batch = self._batch, []
+        if batch:
+            lines = '\n'.join(batch)
+            self._submit(lambda: self._append(lines), len(batch))
+    
+    def _on_timer(self):
+        if self._operations and not self._suspended:
+            self.compact()
+    
+    def _submit(self, task: Callable[[], None], operations: int = 1):
+        self.writer.submit(task)
+        self._operations += operations
+        if self._operations >= self.max_operations:
+            self.compact()
+    
+    @staticmethod
+    def _copy_theme(theme: Dict[str, Any]) -> Dict[str, Any]:
+        return json.loads(json.dumps(theme, default=str))
+    
+    def _path(self, kind: str, generation: int) -> str:
+        extension = PackedProject.EXTENSION if kind == 'snapshot' else '.jsonl'
+        return os.path.join(self.directory, f"{kind}-{generation}{extension}")
+    
+    def _generations(self) -> List[int]:
+        generations = set()
+        for name in os.listdir(self.directory):
+            stem, extension = os.path.splitext(name)
+            kind, _, number = stem.partition('-')
+            if kind in ('snapshot', 'journal') and number.isdigit() and extension in (PackedProject.EXTENSION, '.jsonl'):
+                generations.add(int(number))
+        return sorted(generations)
+    
+    @staticmethod
+    def _encode(operation: LayerOperation) -> str:
+        """Journal line of an operation; runs on the GUI thread as the operation is applied."""
+        entry: Dict[str, Any] = {'op': operation.kind, 'index': operation.index}
+        if operation.kind == 'move':
+            entry['target'] = operation.target
+        elif operation.kind == 'z_index':
+            entry['z'] = operation.layers[0].z_index
+        elif operation.kind in ('add', 'update'):
+            entry['layers'] = [ProjectSerializer.shape_to_dict(layer) for layer in operation.layers]
+        elif operation.kind == 'translate':
+            entry['indices'] = operation.indices
+            entry['offset'] = list(operation.changes['offset'][1])
+        elif operation.kind == 'recolor':
+            entry['indices'] = operation.indices
+            for name, (_, new) in operation.changes.items():
+                entry[name] = new.tolist()
+        elif operation.kind == 'reorder':
+            entry['indices'] = operation.indices
+        return json.dumps(entry, default=str)
+    
+    # The methods below run on the writer thread and only see journal lines
+    # and layer values copied on the GUI thread
+    
+    def _append(self, line: str):
+        if self._journal is not None:
+            self._journal.write(line + '\n')
+            self._journal.flush()
+    
+    def _write_snapshot(self, generation: int, theme: Dict[str, Any], columns: List[List[Any]]):
+        # Snapshot first: a crash before the new journal exists leaves a
+        # complete newer generation, so the old journal is never replayed twice
+        if columns[0] or theme:
+            PackedProject.save_columns(self._path('snapshot', generation), theme, columns)
+        journal = open(self._path('journal', generation), 'w', encoding='utf-8')
+        journal.write(json.dumps({'journal': generation, 'version': self.VERSION}) + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = journal
+        self._remove_generations(lambda old: old < generation)
+    
+    def _discard(self, lock: QLockFile):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._remove_generations(lambda generation: True)
+        lock.unlock()
+    
+    def _remove_generations(self, predicate: Callable[[int], bool]):
+        for generation in self._generations():
+            if predicate(generation):
+                for kind in ('snapshot', 'journal'):
+                    try:
+                        os.remove(self._path(kind, generation))
+                    except FileNotFoundError:
+                        pass
+    
+    def _recover(self, generation: int) -> Optional[Tuple[Dict[str, Any], List[ShapeData]]]:
+        theme: Dict[str, Any] = {}
+        layers: List[ShapeData] = []
+        snapshot = self._path('snapshot', generation)
+        if os.path.exists(snapshot):
+            theme, packed = PackedProject.open(snapshot)
+            layers = packed.shapes()
+            packed.close()
+        
+        replayed = 0
+        try:
+            with open(self._path('journal', generation), 'r', encoding='utf-8') as f:
+                f.readline()  # Generation header
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning("Autosave journal ends in a torn entry; stopping replay")
+                        break
+                    kind, index = entry.get('op'), entry.get('index', -1)
+                    if kind == 'theme':
+                        theme = entry['theme']
+                    elif kind == 'add':
+                        layers[index:index] = [ProjectSerializer.shape_from_dict(data) for data in entry['layers']]
+                    elif kind == 'update':
+                        layers[index] = ProjectSerializer.shape_from_dict(entry['layers'][0])
+                    elif kind == 'remove':
+                        del layers[index]
+                    elif kind == 'move':
+                        layers.insert(entry['target'], layers.pop(index))
+                    elif kind == 'z_index':
+                        layers[index].z_index = entry['z']
+                    elif kind == 'clear':
+                        layers.clear()
+                    elif kind == 'translate':
+                        dx, dy = entry['offset']
+                        for i in entry['indices']:
+                            position = layers[i].position
+                            layers[i].position = QPointF(position.x() + dx, position.y() + dy)
+                    elif kind == 'recolor':
+                        for name, attribute in (('fill', 'fill_color'), ('stroke', 'stroke_color')):
+                            for i, rgba in zip(entry['indices'], entry.get(name) or ()):
+                                setattr(layers[i], attribute, QColor.fromRgba(rgba))
+                    elif kind == 'reorder':
+                        layers = [layers[i] for i in entry['indices']]
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        
+        if not layers and not theme:
+            return None
+        logger.info("Recovered %d layers from autosave (%d journal entries replayed)", len(layers), replayed)
+        return theme, layers
+
+class FontIndex:
+    """Persistent map of font files to the families they provide.
+
+    Entries are keyed by path and validated by mtime and size, so unchanged
+    files never need to be opened again to learn their families.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            data_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.AppDataLocation)
+            path = os.path.join(data_dir, "font_index.json")
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+    
+    def load(self):
+        """Load the index from disk, starting empty if missing or stale."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.entries = data.get('fonts', {})
+        except (OSError, ValueError) as e:
+            logger.debug("Font index not loaded from %s: %s", self.path, e)
+    
+    def save(self):
+        """Write the index atomically if it changed."""
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'version': self.VERSION, 'fonts': self.entries}, f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning("Failed to save font index %s: %s", self.path, e)
+    
+    def lookup(self, path: str, mtime: float, size: int) -> Optional[List[str]]:
+        """Return cached families for an unchanged file, or None."""
+        entry = self.entries.get(path)
+        if entry and entry['mtime'] == mtime and entry['size'] == size:
+            return entry['families']
+        return None
+    
+    def record(self, path: str, mtime: float, size: int, families: List[str]):
+        """Store the families provided by a file (empty if it failed to load)."""
+        self.entries[path] = {'mtime': mtime, 'size': size, 'families': families}
+        self.dirty = True
+    
+    def prune(self, roots: List[str], seen: set):
+        """Forget files under the scanned roots that no longer exist."""
+        prefixes = tuple(os.path.join(root, '') for root in roots)
+        stale = [path for path in self.entries if path.startswith(prefixes) and path not in seen]
+        for path in stale:
+            del self.entries[path]
+        if stale:
+            self.dirty = True
+
+class FontScanWorker(QThread):
+    """Walks font directories off the GUI thread, pairing files with index entries."""
+    
+    filesScanned = pyqtSignal(list)
+    
+    def __init__(self, directories: List[str], index: FontIndex, batch_size: int = 256):
+        super().__init__()
+        self.directories = directories
+        self.entries = dict(index.entries)
+        self.batch_size = batch_size
+        self.seen: set = set()
+    
+    def run(self):
+        batch = []
+        for directory in self.directories:
+            for root, dirs, files in os.walk(directory):
+                if self.isInterruptionRequested():
+                    return
+                for file in files:
+                    if not file.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    font_file = os.path.join(root, file)
+                    try:
+                        stat = os.stat(font_file)
+                    except OSError:
+                        continue
+                    self.seen.add(font_file)
+                    entry = self.entries.get(font_file)
+                    families = None
+                    if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                        families = entry['families']
+                    batch.append((font_file, stat.st_mtime, stat.st_size, families))
+                    if len(batch) >= self.batch_size:
+                        self.filesScanned.emit(batch)
+                        batch = []
+        if batch:
+            self.filesScanned.emit(batch)
+
+class FontLoader(QObject):
+    """Registers fonts incrementally using a persistent FontIndex.
+    
+    Directory scans run on a worker thread. Files missing from the index are
+    registered first (to learn their families), then indexed files are
+    registered in time-sliced batches on the GUI thread. ensure_family()
+    registers a family's files immediately when it is needed sooner.
+    """
+    
+    familiesAvailable = pyqtSignal(list)
+    familiesRegistered = pyqtSignal(list)
+    
+    def __init__(self, index: Optional[FontIndex] = None, time_slice_ms: float = 8.0):
+        super().__init__()
+        self.index = index or FontIndex()
+        self.index.load()
+        self.time_slice_ms = time_slice_ms
+        self.registered_count = 0
+        
+        self._workers: List[FontScanWorker] = []
+        self._registered: set = set()
+        self._known_families: set = set()
+        self._family_files: Dict[str, List[str]] = {}
+        self._discover: deque = deque()
+        self._deferred: deque = deque()
+        
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._process_pending)
+    
+    def scan(self, directories: List[str]):
+        """Start a background scan of font directories."""
+        directories = [d for d in directories if os.path.isdir(d)]
+        if not directories:
+            return
+        worker = FontScanWorker(directories, self.index)
+        worker.filesScanned.connect(self._on_files_scanned)
+        worker.finished.connect(lambda: self._on_scan_finished(worker))
+        self._workers.append(worker)
+        worker.start()
+    
+    def register_directory(self, directory: str) -> int:
+        """Synchronously register every font in a directory; returns files loaded."""
+        loaded_count = 0
+        loaded = []
+        try:
+            for root, dirs, files in os.walk(directory):
+                for file in files:
+                    if file.lower().endswith(FONT_EXTENSIONS):
+                        font_file = os.path.join(root, file)
+                        try:
+                            stat = os.stat(font_file)
+                        except OSError as e:
+                            logger.warning("Failed to load font %s: %s", font_file, e)
+                            continue
+                        families = self._register_file(font_file, stat.st_mtime, stat.st_size)
+                        if families:
+                            loaded_count += 1
+                            loaded += families
+        except Exception as e:
+            logger.warning("Error accessing font directory %s: %s", directory, e)
+        
+        if loaded:
+            self.familiesRegistered.emit(sorted(set(loaded)))
+        self.index.save()
+        return loaded_count
+    
+    def ensure_family(self, family: str) -> bool:
+        """Register any not-yet-loaded files for a family; returns True if it is usable."""
+        loaded = []
+        for font_file in self._family_files.get(family, []):
+            if font_file not in self._registered:
+                entry = self.index.entries.get(font_file, {})
+                loaded += self._register_file(font_file, entry.get('mtime', 0), entry.get('size', 0))
+        if loaded:
+            self.familiesRegistered.emit(sorted(set(loaded)))
+        return family in QFontDatabase.families()
+    
+    def known_families(self) -> List[str]:
+        """Families from the index and registered files, loaded or not."""
+        return sorted(self._known_families)
+    
+    def is_busy(self) -> bool:
+        """True while scans or registrations are outstanding."""
+        return bool(self._workers or self._discover or self._deferred)
+    
+    def stop(self):
+        """Stop background work and persist the index."""
+        self._timer.stop()
+        for worker in self._workers:
+            worker.requestInterruption()
+            worker.wait()
+        self._workers.clear()
+        self.index.save()
+    
+    def _on_files_scanned(self, batch: list):
+        new_families = []
+        for font_file, mtime, size, families in batch:
+            if font_file in self._registered:
+                continue
+            if families is None:
+                self._discover.append((font_file, mtime, size))
+                continue
+            if not families:
+                continue  # Known to fail; skip without opening
+            for family in families:
+                self._family_files.setdefault(family, []).append(font_file)
+                if family not in self._known_families:
+                    self._known_families.add(family)
+                    new_families.append(family)
+            self._deferred.append((font_file, mtime, size))
+        if new_families:
+            self.familiesAvailable.emit(new_families)
+        if not self._timer.isActive():
+            self._timer.start()
+    
+    def _on_scan_finished(self, worker: FontScanWorker):
+        if worker in self._workers:
+            self._workers.remove(worker)
+            if not worker.isInterruptionRequested():
+                self.index.prune(worker.directories, worker.seen)
+        if not self.is_busy():
+            self._finish()
+    
+    def _process_pending(self):
+        """Register queued fonts until this tick's time slice is used up."""
+        deadline = time.perf_counter() + self.time_slice_ms / 1000
+        loaded = []
+        while time.perf_counter() < deadline:
+            if self._discover:
+                queue = self._discover
+            elif self._deferred:
+                queue = self._deferred
+            else:
+                break
+            font_file, mtime, size = queue.popleft()
+            if font_file not in self._registered:
+                loaded += self._register_file(font_file, mtime, size)
+        if loaded:
+            self.familiesRegistered.emit(sorted(set(loaded)))
+        if not self._discover and not self._deferred:
+            self._timer.stop()
+            if not self._workers:
+                self._finish()
+    
+    def _register_file(self, font_file: str, mtime: float, size: int) -> List[str]:
+        """Add a font file to the application database and index its families."""
+        self._registered.add(font_file)
+        families = []
+        try:
+            font_id = QFontDatabase.addApplicationFont(font_file)
+            if font_id != -1:
+                families = QFontDatabase.applicationFontFamilies(font_id)
+                self.registered_count += 1
+        except Exception as e:
+            logger.warning("Failed to load font %s: %s", font_file, e)
+        
+        if self.index.lookup(font_file, mtime, size) != families:
+            self.index.record(font_file, mtime, size, families)
+        new_families = [family for family in families if family not in self._known_families]
+        for family in families:
+            files = self._family_files.setdefault(family, [])
+            if font_file not in files:
+                files.append(font_file)
+        self._known_families.update(new_families)
+        if new_families:
+            self.familiesAvailable.emit(new_families)
+        return families
+    
+    def _finish(self):
+        self.index.save()
+        logger.info("Registered %d fonts (%d families known)", self.registered_count, len(self._known_families))
+
+FAMILY_WEIGHTS = {
+    "Any": None, "Thin": 100, "Light": 300, "Normal": 400,
+    "Medium": 500, "Bold": 700, "Black": 900,
+}
+
+class FontListModel(QAbstractListModel):
+    """Sorted list of font families with lazily computed style attributes."""
+    
+    WeightsRole = Qt.ItemDataRole.UserRole + 1
+    ItalicRole = Qt.ItemDataRole.UserRole + 2
+    
+    def __init__(self, families: Optional[List[str]] = None):
+        super().__init__()
+        self._families: List[str] = sorted(set(families or []))
+        self._registered: set = set(QFontDatabase.families())
+        self._attributes: Dict[str, Tuple[frozenset, bool]] = {}
+    
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._families)
+    
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        family = self._families[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return family
+        if role == self.WeightsRole:
+            return self.attributes(family)[0]
+        if role == self.ItalicRole:
+            return self.attributes(family)[1]
+        return None
+    
+    def family(self, row: int) -> str:
+        return self._families[row]
+    
+    def row_of(self, family: str) -> int:
+        """Row of a family, or -1."""
+        row = bisect.bisect_left(self._families, family)
+        if row < len(self._families) and self._families[row] == family:
+            return row
+        return -1
+    
+    def is_registered(self, family: str) -> bool:
+        return family in self._registered
+    
+    def attributes(self, family: str) -> Tuple[frozenset, bool]:
+        """(available weights, italic support); unknown until the family is registered."""
+        attributes = self._attributes.get(family)
+        if attributes is None:
+            if family not in self._registered:
+                return frozenset(), False
+            styles = QFontDatabase.styles(family)
+            weights = frozenset(QFontDatabase.weight(family, style) for style in styles)
+            italic = any(QFontDatabase.italic(family, style) for style in styles)
+            self._attributes[family] = attributes = (weights, italic)
+        return attributes
+    
+    def add_families(self, families: List[str]):
+        """Insert new families in sorted position, one row at a time."""
+        for family in families:
+            row = bisect.bisect_left(self._families, family)
+            if row < len(self._families) and self._families[row] == family:
+                continue
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._families.insert(row, family)
+            self.endInsertRows()
+    
+    def mark_registered(self, families: List[str]):
+        """Note families that became usable and refresh their rows."""
+        self.add_families(families)
+        for family in families:
+            self._registered.add(family)
+            self._attributes.pop(family, None)
+            row = self.row_of(family)
+            self.dataChanged.emit(self.index(row), self.index(row))
+
+class FontFilterProxyModel(QSortFilterProxyModel):
+    """Filters families by name substring, available weight and italic support."""
+    
+    def __init__(self):
+        super().__init__()
+        self.name_filter = ""
+        self.weight: Optional[int] = None
+        self.require_italic = False
+    
+    def set_filter(self, name: str, weight: Optional[int], require_italic: bool):
+        self.name_filter = name.casefold()
+        self.weight = weight
+        self.require_italic = require_italic
+        self.invalidateFilter()
+    
+    def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
+        model = self.sourceModel()
+        family = model.family(source_row)
+        if self.name_filter and self.name_filter not in family.casefold():
+            return False
+        if self.weight is None and not self.require_italic:
+            return True
+        weights, italic = model.attributes(family)
+        if self.weight is not None and self.weight not in weights:
+            return False
+        if self.require_italic and not italic:
+            return False
+        return True
+
+class FontSampleSignals(QObject):
+    """Carries finished sample renders back to the GUI thread."""
+    
+    rendered = pyqtSignal(str, QImage)
+
+class FontSampleRenderer(QRunnable):
+    """Renders one family's sample line into an image on the thread pool."""
+    
+    def __init__(self, family: str, text: str, size: QSize, point_size: int,
+                 dpr: float, color: QColor, signals: FontSampleSignals):
+        super().__init__()
+        self.family = family
+        self.text = text
+        self.size = size
+        self.point_size = point_size
+        self.dpr = dpr
+        self.color = QColor(color)
+        self.signals = signals
+    
+    def run(self):
+        image = QImage(
+            math.ceil(self.size.width() * self.dpr), math.ceil(self.size.height() * self.dpr),
+            QImage.Format.Format_ARGB32_Premultiplied
+        )
+        image.setDevicePixelRatio(self.dpr)
+        image.fill(Qt.GlobalColor.transparent)
+        
+        font = QFont(self.family)
+        font.setPointSize(self.point_size)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+        painter.setFont(font)
+        painter.setPen(self.color)
+        painter.drawText(
+            QRectF(0, 0, self.size.width(), self.size.height()),
+            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, self.text
+        )
+        painter.end()
+        self.signals.rendered.emit(self.family, image)
+
+class FontSampleDelegate(QStyledItemDelegate):
+    """Paints a family name and a cached sample raster, rendering misses asynchronously.
     
-    def draw_grid(self, painter: QPainter):
-        """Draw grid lines."""
-        painter.setPen(QPen(QColor(220, 220, 220), 1, Qt.PenStyle.DotLine))
-        
-        for x in range(0, self.width(), self.grid_size):
-            painter.drawLine(x, 0, x, self.height())
-        
-        for y in range(0, self.height(), self.grid_size):
-            painter.drawLine(0, y, self.width(), y)
+    Until a sample arrives only the name is painted. Families not yet
+    registered with Qt are registered from a timer, outside paint().
+    """
     
-    def draw_shape(self, painter: QPainter, shape: ShapeData):
-        """Draw a shape on the canvas."""
-        painter.save()
-        
-        # Apply transformations
-        painter.translate(shape.position)
-        painter.rotate(shape.rotation)
-        painter.setOpacity(shape.opacity)
-        
-        # Set up brush and pen
-        if shape.gradient:
-            brush = self.create_gradient_brush(shape.gradient)
-        else:
-            brush = QBrush(shape.fill_color)
-        
-        pen = QPen(shape.stroke_color, shape.stroke_width)
-        painter.setBrush(brush)
-        painter.setPen(pen)
-        
-        # Draw based on shape type
-        if shape.shape_type == ShapeType.RECTANGLE:
-            painter.drawRect(QRectF(0, 0, shape.size.width(), shape.size.height()))
-        elif shape.shape_type == ShapeType.ELLIPSE:
-            painter.drawEllipse(QRectF(0, 0, shape.size.width(), shape.size.height()))
-        elif shape.shape_type == ShapeType.POLYGON:
-            # Draw a hexagon as example
-            points = self.create_polygon_points(shape.size, 6)
-            painter.drawPolygon(points)
-        elif shape.shape_type == ShapeType.STAR:
-            points = self.create_star_points(shape.size, 5)
-            painter.drawPolygon(points)
-        
-        painter.restore()
+    ROW_HEIGHT = 46
+    NAME_HEIGHT = 14
     
-    def create_gradient_brush(self, gradient: GradientData) -> QBrush:
-        """Create a gradient brush from gradient data."""
-        if gradient.type == GradientType.LINEAR:
-            grad = QLinearGradient(gradient.start_point, gradient.end_point)
-        elif gradient.type == GradientType.RADIAL:
-            grad = QRadialGradient(gradient.start_point, gradient.radius)
-        else:  # CONICAL
-            grad = QConicalGradient(gradient.start_point, gradient.angle)
-        
-        for stop in gradient.stops:
-            grad.setColorAt(stop.position, stop.color)
-        
-        return QBrush(grad)
+    def __init__(self, model: FontListModel, ensure_family: Optional[Callable[[str], bool]] = None,
+                 sample_text: str = "The quick brown fox jumps over the lazy dog",
+                 point_size: int = 16, max_samples: int = 512):
+        super().__init__()
+        self.model = model
+        self.ensure_family = ensure_family
+        self.sample_text = sample_text
+        self.point_size = point_size
+        self.max_samples = max_samples
+        self._samples: "OrderedDict[str, QImage]" = OrderedDict()
+        self._pending: set = set()
+        self._signals = FontSampleSignals()
+        self._signals.rendered.connect(self._on_rendered)
+        self._pool = QThreadPool.globalInstance()
+        # Families to register before rendering, one per event loop pass
+        self._unregistered: deque = deque()
+        self._register_timer = QTimer(self)
+        self._register_timer.setInterval(0)
+        self._register_timer.timeout.connect(self._register_next)
     
-    def create_polygon_points(self, size: QSizeF, sides: int) -> QPolygonF:
-        """Create polygon points."""
-        points = QPolygonF()
-        center = QPointF(size.width() / 2, size.height() / 2)
-        radius = min(size.width(), size.height()) / 2
-        
-        for i in range(sides):
-            angle = 2 * math.pi * i / sides
-            x = center.x() + radius * math.cos(angle)
-            y = center.y() + radius * math.sin(angle)
-            points.append(QPointF(x, y))
-        
-        return points
+    def sizeHint(self, option, index) -> QSize:
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
     
-    def create_star_points(self, size: QSizeF, points: int) -> QPolygonF:
-        """Create star points."""
-        star = QPolygonF()
-        center = QPointF(size.width() / 2, size.height() / 2)
-        outer_radius = min(size.width(), size.height()) / 2
-        inner_radius = outer_radius * 0.4
-        
-        for i in range(points * 2):
-            angle = math.pi * i / points
-            radius = outer_radius if i % 2 == 0 else inner_radius
-            x = center.x() + radius * math.cos(angle - math.pi / 2)
-            y = center.y() + radius * math.sin(angle - math.pi / 2)
-            star.append(QPointF(x, y))
+    def paint(self, painter: QPainter, option, index: QModelIndex):
+        family = index.data(Qt.ItemDataRole.DisplayRole)
+        rect = option.rect
+        selected = bool(option.state & QStyle.StateFlag.State_Selected)
+        if selected:
+            painter.fillRect(rect, option.palette.highlight())
+        
+        text_color = option.palette.highlightedText().color() if selected else option.palette.text().color()
+        painter.setPen(text_color)
+        painter.setFont(option.font)
+        painter.drawText(
+            QRectF(rect.x() + 4, rect.y() + 1, rect.width() - 8, self.NAME_HEIGHT),
+            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, family
+        )
         
-        return star
+        sample = self._samples.get(family)
+        if sample is not None:
+            self._samples.move_to_end(family)
+            painter.drawImage(QPointF(rect.x() + 4, rect.y() + self.NAME_HEIGHT + 1), sample)
+        else:
+            self._request(family, QSize(max(1, rect.width() - 8), self.ROW_HEIGHT - self.NAME_HEIGHT - 2),
+                          painter.device().devicePixelRatioF(), option.palette.text().color())
     
-    def draw_preview_shape(self, painter: QPainter):
-        """Draw preview of shape being created."""
-        painter.setPen(QPen(QColor(100, 100, 100), 1, Qt.PenStyle.DashLine))
-        painter.setBrush(Qt.BrushStyle.NoBrush)
-        
-        rect = QRectF(self.start_point, self.current_point).normalized()
-        if self.current_tool == ShapeType.RECTANGLE:
-            painter.drawRect(rect)
-        elif self.current_tool == ShapeType.ELLIPSE:
-            painter.drawEllipse(rect)
+    def invalidate(self, families: List[str]):
+        """Drop cached samples, e.g. after a family was registered."""
+        for family in families:
+            self._samples.pop(family, None)
     
-    def mousePressEvent(self, event):
-        """Handle mouse press for shape creation."""
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.drawing_mode = True
-            self.start_point = QPointF(event.position())
-            self.current_point = self.start_point
+    def _request(self, family: str, size: QSize, dpr: float, color: QColor):
+        if family in self._pending:
+            return
+        self._pending.add(family)
+        if self.model.is_registered(family) or self.ensure_family is None:
+            self._render(family, size, dpr, color)
+            return
+        # Registering reads the font file, so it must not happen inside paint()
+        self._unregistered.append((family, size, dpr, color))
+        if not self._register_timer.isActive():
+            self._register_timer.start()
     
-    def mouseMoveEvent(self, event):
-        """Handle mouse move for shape preview."""
-        if self.drawing_mode:
-            self.current_point = QPointF(event.position())
-            if self.snap_to_grid:
-                self.current_point = self.snap_to_grid_point(self.current_point)
-            self.update()
+    def _register_next(self):
+        family, size, dpr, color = self._unregistered.popleft()
+        if not self._unregistered:
+            self._register_timer.stop()
+        self.ensure_family(family)
+        self._render(family, size, dpr, color)
     
-    def mouseReleaseEvent(self, event):
-        """Handle mouse release to create shape."""
-        if event.button() == Qt.MouseButton.LeftButton and self.drawing_mode:
-            self.drawing_mode = False
-            rect = QRectF(self.start_point, self.current_point).normalized()
-            
-            if rect.width() > 5 and rect.height() > 5:  # Minimum size
-                shape = ShapeData(
-                    shape_type=self.current_tool,
-                    position=rect.topLeft(),
-                    size=rect.size(),
-                    rotation=0.0,
-                    fill_color=QColor(100, 150, 255, 200),
-                    stroke_color=QColor(50, 100, 200),
-                    stroke_width=2.0,
-                    gradient=None,
-                    opacity=1.0,
-                    blend_mode=BlendMode.NORMAL,
-                    z_index=len(self.layer_manager.layers),
-                    visible=True,
-                    locked=False,
-                    name=f"{self.current_tool.name.title()} {len(self.layer_manager.layers) + 1}",
-                    custom_properties={}
-                )
-                self.layer_manager.add_layer(shape)
-            self.update()
+    def _render(self, family: str, size: QSize, dpr: float, color: QColor):
+        self._pool.start(FontSampleRenderer(
+            family, self.sample_text, size, self.point_size, dpr, color, self._signals
+        ))
     
-    def snap_to_grid_point(self, point: QPointF) -> QPointF:
-        """Snap point to grid."""
-        x = round(point.x() / self.grid_size) * self.grid_size
-        y = round(point.y() / self.grid_size) * self.grid_size
-        return QPointF(x, y)
+    def _on_rendered(self, family: str, image: QImage):
+        self._pending.discard(family)
+        self._samples[family] = image
+        if len(self._samples) > self.max_samples:
+            self._samples.popitem(last=False)
+        row = self.model.row_of(family)
+        if row >= 0:
+            self.model.dataChanged.emit(self.model.index(row), self.model.index(row))
 
-class ThemeExporter:
-    """Handles theme export in various formats."""
+class FontBrowser(QWidget):
+    """Searchable, virtualized list of font families with rendered samples."""
     
-    @staticmethod
-    def export_to_python(theme_data: Dict[str, Any]) -> str:
-        """Export theme as Python code."""
-        code_lines = [
-            "# Generated by Selene Theme Stylizer Pro",
-            "from PyQt6.QtGui import QColor, QFont, QLinearGradient",
-            "from PyQt6.QtCore import Qt",
-            "",
-            "# Theme Configuration",
-            "class Theme:",
-            "    def __init__(self):",
-        ]
-        
-        # Colors
-        if 'colors' in theme_data:
-            code_lines.append("        # Colors")
-            for name, color_data in theme_data['colors'].items():
-                if isinstance(color_data, dict):
-                    r, g, b, a = color_data['r'], color_data['g'], color_data['b'], color_data['a']
-                    code_lines.append(f"        self.{name} = QColor({r}, {g}, {b}, {a})")
-        
-        # Fonts
-        if 'fonts' in theme_data:
-            code_lines.append("        # Fonts")
-            for name, font_data in theme_data['fonts'].items():
-                code_lines.append(f"        self.{name} = QFont('{font_data['family']}', {font_data['size']})")
-                if font_data.get('bold'):
-                    code_lines.append(f"        self.{name}.setBold(True)")
-                if font_data.get('italic'):
-                    code_lines.append(f"        self.{name}.setItalic(True)")
-        
-        # Stylesheets
-        if 'stylesheets' in theme_data:
-            code_lines.append("        # Stylesheets")
-            for widget_type, styles in theme_data['stylesheets'].items():
-                code_lines.append(f"        self.{widget_type}_style = '''")
-                for property_name, value in styles.items():
-                    code_lines.append(f"            {property_name}: {value};")
-                code_lines.append("        '''")
-        
-        return "\n".join(code_lines)
+    familySelected = pyqtSignal(str)
     
-    @staticmethod
-    def export_to_css(theme_data: Dict[str, Any]) -> str:
-        """Export theme as CSS/Qt StyleSheet."""
-        css_lines = ["/* Generated by Selene Theme Stylizer Pro */", ""]
-        
-        if 'stylesheets' in theme_data:
-            for widget_type, styles in theme_data['stylesheets'].items():
-                css_lines.append(f"{widget_type} {{")
-                for property_name, value in styles.items():
-                    css_lines.append(f"    {property_name}: {value};")
-                css_lines.append("}")
-                css_lines.append("")
-        
-        return "\n".join(css_lines)
+    def __init__(self, families: List[str], ensure_family: Optional[Callable[[str], bool]] = None):
+        super().__init__()
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        
+        # Filters
+        filter_layout = QHBoxLayout()
+        self.search = QLineEdit()
+        self.search.setPlaceholderText("Search fonts...")
+        self.weight_filter = QComboBox()
+        self.weight_filter.addItems(list(FAMILY_WEIGHTS))
+        self.italic_filter = QCheckBox("Italic")
+        filter_layout.addWidget(self.search, 1)
+        filter_layout.addWidget(self.weight_filter)
+        filter_layout.addWidget(self.italic_filter)
+        layout.addLayout(filter_layout)
+        
+        # Model and view; uniform row heights keep scrolling O(visible rows)
+        self.model = FontListModel(families)
+        self.proxy = FontFilterProxyModel()
+        self.proxy.setSourceModel(self.model)
+        self.delegate = FontSampleDelegate(self.model, ensure_family)
+        
+        self.view = QListView()
+        self.view.setModel(self.proxy)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setUniformItemSizes(True)
+        self.view.setMinimumHeight(160)
+        layout.addWidget(self.view)
+        
+        self.search.textChanged.connect(self._apply_filter)
+        self.weight_filter.currentTextChanged.connect(self._apply_filter)
+        self.italic_filter.toggled.connect(self._apply_filter)
+        self.view.clicked.connect(lambda index: self.familySelected.emit(index.data()))
     
-    @staticmethod
-    def export_to_json(theme_data: Dict[str, Any]) -> str:
-        """Export theme as JSON."""
-        return json.dumps(theme_data, indent=2, default=str)
+    def add_families(self, families: List[str]):
+        self.model.add_families(families)
+    
+    def mark_registered(self, families: List[str]):
+        self.delegate.invalidate(families)
+        self.model.mark_registered(families)
+    
+    def _apply_filter(self, *args):
+        self.proxy.set_filter(
+            self.search.text(), FAMILY_WEIGHTS[self.weight_filter.currentText()],
+            self.italic_filter.isChecked()
+        )
 
 class AdvancedThemeStyler(QWidget):
     """Main application class with advanced theming capabilities."""
@@ -517,49 +5025,48 @@ class AdvancedThemeStyler(QWidget):
         
         # Initialize core systems
         self.layer_manager = LayerManager()
+        self.project_loader = ProjectLoader(self.layer_manager)
+        self.writer = BackgroundWriter()
+        self.writer.taskFinished.connect(self._on_write_finished)
+        self.autosave = AutosaveJournal(self.layer_manager, self.writer)
+        self.history = EditHistory(self.layer_manager)
         self.color_palette = ColorPalette()
+        self.code_generator = CodeGenerator(self)
+        self.code_generator.codeReady.connect(self._on_code_ready)
         self.settings = QSettings("Selene", "ThemeStyler")
         
         # Initialize state
         self.current_theme_data = {}
-        self.animation_timers = {}
         self.custom_font_paths = []
         
-        # Load fonts and setup UI
+        # Load fonts (in the background) and setup UI
+        self.font_loader = FontLoader()
         self._load_system_fonts()
         self._init_ui()
         self._load_settings()
+        self._restore_autosave()
+    
+    def _restore_autosave(self):
+        """Recover the document of a session that did not exit cleanly, then start journaling."""
+        recovered = self.autosave.open()
+        if recovered:
+            self.current_theme_data, layers = recovered
+            self.layer_manager.add_layers(layers)
+            self.code_generator.set_theme(self.current_theme_data)
+            self.history.clear()
+        self.autosave.start(self.current_theme_data)
     
     def _load_system_fonts(self):
-        """Load system fonts."""
+        """Start loading system fonts in the background."""
         system_name = platform.system()
         font_paths = SYSTEM_FONT_PATHS.get(system_name, [])
         
-        loaded_count = 0
-        for font_dir in font_paths:
-            if os.path.exists(font_dir):
-                loaded_count += self._load_fonts_from_directory(font_dir)
-        
-        logger.info("Loaded %d system fonts from %s", loaded_count, system_name)
+        self.font_loader.scan(font_paths)
+        logger.info("Scanning system fonts for %s", system_name)
     
     def _load_fonts_from_directory(self, directory: str) -> int:
         """Load fonts from directory."""
-        loaded_count = 0
-        try:
-            for root, dirs, files in os.walk(directory):
-                for file in files:
-                    if file.lower().endswith(('.ttf', '.otf', '.woff', '.woff2')):
-                        font_file = os.path.join(root, file)
-                        try:
-                            font_id = QFontDatabase.addApplicationFont(font_file)
-                            if font_id != -1:
-                                loaded_count += 1
-                        except Exception as e:
-                            logger.warning("Failed to load font %s: %s", font_file, e)
-        except Exception as e:
-            logger.warning("Error accessing font directory %s: %s", directory, e)
-        
-        return loaded_count
+        return self.font_loader.register_directory(directory)
     
     def _init_ui(self):
         """Initialize the user interface."""
@@ -612,6 +5119,22 @@ class AdvancedThemeStyler(QWidget):
         self.tool_buttons.buttons()[0].setChecked(True)  # Default to rectangle
         self.tool_buttons.buttonClicked.connect(self._on_tool_changed)
         
+        # Polygon sides and star points
+        row = (len(tools) + 1) // 2
+        tools_layout.addWidget(QLabel("Sides:"), row, 0)
+        self.polygon_sides = QSpinBox()
+        self.polygon_sides.setRange(3, 64)
+        self.polygon_sides.setValue(DEFAULT_POLYGON_SIDES)
+        self.polygon_sides.valueChanged.connect(lambda value: setattr(self.canvas, 'polygon_sides', value))
+        tools_layout.addWidget(self.polygon_sides, row, 1)
+        
+        tools_layout.addWidget(QLabel("Star Points:"), row + 1, 0)
+        self.star_points = QSpinBox()
+        self.star_points.setRange(3, 64)
+        self.star_points.setValue(DEFAULT_STAR_POINTS)
+        self.star_points.valueChanged.connect(lambda value: setattr(self.canvas, 'star_points', value))
+        tools_layout.addWidget(self.star_points, row + 1, 1)
+        
         layout.addWidget(tools_group)
         
         # Color controls
@@ -737,6 +5260,9 @@ class AdvancedThemeStyler(QWidget):
         
         font_layout.addWidget(QLabel("Family:"), 0, 0)
         self.font_combo = QFontComboBox()
+        self.font_combo.currentFontChanged.connect(
+            lambda font: self.font_loader.ensure_family(font.family())
+        )
         font_layout.addWidget(self.font_combo, 0, 1)
         
         font_layout.addWidget(QLabel("Size:"), 1, 0)
@@ -753,6 +5279,16 @@ class AdvancedThemeStyler(QWidget):
         
         layout.addLayout(font_layout)
         
+        # Font browser with samples; also lists indexed fonts not loaded yet
+        self.font_browser = FontBrowser(
+            QFontDatabase.families() + self.font_loader.known_families(),
+            self.font_loader.ensure_family
+        )
+        self.font_browser.familySelected.connect(self._on_font_family_selected)
+        self.font_loader.familiesAvailable.connect(self.font_browser.add_families)
+        self.font_loader.familiesRegistered.connect(self.font_browser.mark_registered)
+        layout.addWidget(self.font_browser)
+        
         # Font styles
         styles_layout = QHBoxLayout()
         self.italic_cb = QCheckBox("Italic")
@@ -845,6 +5381,19 @@ class AdvancedThemeStyler(QWidget):
         
         layout.addWidget(shadow_group)
         
+        # Glow and shadow apply to the selected layers
+        self.glow_color = QColor(TextEffectData.DEFAULT_GLOW_COLOR)
+        for checkbox in (self.glow_enabled, self.shadow_enabled):
+            checkbox.toggled.connect(lambda checked: self._apply_effects())
+        # A drag or a run of spin steps is one undo step, ended on release
+        for control in (self.glow_radius, self.shadow_x, self.shadow_y, self.shadow_blur):
+            control.valueChanged.connect(lambda value: self._apply_effects(live=True))
+        for slider in (self.glow_radius, self.shadow_blur):
+            slider.sliderReleased.connect(self.history.seal)
+        for spin_box in (self.shadow_x, self.shadow_y):
+            spin_box.editingFinished.connect(self.history.seal)
+        self.layer_manager.selectionChanged.connect(self._show_effects)
+        
         # Opacity and blend mode
         blend_layout = QGridLayout()
         
@@ -857,6 +5406,8 @@ class AdvancedThemeStyler(QWidget):
         blend_layout.addWidget(QLabel("Blend Mode:"), 1, 0)
         self.blend_mode = QComboBox()
         self.blend_mode.addItems([mode.name.title().replace('_', ' ') for mode in BlendMode])
+        self.blend_mode.currentIndexChanged.connect(self._set_blend_mode)
+        self.layer_manager.selectionChanged.connect(self._show_blend_mode)
         blend_layout.addWidget(self.blend_mode, 1, 1)
         
         layout.addLayout(blend_layout)
@@ -875,6 +5426,8 @@ class AdvancedThemeStyler(QWidget):
         # Canvas area
         canvas_scroll = QScrollArea()
         self.canvas = AdvancedCanvas(self.layer_manager)
+        # A finished drag is one undo step
+        self.canvas.shapeModified.connect(self.history.seal)
         canvas_scroll.setWidget(self.canvas)
         canvas_scroll.setWidgetResizable(True)
         
@@ -911,6 +5464,16 @@ class AdvancedThemeStyler(QWidget):
         
         layout.addWidget(QLabel("|"))  # Separator
         
+        # Edit history
+        self.undo_btn = QPushButton("Undo")
+        self.redo_btn = QPushButton("Redo")
+        self.undo_btn.setEnabled(False)
+        self.redo_btn.setEnabled(False)
+        layout.addWidget(self.undo_btn)
+        layout.addWidget(self.redo_btn)
+        
+        layout.addWidget(QLabel("|"))  # Separator
+        
         # View controls
         zoom_out_btn = QPushButton("Zoom Out")
         zoom_in_btn = QPushButton("Zoom In")
@@ -925,12 +5488,42 @@ class AdvancedThemeStyler(QWidget):
         
         layout.addStretch()
         
+        # Project loading progress, shown only while a project streams in
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setMaximumWidth(160)
+        self.load_progress.setFormat("Loading %p%")
+        self.load_progress.hide()
+        layout.addWidget(self.load_progress)
+        
         # Connect signals
         new_btn.clicked.connect(self._new_project)
         open_btn.clicked.connect(self._open_project)
         save_btn.clicked.connect(self._save_project)
         export_btn.clicked.connect(self._export_theme)
         grid_btn.toggled.connect(self._toggle_grid)
+        self.undo_btn.clicked.connect(self.history.undo)
+        self.redo_btn.clicked.connect(self.history.redo)
+        self.history.changed.connect(self._update_history_buttons)
+        
+        undo_action = QAction("Undo", self)
+        undo_action.setShortcut(QKeySequence.StandardKey.Undo)
+        undo_action.triggered.connect(self.history.undo)
+        redo_action = QAction("Redo", self)
+        redo_action.setShortcut(QKeySequence.StandardKey.Redo)
+        redo_action.triggered.connect(self.history.redo)
+        self.addAction(undo_action)
+        self.addAction(redo_action)
+        
+        play_action = QAction("Play Animations", self)
+        play_action.setShortcut(QKeySequence("F5"))
+        play_action.triggered.connect(self._toggle_animations)
+        self.addAction(play_action)
+        
+        self.project_loader.themeLoaded.connect(self._on_project_theme_loaded)
+        self.project_loader.progressChanged.connect(self.load_progress.setValue)
+        self.project_loader.loadFinished.connect(self._on_project_loaded)
+        self.project_loader.loadFailed.connect(self._on_project_load_failed)
         
         return toolbar
     
@@ -956,11 +5549,22 @@ class AdvancedThemeStyler(QWidget):
         layer_controls.addWidget(move_down_btn)
         layers_layout.addLayout(layer_controls)
         
+        delete_layer_btn.clicked.connect(lambda: self.layer_manager.remove_layers(self.layer_manager.selected_layers))
+        move_up_btn.clicked.connect(lambda: self._move_selected_layers(-1))
+        move_down_btn.clicked.connect(lambda: self._move_selected_layers(1))
+        
         # Layer list
-        self.layer_tree = QTreeWidget()
-        self.layer_tree.setHeaderLabels(["Name", "Visible", "Locked"])
-        self.layer_tree.setRootIsDecorated(False)
-        layers_layout.addWidget(self.layer_tree)
+        self.layer_model = LayerTableModel(self.layer_manager)
+        # A table view lays out only visible rows, unlike QTreeView which
+        # walks every row whenever rows are inserted or removed
+        self.layer_table = QTableView()
+        self.layer_table.setModel(self.layer_model)
+        self.layer_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.layer_table.setShowGrid(False)
+        self.layer_table.verticalHeader().hide()
+        self.layer_table.verticalHeader().setDefaultSectionSize(self.layer_table.fontMetrics().height() + 6)
+        self.layer_table.horizontalHeader().setStretchLastSection(True)
+        layers_layout.addWidget(self.layer_table)
         
         layout.addWidget(layers_group)
         
@@ -999,6 +5603,8 @@ class AdvancedThemeStyler(QWidget):
         # Code display
         self.code_display = QTextEdit()
         self.code_display.setReadOnly(True)
+        # Output is rewritten in place on every theme change; keep no undo trail
+        self.code_display.setUndoRedoEnabled(False)
         self.code_display.setFont(QFont("Consolas", 9))
         self.code_display.setStyleSheet("""
             QTextEdit {
@@ -1012,9 +5618,6 @@ class AdvancedThemeStyler(QWidget):
         
         layout.addWidget(code_group)
         
-        # Connect layer manager signals
-        self.layer_manager.layerChanged.connect(self._update_layer_tree)
-        
         return panel
     
     def _on_tool_changed(self, button):
@@ -1044,7 +5647,16 @@ class AdvancedThemeStyler(QWidget):
                 'a': color.alpha()
             }
             
-            self._update_code_output()
+            # Fill and stroke also recolor the selected layers
+            selected = self.layer_manager.selected_layers
+            if selected and color_key in ('fill_color', 'stroke_color'):
+                self.layer_manager.recolor_layers(selected, **{color_key.split('_')[0]: color})
+            elif color_key == 'glow_color':
+                self.glow_color = color
+                self.glow_color_btn.setStyleSheet(f"background-color: {color.name()}; border: 1px solid #333;")
+                self._apply_effects()
+            
+            self._on_theme_changed()
             logger.info(f"Color {color_key} updated to {color.name()}")
     
     def _generate_color_harmony(self):
@@ -1081,7 +5693,7 @@ class AdvancedThemeStyler(QWidget):
                     f"background-color: {color.name()}; border: 1px solid #333;"
                 )
         
-        self._update_code_output()
+        self._on_theme_changed()
         logger.info(f"Generated {harmony_type} color harmony")
     
     def _load_custom_fonts(self):
@@ -1095,20 +5707,7 @@ class AdvancedThemeStyler(QWidget):
             loaded_count = self._load_fonts_from_directory(directory)
             
             if loaded_count > 0:
-                # Refresh font combo
-                current_font = self.font_combo.currentFont()
-                self.font_combo.clear()
-                
-                font_db = QFontDatabase()
-                families = sorted(font_db.families())
-                for family in families:
-                    self.font_combo.addItem(family)
-                
-                # Restore selection
-                index = self.font_combo.findText(current_font.family())
-                if index >= 0:
-                    self.font_combo.setCurrentIndex(index)
-                
+                # The font combo and browser pick up new families incrementally
                 QMessageBox.information(
                     self, "Success", 
                     f"Loaded {loaded_count} fonts from {directory}"
@@ -1119,6 +5718,11 @@ class AdvancedThemeStyler(QWidget):
                     f"No supported fonts found in {directory}"
                 )
     
+    def _on_font_family_selected(self, family: str):
+        """Select a family picked in the font browser."""
+        if self.font_loader.ensure_family(family):
+            self.font_combo.setCurrentFont(QFont(family))
+    
     def _new_project(self):
         """Create new project."""
         reply = QMessageBox.question(
@@ -1128,56 +5732,65 @@ class AdvancedThemeStyler(QWidget):
         )
         
         if reply == QMessageBox.StandardButton.Yes:
-            self.layer_manager.layers.clear()
+            self.project_loader.cancel()
+            self.load_progress.hide()
+            self.autosave.resume()
+            self.layer_manager.clear()
+            self.history.clear()
             self.current_theme_data.clear()
-            self._update_layer_tree()
-            self._update_code_output()
+            self._on_theme_changed()
             self.canvas.update()
             logger.info("New project created")
     
     def _open_project(self):
         """Open project file."""
         file_path, _ = QFileDialog.getOpenFileName(
-            self, "Open Project", "", "Selene Theme Files (*.stheme);;JSON Files (*.json)"
+            self, "Open Project", "", "Selene Theme Files (*.stheme);;Packed Theme Files (*.sthemeb);;JSON Files (*.json)"
         )
         
         if file_path:
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                
-                self.current_theme_data = data.get('theme', {})
-                # TODO: Load layers from data
-                
-                self._update_code_output()
-                logger.info(f"Project loaded from {file_path}")
-                
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to load project: {str(e)}")
-                logger.error(f"Failed to load project: {e}")
+            # Layers stream in from a worker thread; see the _on_project_* handlers
+            self.current_theme_data = {}
+            self.load_progress.setValue(0)
+            self.load_progress.show()
+            # The loaded document is snapshotted once instead of journaled layer by layer
+            self.autosave.suspend()
+            self.project_loader.load(file_path)
+    
+    def _on_project_theme_loaded(self, theme: Dict[str, Any]):
+        self.current_theme_data = theme
+        self._on_theme_changed()
+    
+    def _on_project_loaded(self, file_path: str, layer_count: int):
+        self.load_progress.hide()
+        self.autosave.resume()
+        self.history.clear()
+    
+    def _on_project_load_failed(self, file_path: str, message: str):
+        self.load_progress.hide()
+        self.autosave.resume()
+        self.history.clear()
+        QMessageBox.critical(self, "Error", f"Failed to load project: {message}")
     
     def _save_project(self):
         """Save project file."""
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "Save Project", "", "Selene Theme Files (*.stheme);;JSON Files (*.json)"
+            self, "Save Project", "", "Selene Theme Files (*.stheme);;Packed Theme Files (*.sthemeb);;JSON Files (*.json)"
         )
         
         if file_path:
-            try:
-                project_data = {
-                    'version': '1.0',
-                    'theme': self.current_theme_data,
-                    'layers': [asdict(layer) for layer in self.layer_manager.layers]
-                }
-                
-                with open(file_path, 'w') as f:
-                    json.dump(project_data, f, indent=2, default=str)
-                
-                logger.info(f"Project saved to {file_path}")
-                
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to save project: {str(e)}")
-                logger.error(f"Failed to save project: {e}")
+            # Serialize on the writer thread from values copied here, so edits
+            # made while it writes cannot reach the file
+            theme = AutosaveJournal._copy_theme(self.current_theme_data)
+            columns = LayerStore.fields_of(self.layer_manager.layers)
+            self.writer.submit(lambda: ProjectSerializer.save_columns(file_path, theme, columns), file_path)
+    
+    def _on_write_finished(self, file_path: str, error: str):
+        """Report the outcome of a background project save."""
+        if error:
+            QMessageBox.critical(self, "Error", f"Failed to save project: {error}")
+        else:
+            logger.info(f"Project saved to {file_path}")
     
     def _export_theme(self):
         """Export theme in various formats."""
@@ -1189,14 +5802,15 @@ class AdvancedThemeStyler(QWidget):
         if file_path:
             try:
                 if file_type == "Python Files (*.py)":
-                    content = ThemeExporter.export_to_python(self.current_theme_data)
+                    writer = ThemeExporter.write_python
                 elif file_type == "CSS Files (*.css)":
-                    content = ThemeExporter.export_to_css(self.current_theme_data)
+                    writer = ThemeExporter.write_css
                 else:  # JSON
-                    content = ThemeExporter.export_to_json(self.current_theme_data)
+                    writer = ThemeExporter.write_json
                 
+                theme = ThemeExporter.compile(self.current_theme_data)
                 with open(file_path, 'w') as f:
-                    f.write(content)
+                    writer(theme, f)
                 
                 logger.info(f"Theme exported to {file_path}")
                 
@@ -1204,41 +5818,132 @@ class AdvancedThemeStyler(QWidget):
                 QMessageBox.critical(self, "Error", f"Failed to export theme: {str(e)}")
                 logger.error(f"Failed to export theme: {e}")
     
+    def _update_history_buttons(self):
+        self.undo_btn.setEnabled(self.history.can_undo())
+        self.redo_btn.setEnabled(self.history.can_redo())
+    
+    def _move_selected_layers(self, step: int):
+        """Shift the selected layers one place up (-1) or down (1) the layer list."""
+        selected = sorted(self.layer_manager.selected_layers, reverse=step > 0)
+        # A layer at the edge, or stuck behind one that is, stays put
+        limit = -1 if step < 0 else len(self.layer_manager.layers)
+        with self.layer_manager.transaction():
+            for index in selected:
+                if index + step == limit:
+                    limit = index
+                else:
+                    self.layer_manager.move_layer(index, index + step)
+    
+    def _set_blend_mode(self, index: int):
+        """Apply the chosen blend mode to the selected layers as one undo step."""
+        blend_mode = LayerStore.BLEND_MODES[index]
+        with self.layer_manager.transaction():
+            for layer_index in self.layer_manager.selected_layers:
+                self.layer_manager.edit_layer(layer_index, blend_mode=blend_mode)
+    
+    def _show_blend_mode(self):
+        """Show the blend mode of the first selected layer."""
+        selected = self.layer_manager.selected_layers
+        if selected:
+            self.blend_mode.blockSignals(True)
+            self.blend_mode.setCurrentIndex(LayerStore.BLEND_MODE_INDEX[self.layer_manager.layers[selected[0]].blend_mode])
+            self.blend_mode.blockSignals(False)
+    
+    def _panel_effects(self) -> TextEffectData:
+        """Glow and shadow settings shown in the Effects panel."""
+        return TextEffectData(
+            glow_enabled=self.glow_enabled.isChecked(),
+            glow_color=QColor(self.glow_color),
+            glow_radius=self.glow_radius.value(),
+            shadow_enabled=self.shadow_enabled.isChecked(),
+            shadow_color=QColor(TextEffectData.DEFAULT_SHADOW_COLOR),
+            shadow_offset=QPointF(self.shadow_x.value(), self.shadow_y.value()),
+            shadow_blur=float(self.shadow_blur.value()),
+            outline_enabled=False,
+            outline_color=QColor(Qt.GlobalColor.black),
+            outline_width=1.0,
+        )
+    
+    def _apply_effects(self, live: bool = False):
+        """Store the panel's glow and shadow on the selected layers.
+        
+        Toggles and color picks are one sealed undo step. Live edits go
+        through edit_layer outside a transaction, so EditHistory coalesces
+        a whole slider drag into one step until the control is released.
+        """
+        if live:
+            self._store_effects()
+            return
+        with self.layer_manager.transaction():
+            self._store_effects()
+    
+    def _store_effects(self):
+        for index in self.layer_manager.selected_layers:
+            layer = self.layer_manager.layers[index]
+            panel = self._panel_effects()
+            current = layer.effects()
+            if current is not None:
+                # Settings the panel has no controls for are kept
+                panel.shadow_color = current.shadow_color
+                panel.outline_enabled = current.outline_enabled
+                panel.outline_color = current.outline_color
+                panel.outline_width = current.outline_width
+            properties = dict(layer.custom_properties)
+            properties['effects'] = panel.to_properties()
+            if not properties['effects']:
+                del properties['effects']
+            self.layer_manager.edit_layer(index, custom_properties=properties)
+    
+    def _show_effects(self):
+        """Show the glow and shadow of the first selected layer."""
+        selected = self.layer_manager.selected_layers
+        if not selected:
+            return
+        effects = self.layer_manager.layers[selected[0]].effects()
+        if effects is None:
+            effects = TextEffectData.from_properties({})
+        controls = (self.glow_enabled, self.glow_radius, self.shadow_enabled,
+                    self.shadow_x, self.shadow_y, self.shadow_blur)
+        for control in controls:
+            control.blockSignals(True)
+        self.glow_enabled.setChecked(effects.glow_enabled)
+        self.glow_radius.setValue(effects.glow_radius)
+        self.shadow_enabled.setChecked(effects.shadow_enabled)
+        self.shadow_x.setValue(round(effects.shadow_offset.x()))
+        self.shadow_y.setValue(round(effects.shadow_offset.y()))
+        self.shadow_blur.setValue(round(effects.shadow_blur))
+        for control in controls:
+            control.blockSignals(False)
+        self.glow_color = effects.glow_color
+        self.glow_color_btn.setStyleSheet(f"background-color: {effects.glow_color.name()}; border: 1px solid #333;")
+    
+    def _toggle_animations(self):
+        """Play the animations stored on the selected layers (or all layers), or stop playback."""
+        animations = self.canvas.animations
+        if animations.active:
+            animations.stop()
+            logger.info(f"Animation playback stopped: {animations.stats()}")
+        else:
+            started = animations.play(self.layer_manager.selected_layers or None)
+            logger.info(f"Playing {started} animations")
+    
     def _toggle_grid(self, enabled: bool):
         """Toggle grid display."""
         self.canvas.grid_enabled = enabled
         self.canvas.update()
     
-    def _update_layer_tree(self):
-        """Update layer tree widget."""
-        self.layer_tree.clear()
-        
-        for i, layer in enumerate(self.layer_manager.layers):
-            item = QTreeWidgetItem()
-            item.setText(0, layer.name)
-            item.setCheckState(1, Qt.CheckState.Checked if layer.visible else Qt.CheckState.Unchecked)
-            item.setCheckState(2, Qt.CheckState.Checked if layer.locked else Qt.CheckState.Unchecked)
-            item.setData(0, Qt.ItemDataRole.UserRole, i)
-            
-            self.layer_tree.addTopLevelItem(item)
+    def _on_theme_changed(self):
+        """Journal and regenerate code after current_theme_data changed."""
+        self.autosave.record_theme(self.current_theme_data)
+        self.code_generator.set_theme(self.current_theme_data)
     
     def _update_code_output(self):
         """Update code output based on current format."""
-        format_type = self.code_format.currentText()
-        
-        try:
-            if format_type == "Python":
-                code = ThemeExporter.export_to_python(self.current_theme_data)
-            elif format_type == "CSS":
-                code = ThemeExporter.export_to_css(self.current_theme_data)
-            else:  # JSON
-                code = ThemeExporter.export_to_json(self.current_theme_data)
-            
-            self.code_display.setPlainText(code)
-            
-        except Exception as e:
-            self.code_display.setPlainText(f"Error generating code: {str(e)}")
-            logger.error(f"Code generation error: {e}")
+        self.code_generator.request(self.code_format.currentText())
+    
+    def _on_code_ready(self, format_type: str, code: str):
+        if format_type == self.code_format.currentText():
+            replace_text_incrementally(self.code_display, code)
     
     def _copy_code(self):
         """Copy code to clipboard."""
@@ -1251,14 +5956,14 @@ class AdvancedThemeStyler(QWidget):
         self.restoreGeometry(self.settings.value("geometry", b""))
         
         # Load custom font paths
-        font_paths = self.settings.value("custom_font_paths", [])
+        font_paths = self.settings.value("custom_font_paths", []) or []
         if isinstance(font_paths, str):
             font_paths = [font_paths]
         
         for path in font_paths:
             if os.path.exists(path):
                 self.custom_font_paths.append(path)
-                self._load_fonts_from_directory(path)
+        self.font_loader.scan(self.custom_font_paths)
     
     def _save_settings(self):
         """Save application settings."""
@@ -1268,10 +5973,580 @@ class AdvancedThemeStyler(QWidget):
     def closeEvent(self, event):
         """Handle application close."""
         self._save_settings()
+        self.project_loader.cancel()
+        self.autosave.close()
+        self.writer.stop()
+        self.font_loader.stop()
         event.accept()
 
-def main():
+PROJECT_EXTENSIONS = ('.stheme', '.sthemeb', '.json')
+
+def ensure_headless_app() -> QGuiApplication:
+    """Create a GUI application on the offscreen platform if none exists."""
+    app = QGuiApplication.instance()
+    if app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QGuiApplication([sys.argv[0]])
+    return app
+
+def collect_project_files(inputs: List[str], exclude: Sequence[str] = ()) -> List[Tuple[str, str]]:
+    """Expand files and directory trees into (path, path relative to its input root) pairs.
+    
+    Paths in exclude, files or whole directories, are skipped, so a command
+    whose output lands inside its inputs never reads its own results back.
+    """
+    excluded = {os.path.realpath(path) for path in exclude}
+    files = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, dirs, names in os.walk(entry):
+                dirs[:] = sorted(name for name in dirs if os.path.realpath(os.path.join(root, name)) not in excluded)
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    if name.lower().endswith(PROJECT_EXTENSIONS) and os.path.realpath(path) not in excluded:
+                        files.append((path, os.path.relpath(path, entry)))
+        elif os.path.isfile(entry):
+            files.append((entry, os.path.basename(entry)))
+        else:
+            logger.warning("No such file or directory: %s", entry)
+    return files
+
+def render_layers_image(layers: List[ShapeData], width: int, height: int, scale: float = 1.0,
+                        background: Optional[QColor] = None, origin: Optional[QPointF] = None,
+                        renderer: Optional[ShapeRenderer] = None,
+                        compositor: Optional[LayerCompositor] = None) -> QImage:
+    """Render layers in z-order onto an offscreen image using the canvas drawing code.
+    
+    With a compositor, layers are blended by its NumPy path instead of QPainter.
+    """
+    if compositor is not None:
+        return compositor.render(sorted(layers, key=lambda layer: layer.z_index),
+                                 width, height, scale, background, origin)
+    image = QImage(max(1, round(width * scale)), max(1, round(height * scale)),
+                   QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(background if background is not None else Qt.GlobalColor.transparent)
+    
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    painter.scale(scale, scale)
+    if origin is not None:
+        painter.translate(-origin)
+    if renderer is None:
+        # One-shot renders rarely repeat a shape, so caching rasters only costs time
+        renderer = ShapeRenderer()
+        renderer.raster_cache_enabled = False
+    renderer.render_layers(painter, sorted(layers, key=lambda layer: layer.z_index), scale)
+    painter.end()
+    return image
+
+def _render_project_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Render one project file to PNG; runs in a worker process."""
+    ensure_headless_app()
+    started = time.perf_counter()
+    result = {'input': task['input'], 'output': task['output'], 'layers': 0, 'error': None}
+    try:
+        theme, layers = ProjectSerializer.load(task['input'])
+        result['layers'] = len(layers)
+        
+        origin = QPointF(0, 0)
+        width, height = task['width'], task['height']
+        if task['fit'] and layers:
+            x0, y0, x1, y1 = LayerManager.paint_bounds(layers[0])
+            for layer in layers[1:]:
+                bx0, by0, bx1, by1 = LayerManager.paint_bounds(layer)
+                x0, y0, x1, y1 = min(x0, bx0), min(y0, by0), max(x1, bx1), max(y1, by1)
+            origin = QPointF(math.floor(x0), math.floor(y0))
+            width, height = math.ceil(x1) - origin.x(), math.ceil(y1) - origin.y()
+        
+        background = QColor(task['background']) if task['background'] != 'transparent' else None
+        compositor = LayerCompositor() if task['compositor'] == 'numpy' else None
+        image = render_layers_image(layers, width, height, task['scale'], background, origin,
+                                    compositor=compositor)
+        
+        os.makedirs(os.path.dirname(task['output']) or '.', exist_ok=True)
+        if not image.save(task['output'], 'PNG'):
+            raise OSError(f"could not write {task['output']}")
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+class APNGWriter:
+    """Streams PNG-encoded frames of equal size into an animated PNG.
+    
+    The first frame's chunks are copied as the default image; the IDAT
+    data of later frames is rewritten as fdAT chunks, so no re-encoding is
+    needed and viewers without APNG support still show the first frame.
+    """
+    
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    
+    def __init__(self, stream, frame_count: int, fps: float, loops: int = 0):
+        self.stream = stream
+        self.frame_count = frame_count
+        # Frame delay in seconds as a fraction of two 16-bit integers
+        delay = Fraction(1 / fps).limit_denominator(0xFFFF)
+        self.delay = (delay.numerator, delay.denominator)
+        self.loops = loops
+        self.frames = 0
+        self.size: Optional[Tuple[int, int]] = None
+        self._sequence = 0
+    
+    @classmethod
+    def chunks(cls, png: bytes) -> Iterator[Tuple[bytes, bytes]]:
+        """(type, data) pairs of a PNG file."""
+        if not png.startswith(cls.SIGNATURE):
+            raise ValueError("Frame is not PNG data")
+        offset = len(cls.SIGNATURE)
+        while offset < len(png):
+            length, = struct.unpack_from('>I', png, offset)
+            yield png[offset + 4:offset + 8], png[offset + 8:offset + 8 + length]
+            offset += length + 12
+    
+    def _write_chunk(self, chunk_type: bytes, data: bytes):
+        self.stream.write(struct.pack('>I', len(data)))
+        self.stream.write(chunk_type)
+        self.stream.write(data)
+        self.stream.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+    
+    def _next_sequence(self) -> bytes:
+        sequence = struct.pack('>I', self._sequence)
+        self._sequence += 1
+        return sequence
+    
+    def add_frame(self, png: bytes):
+        """Append the next frame, given as a complete PNG file."""
+        if self.frames >= self.frame_count:
+            raise ValueError("More frames than announced")
+        first = self.frames == 0
+        if first:
+            self.stream.write(self.SIGNATURE)
+        control_written = False
+        for chunk_type, data in self.chunks(png):
+            if chunk_type == b'IHDR':
+                width, height = struct.unpack_from('>II', data)
+                if first:
+                    self.size = (width, height)
+                    self._write_chunk(b'IHDR', data)
+                    self._write_chunk(b'acTL', struct.pack('>II', self.frame_count, self.loops))
+                elif (width, height) != self.size:
+                    raise ValueError("Frames differ in size")
+            elif chunk_type == b'IDAT':
+                if not control_written:
+                    self._write_chunk(b'fcTL', self._next_sequence() + struct.pack(
+                        '>IIIIHHBB', *self.size, 0, 0, *self.delay, 0, 0))
+                    control_written = True
+                if first:
+                    self._write_chunk(b'IDAT', data)
+                else:
+                    self._write_chunk(b'fdAT', self._next_sequence() + data)
+            elif first and chunk_type != b'IEND':
+                self._write_chunk(chunk_type, data)
+        self.frames += 1
+    
+    def close(self):
+        """Finish the file; every announced frame must have been added."""
+        if self.frames != self.frame_count:
+            raise ValueError(f"Expected {self.frame_count} frames, got {self.frames}")
+        self._write_chunk(b'IEND', b'')
+
+# Per-process memo of the last project loaded by animation frame tasks,
+# which each render a slice of the same timeline
+_animation_project: Dict[Tuple[str, float], Tuple[List[ShapeData], List[AnimationTrack]]] = {}
+
+def load_animation_project(path: str) -> Tuple[List[ShapeData], List[AnimationTrack]]:
+    """Layers of a project in draw order, with tracks for their stored animations starting at 0."""
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _animation_project:
+        theme, layers = ProjectSerializer.load(path)
+        layers = sorted(layers, key=lambda layer: layer.z_index)
+        _animation_project.clear()
+        _animation_project[key] = (layers, AnimationEngine.make_tracks(layers))
+    return _animation_project[key]
+
+def _render_animation_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Render a range of animation frames to PNG; runs in a worker process."""
+    ensure_headless_app()
+    started = time.perf_counter()
+    result = {'first': task['first'], 'frames': [], 'error': None}
+    try:
+        layers, tracks = load_animation_project(task['input'])
+        # Static layers repeat in every frame, so their rasters are worth caching
+        renderer = ShapeRenderer()
+        background = QColor(task['background']) if task['background'] != 'transparent' else None
+        origin = QPointF(*task['origin'])
+        for number in range(task['first'], task['last']):
+            renderer.animation_frames, _ = AnimationEngine.sample(tracks, number * 1000 / task['fps'])
+            image = render_layers_image(layers, task['width'], task['height'], task['scale'],
+                                        background, origin, renderer=renderer)
+            if task['directory'] is not None:
+                path = os.path.join(task['directory'], task['pattern'].format(number))
+                if not image.save(path, 'PNG'):
+                    raise OSError(f"could not write {path}")
+                result['frames'].append(path)
+            else:
+                buffer = QBuffer()
+                buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+                image.save(buffer, 'PNG')
+                result['frames'].append(bytes(buffer.data()))
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def run_tasks(function: Callable, tasks: List[Dict[str, Any]], jobs: int):
+    """Yield results of function over tasks, fanned out across a process pool."""
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+    # Chunk small tasks so per-task IPC does not dominate
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(function, tasks, chunksize=chunksize)
+
+def render_command(args: argparse.Namespace) -> int:
+    """Render project files or directory trees to PNG previews."""
+    if args.compositor == 'numpy' and numpy is None:
+        logger.error("--compositor numpy needs NumPy (pip install numpy)")
+        return 2
+    tasks = []
+    for path, relative in collect_project_files(args.inputs, [args.output] if args.output else ()):
+        output_root = args.output or os.path.dirname(path)
+        output_name = relative if args.output else os.path.basename(path)
+        tasks.append({
+            'input': path,
+            'output': os.path.join(output_root, os.path.splitext(output_name)[0] + '.png'),
+            'width': args.width, 'height': args.height, 'scale': args.scale,
+            'fit': args.fit, 'background': args.background, 'compositor': args.compositor,
+        })
+    if not tasks:
+        logger.error("No project files found")
+        return 1
+    
+    started = time.perf_counter()
+    failures = 0
+    for result in run_tasks(_render_project_task, tasks, args.jobs):
+        if result['error']:
+            failures += 1
+            logger.error("Failed to render %s: %s", result['input'], result['error'])
+        else:
+            logger.info("Rendered %s (%d layers) in %.2fs", result['output'], result['layers'], result['seconds'])
+    
+    elapsed = time.perf_counter() - started
+    logger.info("Rendered %d/%d projects in %.2fs (%.1f projects/s, %d jobs)",
+                len(tasks) - failures, len(tasks), elapsed, len(tasks) / elapsed if elapsed else 0.0, args.jobs)
+    return 1 if failures else 0
+
+def animate_command(args: argparse.Namespace) -> int:
+    """Render a project's animation timeline to a PNG sequence or an animated PNG."""
+    if args.fps <= 0:
+        logger.error("--fps must be positive")
+        return 2
+    try:
+        layers, tracks = load_animation_project(args.input)
+    except Exception as e:
+        logger.error("Failed to load %s: %s", args.input, e)
+        return 1
+    if not tracks:
+        logger.error("%s has no animated layers", args.input)
+        return 1
+    
+    duration_ms = args.duration * 1000 if args.duration else AnimationEngine.timeline_ms(tracks)
+    frame_count = max(1, math.ceil(duration_ms * args.fps / 1000))
+    origin = QPointF(0, 0)
+    width, height = args.width, args.height
+    if args.fit:
+        # Cover every layer where it rests and wherever its animation takes it
+        rect = QRectF()
+        for layer in layers:
+            x0, y0, x1, y1 = LayerManager.paint_bounds(layer)
+            rect = rect.united(QRectF(x0, y0, x1 - x0, y1 - y0))
+        for number in range(frame_count):
+            frames, _ = AnimationEngine.sample(tracks, number * 1000 / args.fps)
+            for frame in frames.values():
+                rect = rect.united(frame.rect)
+        origin = QPointF(math.floor(rect.left()), math.floor(rect.top()))
+        width, height = math.ceil(rect.right()) - origin.x(), math.ceil(rect.bottom()) - origin.y()
+    
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+    directory = None
+    if args.format == 'sequence':
+        directory = args.output or os.path.join(os.path.dirname(args.input), stem + '_frames')
+        os.makedirs(directory, exist_ok=True)
+    output = args.output or os.path.join(os.path.dirname(args.input), stem + '.apng')
+    pattern = f"{stem}_{{:0{max(4, len(str(frame_count - 1)))}d}}.png"
+    
+    # Contiguous slices keep each worker's raster cache warm between frames
+    slices = max(1, min(frame_count, args.jobs * 4))
+    bounds = [frame_count * i // slices for i in range(slices + 1)]
+    tasks = [{
+        'input': args.input, 'first': first, 'last': last, 'fps': args.fps,
+        'width': width, 'height': height, 'scale': args.scale, 'origin': (origin.x(), origin.y()),
+        'background': args.background, 'directory': directory, 'pattern': pattern,
+    } for first, last in zip(bounds, bounds[1:]) if last > first]
+    
+    logger.info("Rendering %d frames at %g fps (%.2fs of animation, %dx%d px)", frame_count, args.fps,
+                duration_ms / 1000, round(width * args.scale), round(height * args.scale))
+    started = time.perf_counter()
+    writer = None
+    stream = None
+    try:
+        if directory is None:
+            os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+            stream = open(output, 'wb')
+            writer = APNGWriter(stream, frame_count, args.fps)
+        for result in run_tasks(_render_animation_task, tasks, args.jobs):
+            if result['error']:
+                logger.error("Failed to render frames from %d: %s", result['first'], result['error'])
+                return 1
+            if writer is not None:
+                for png in result['frames']:
+                    writer.add_frame(png)
+            logger.info("Rendered frames %d-%d in %.2fs", result['first'],
+                        result['first'] + len(result['frames']) - 1, result['seconds'])
+        if writer is not None:
+            writer.close()
+    finally:
+        if stream is not None:
+            stream.close()
+    
+    elapsed = time.perf_counter() - started
+    logger.info("Wrote %d frames to %s in %.2fs (%.1f frames/s, %d jobs)", frame_count,
+                directory or output, elapsed, frame_count / elapsed if elapsed else 0.0, args.jobs)
+    return 0
+
+def blend_benchmark_command(args: argparse.Namespace) -> int:
+    """Time every blend mode through the QPainter and NumPy compositing paths."""
+    if numpy is None:
+        logger.error("The blend benchmark needs NumPy (pip install numpy)")
+        return 2
+    ensure_headless_app()
+    width, height = args.width, args.height
+    rng = random.Random(0)
+    # Large translucent rectangles and ellipses, overlapping across the frame
+    boxes = []
+    for _ in range(args.layers):
+        w, h = rng.uniform(0.4, 0.8) * width, rng.uniform(0.4, 0.8) * height
+        boxes.append((rng.uniform(0, width - w), rng.uniform(0, height - h), w, h,
+                      QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(128, 256))))
+    pixels = sum(w * h for _, _, w, h, _ in boxes)
+    background = QColor(255, 255, 255)
+    compositor = LayerCompositor()
+    
+    logger.info("Blending %d layers at %dx%d (%.1f Mpx per frame)", args.layers, width, height, pixels / 1e6)
+    for mode in BlendMode:
+        layers = [
+            ShapeData(
+                shape_type=ShapeType.ELLIPSE if i % 2 else ShapeType.RECTANGLE,
+                position=QPointF(x, y), size=QSizeF(w, h), rotation=0.0,
+                fill_color=color, stroke_color=color.darker(), stroke_width=4.0, gradient=None,
+                opacity=1.0, blend_mode=mode, z_index=i, visible=True, locked=False,
+                name=f"Layer {i + 1}", custom_properties={}
+            )
+            for i, (x, y, w, h, color) in enumerate(boxes)
+        ]
+        timings = []
+        for path in (None, compositor):
+            started = time.perf_counter()
+            render_layers_image(layers, width, height, background=background, compositor=path)
+            timings.append(time.perf_counter() - started)
+        logger.info("%-11s QPainter %7.1f ms (%5.2f ns/px)   NumPy %7.1f ms (%5.2f ns/px)",
+                    mode.name.lower(), timings[0] * 1000, timings[0] / pixels * 1e9,
+                    timings[1] * 1000, timings[1] / pixels * 1e9)
+    return 0
+
+EXPORT_FORMATS = {
+    'python': ('.py', ThemeExporter.write_python),
+    'css': ('.css', ThemeExporter.write_css),
+    'json': ('.json', ThemeExporter.write_json),
+}
+
+def load_theme_data(file_path: str) -> Dict[str, Any]:
+    """Read theme data from a project file or a bare exported theme JSON file."""
+    if PackedProject.is_packed(file_path):
+        theme, layers = PackedProject.open(file_path)
+        layers.close()
+        return theme
+    with open(file_path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and 'theme' in data and 'version' in data:
+        return data['theme']
+    return data
+
+def _export_theme_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Write every requested format for one theme file; runs in a worker process."""
+    result = {'input': task['input'], 'relative': task['relative'], 'hash': task['hash'], 'error': None}
+    try:
+        # Decoded straight from the file, so it needs no defensive copy
+        theme = ThemeIR.build(load_theme_data(task['input']), task['hash'])
+        base = os.path.join(task['output'], os.path.splitext(task['relative'])[0])
+        os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+        errors = []
+        # A section only one backend reads must not stop the other formats
+        for format_name in task['formats']:
+            extension, writer = EXPORT_FORMATS[format_name]
+            try:
+                with open(base + extension, 'w') as f:
+                    writer(theme, f)
+            except ValueError as e:
+                os.remove(base + extension)
+                errors.append(f"{format_name}: {e}")
+        result['error'] = '; '.join(errors) or None
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+class ExportManifest:
+    """Content hashes of a previous batch export, used to skip unchanged inputs.
+    
+    Entries are keyed by absolute input path, since paths relative to their
+    input root collide when several roots hold files of the same name.
+    """
+    
+    VERSION = 2
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION and data.get('exporter') == ThemeExporter.VERSION:
+                self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+    
+    def is_current(self, path: str, relative: str, content_hash: str, formats: List[str], output_dir: str) -> bool:
+        """True if the input is unchanged and all requested outputs already exist."""
+        entry = self.entries.get(os.path.abspath(path))
+        if (not entry or entry['hash'] != content_hash or entry['relative'] != relative
+                or not set(formats) <= set(entry['formats'])):
+            return False
+        base = os.path.join(output_dir, os.path.splitext(relative)[0])
+        return all(os.path.exists(base + EXPORT_FORMATS[name][0]) for name in formats)
+    
+    def record(self, path: str, relative: str, content_hash: str, formats: List[str]):
+        self.entries[os.path.abspath(path)] = {'relative': relative, 'hash': content_hash, 'formats': sorted(formats)}
+    
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'exporter': ThemeExporter.VERSION, 'files': self.entries}, f)
+        os.replace(temp_path, self.path)
+
+def export_command(args: argparse.Namespace) -> int:
+    """Export a tree of theme files to every requested format, skipping unchanged inputs."""
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in EXPORT_FORMATS]
+    if unknown or not formats:
+        logger.error("Unknown export format(s): %s (choose from %s)", ', '.join(unknown), ', '.join(EXPORT_FORMATS))
+        return 2
+    
+    started = time.perf_counter()
+    manifest = ExportManifest(args.manifest or os.path.join(args.output, '.stylizer-manifest.json'))
+    files = collect_project_files(args.inputs, [args.output, manifest.path])
+    
+    sources: Dict[str, str] = {}
+    for path, relative in files:
+        if sources.setdefault(relative, path) != path:
+            logger.warning("%s and %s both export to %s", sources[relative], path, relative)
+    
+    tasks = []
+    for path, relative in files:
+        with open(path, 'rb') as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        if not args.force and manifest.is_current(path, relative, content_hash, formats, args.output):
+            continue
+        tasks.append({'input': path, 'relative': relative, 'hash': content_hash,
+                      'output': args.output, 'formats': formats})
+    
+    failures = 0
+    for result in run_tasks(_export_theme_task, tasks, args.jobs):
+        if result['error']:
+            failures += 1
+            logger.error("Failed to export %s: %s", result['input'], result['error'])
+        else:
+            manifest.record(result['input'], result['relative'], result['hash'], formats)
+    
+    # Forget inputs that no longer exist
+    present = {os.path.abspath(path) for path, _ in files}
+    for path in [path for path in manifest.entries if path not in present]:
+        del manifest.entries[path]
+    manifest.save()
+    
+    elapsed = time.perf_counter() - started
+    logger.info("Exported %d themes, %d unchanged, %d failed in %.2fs (%d jobs)",
+                len(tasks) - failures, len(files) - len(tasks), failures, elapsed, args.jobs)
+    return 1 if failures else 0
+
+def build_cli_parser() -> argparse.ArgumentParser:
+    """Command line interface for headless operation."""
+    parser = argparse.ArgumentParser(prog="selene_theme_stylizer", description=WINDOW_TITLE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    render = commands.add_parser("render", help="render .stheme projects to PNG without the GUI")
+    render.add_argument("inputs", nargs="+", help="project files or directories to search recursively")
+    render.add_argument("-o", "--output", help="output directory (default: next to each input)")
+    render.add_argument("--width", type=int, default=CANVAS_WIDTH, help="image width in document units")
+    render.add_argument("--height", type=int, default=CANVAS_HEIGHT, help="image height in document units")
+    render.add_argument("--scale", type=float, default=1.0, help="pixels per document unit")
+    render.add_argument("--fit", action="store_true", help="crop to the bounds of the layers")
+    render.add_argument("--background", default="#ffffff", help="background color or 'transparent'")
+    render.add_argument("--compositor", choices=("qpainter", "numpy"), default="qpainter",
+                        help="blend layers with QPainter or with NumPy (default: %(default)s)")
+    render.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    render.set_defaults(handler=render_command)
+    
+    export = commands.add_parser("export", help="batch export theme files to Python/CSS/JSON")
+    export.add_argument("inputs", nargs="+", help="theme files or directories to search recursively")
+    export.add_argument("-o", "--output", required=True, help="output directory (mirrors the input tree)")
+    export.add_argument("-f", "--formats", default=",".join(EXPORT_FORMATS),
+                        help="comma-separated formats (default: %(default)s)")
+    export.add_argument("--manifest", help="manifest path (default: OUTPUT/.stylizer-manifest.json)")
+    export.add_argument("--force", action="store_true", help="ignore the manifest and export everything")
+    export.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    export.set_defaults(handler=export_command)
+    
+    animate = commands.add_parser("animate", help="render a project's animations to PNG frames or an animated PNG")
+    animate.add_argument("input", help="project file with animated layers")
+    animate.add_argument("-o", "--output",
+                         help="frame directory or .apng file (default: INPUT_frames/ or INPUT.apng)")
+    animate.add_argument("--format", choices=("sequence", "apng"), default="sequence",
+                         help="numbered PNG files or one animated PNG (default: %(default)s)")
+    animate.add_argument("--fps", type=float, default=30.0, help="frames per second")
+    animate.add_argument("--duration", type=float,
+                         help="seconds to render (default: until the last finite animation ends)")
+    animate.add_argument("--width", type=int, default=CANVAS_WIDTH, help="frame width in document units")
+    animate.add_argument("--height", type=int, default=CANVAS_HEIGHT, help="frame height in document units")
+    animate.add_argument("--scale", type=float, default=1.0, help="pixels per document unit")
+    animate.add_argument("--fit", action="store_true", help="crop to the area the layers cover while animating")
+    animate.add_argument("--background", default="#ffffff", help="background color or 'transparent'")
+    animate.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    animate.set_defaults(handler=animate_command)
+    
+    benchmark = commands.add_parser("blend-benchmark", help="compare QPainter and NumPy blend mode compositing")
+    benchmark.add_argument("--width", type=int, default=3840, help="output width in pixels")
+    benchmark.add_argument("--height", type=int, default=2160, help="output height in pixels")
+    benchmark.add_argument("--layers", type=int, default=8, help="overlapping layers per frame")
+    benchmark.set_defaults(handler=blend_benchmark_command)
+    
+    return parser
+
+CLI_COMMANDS = ("render", "export", "animate", "blend-benchmark")
+
+def run_cli(argv: List[str]) -> int:
+    """Run a headless command."""
+    args = build_cli_parser().parse_args(argv)
+    return args.handler(args)
+
+def main(argv: Optional[List[str]] = None):
     """Main application entry point."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in CLI_COMMANDS + ("-h", "--help"):
+        return run_cli(argv)
+    
     app = QApplication(sys.argv)
     app.setApplicationName("Selene Theme Stylizer Pro")
     app.setApplicationVersion("2.0.0")
@@ -0,0 +1,31 @@
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt6.QtCore import QPointF, QSizeF
+from PyQt6.QtGui import QColor
+from PyQt6.QtWidgets import QApplication
+
+import selene_theme_stylizer as stylizer
+
+
+@pytest.fixture(scope="session", autouse=True)
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def make_shape():
+    def make(x=0.0, y=0.0, width=30.0, height=20.0, z_index=0, **fields):
+        values = dict(
+            shape_type=stylizer.ShapeType.RECTANGLE, position=QPointF(x, y), size=QSizeF(width, height),
+            rotation=0.0, fill_color=QColor(10, 20, 30, 200), stroke_color=QColor(1, 2, 3),
+            stroke_width=2.0, gradient=None, opacity=1.0, blend_mode=stylizer.BlendMode.NORMAL,
+            z_index=z_index, visible=True, locked=False, name="Shape", custom_properties={},
+        )
+        values.update(fields)
+        return stylizer.ShapeData(**values)
+    return make
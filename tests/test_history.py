@@ -0,0 +1,98 @@
+import random
+
+import pytest
+from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QColor
+
+import selene_theme_stylizer as stylizer
+
+
+def document_state(layer_manager):
+    layers = [stylizer.ProjectSerializer.shape_to_dict(layer) for layer in layer_manager.layers]
+    draw_order = [layer_manager.layers.index(layer) for layer in layer_manager.draw_order]
+    return layers, draw_order
+
+
+def test_random_edits_replay_backwards_and_forwards(make_shape):
+    layer_manager = stylizer.LayerManager()
+    history = stylizer.EditHistory(layer_manager)
+    rng = random.Random(1)
+    snapshots = [document_state(layer_manager)]
+    # Whole-number positions keep undone translations exact
+    for _ in range(300):
+        count = len(layer_manager.layers)
+        roll = rng.random()
+        if roll < 0.3 or count < 3:
+            layer_manager.add_layer(make_shape(rng.randrange(500), rng.randrange(500), z_index=rng.randint(0, 9)))
+        elif roll < 0.4:
+            layer_manager.insert_layer(rng.randrange(count), make_shape(1, 1, 5, 5, z_index=rng.randint(0, 9)))
+        elif roll < 0.5:
+            layer_manager.remove_layer(rng.randrange(count))
+        elif roll < 0.6:
+            layer_manager.move_layer(rng.randrange(count), rng.randrange(count))
+        elif roll < 0.7:
+            layer_manager.set_layer_z_index(rng.randrange(count), rng.randint(0, 9))
+        elif roll < 0.72:
+            layer_manager.clear()
+        elif roll < 0.8:
+            layer_manager.translate_layers(rng.sample(range(count), 2), 3.0, -2.0)
+        else:
+            layer_manager.edit_layer(rng.randrange(count), position=QPointF(rng.randrange(500), 3),
+                                     fill_color=QColor(rng.randrange(255), 0, 0))
+        history.seal()
+        if history.stats()['undo_steps'] == len(snapshots):
+            snapshots.append(document_state(layer_manager))
+        else:
+            snapshots[-1] = document_state(layer_manager)
+
+    steps = history.stats()['undo_steps']
+    assert steps > 200
+    for i in range(steps):
+        assert history.undo()
+        assert document_state(layer_manager) == snapshots[-2 - i]
+    for i in range(steps):
+        assert history.redo()
+        assert document_state(layer_manager) == snapshots[len(snapshots) - steps + i]
+
+
+def test_field_edits_coalesce_until_sealed(make_shape):
+    layer_manager = stylizer.LayerManager()
+    history = stylizer.EditHistory(layer_manager)
+    layer_manager.add_layer(make_shape())
+    history.clear()
+    for x in range(1, 21):
+        layer_manager.edit_layer(0, position=QPointF(x, 0))
+    history.seal()
+    layer_manager.edit_layer(0, position=QPointF(50, 0))
+    assert history.stats()['undo_steps'] == 2
+    history.undo()
+    history.undo()
+    assert layer_manager.layers[0].position == QPointF(0, 0)
+
+
+def test_move_onto_same_index_records_nothing(make_shape):
+    layer_manager = stylizer.LayerManager()
+    history = stylizer.EditHistory(layer_manager)
+    layer_manager.add_layers([make_shape(i) for i in range(3)])
+    history.clear()
+    assert not layer_manager.move_layer(1, 1)
+    assert not history.can_undo()
+
+
+def test_custom_properties_change_only_by_assignment(make_shape):
+    layer_manager = stylizer.LayerManager()
+    history = stylizer.EditHistory(layer_manager)
+    layer_manager.add_layers([make_shape(), make_shape(custom_properties={'sides': 5})])
+    history.clear()
+    shape = layer_manager.layers[0]
+    assert shape.custom_properties == {}
+    assert layer_manager.store.columns[stylizer.LayerStore.PROPERTIES][shape._row] is None
+    with pytest.raises(TypeError):
+        layer_manager.layers[1].custom_properties['sides'] = 6
+
+    properties = dict(layer_manager.layers[1].custom_properties, sides=6)
+    layer_manager.edit_layer(1, custom_properties=properties)
+    properties['sides'] = 7
+    assert layer_manager.layers[1].custom_properties == {'sides': 6}
+    history.undo()
+    assert layer_manager.layers[1].custom_properties == {'sides': 5}
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+from PyQt6.QtCore import QPointF, QSizeF
+from PyQt6.QtGui import QColor
+
+import selene_theme_stylizer as stylizer
+
+
+def detailed_shape(make_shape):
+    gradient = stylizer.GradientData(
+        stylizer.GradientType.RADIAL, QPointF(1, 2), QPointF(30, 40), 25.0, 15.0,
+        [stylizer.ColorStop(0.0, QColor(255, 0, 0, 128)), stylizer.ColorStop(1.0, QColor(0, 0, 255))],
+    )
+    # Every field differs from make_shape's defaults
+    return make_shape(
+        shape_type=stylizer.ShapeType.STAR, position=QPointF(12.5, -7.25), size=QSizeF(44.0, 33.5),
+        rotation=33.0, fill_color=QColor(250, 128, 5, 77), stroke_color=QColor(9, 8, 7, 6),
+        stroke_width=3.5, gradient=gradient, opacity=0.4, blend_mode=stylizer.BlendMode.SCREEN,
+        z_index=-4, visible=False, locked=True, name="Étoile ★",
+        custom_properties={'points': 7, 'inner_ratio': 0.3, 'effects': {'glow': {'radius': 12}}},
+    )
+
+
+def field_values(shape):
+    values = {}
+    for name in stylizer.ShapeData.FIELDS:
+        value = getattr(shape, name)
+        if isinstance(value, QColor):
+            value = value.rgba()
+        elif isinstance(value, stylizer.GradientData):
+            value = value.cache_key()
+        values[name] = value
+    return values
+
+
+@pytest.mark.parametrize('extension', ['.stheme', stylizer.PackedProject.EXTENSION])
+def test_round_trip_keeps_every_field(tmp_path, make_shape, extension):
+    layer_manager = stylizer.LayerManager()
+    layer_manager.add_layers([detailed_shape(make_shape), make_shape(5, 6)])
+    theme = {'colors': {'bg': {'r': 1, 'g': 2, 'b': 3, 'a': 4}}}
+    path = str(tmp_path / ('project' + extension))
+
+    stylizer.ProjectSerializer.save(path, theme, layer_manager.layers)
+    loaded_theme, loaded = stylizer.ProjectSerializer.load(path)
+
+    assert loaded_theme == theme
+    assert [field_values(shape) for shape in loaded] == [field_values(shape) for shape in layer_manager.layers]
+
+
+def test_packed_bulk_decode_matches_indexing(tmp_path, make_shape):
+    path = str(tmp_path / ('project' + stylizer.PackedProject.EXTENSION))
+    shapes = [detailed_shape(make_shape), make_shape(5, 6), make_shape(7, 8, name="third")]
+    stylizer.PackedProject.save(path, {}, shapes)
+    _, packed = stylizer.PackedProject.open(path)
+    try:
+        assert [field_values(shape) for shape in packed.shapes(1)] == [field_values(packed[i]) for i in (1, 2)]
+    finally:
+        packed.close()
+
+
+def test_autosave_replay_stops_at_torn_line(tmp_path, make_shape):
+    directory = str(tmp_path / 'autosave')
+    layer_manager = stylizer.LayerManager()
+    writer = stylizer.BackgroundWriter()
+    journal = stylizer.AutosaveJournal(layer_manager, writer, directory)
+    assert journal.open() is None
+    journal.start({})
+    layer_manager.add_layers([make_shape(i * 10) for i in range(5)])
+    layer_manager.move_layer(0, 3)
+    layer_manager.translate_layers([1, 2], 4.0, 5.0)
+    layer_manager.edit_layer(4, name="renamed", rotation=90.0)
+    with layer_manager.transaction():
+        layer_manager.remove_layer(2)
+        layer_manager.set_layer_z_index(0, 3)
+    expected = [field_values(shape) for shape in layer_manager.layers]
+    writer.stop()
+
+    # A crash in the middle of writing an entry leaves a partial last line
+    journal_path = os.path.join(directory, f"journal-{journal.generation}.jsonl")
+    with open(journal_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'op': 'remove', 'index': 0})[:12])
+    journal._lock.unlock()
+
+    recovering = stylizer.AutosaveJournal(stylizer.LayerManager(), stylizer.BackgroundWriter(), directory)
+    recovered = recovering.open()
+    assert recovered is not None
+    _, layers = recovered
+    assert [field_values(shape) for shape in layers] == expected
+    recovering._lock.unlock()